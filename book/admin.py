@@ -1,6 +1,18 @@
 from django.contrib import admin
 
-from book.models import Book
+from book.models import Book, BookInventoryShard
 
 
-admin.site.register(Book)
+class BookInventoryShardInline(admin.TabularInline):
+    model = BookInventoryShard
+    extra = 0
+    readonly_fields = ("slot", "count")
+    can_delete = False
+
+
+@admin.register(Book)
+class BookAdmin(admin.ModelAdmin):
+    list_display = ("title", "author", "inventory", "shard_count")
+    readonly_fields = ("shard_count",)
+    inlines = (BookInventoryShardInline,)
+    query_budgets = {"changelist": 5}
@@ -0,0 +1,196 @@
+import csv
+import json
+import time
+from dataclasses import dataclass, field
+
+from django.db import connection, transaction
+
+from book.models import Book, BookInventoryShard
+from utils.cache import bump_version
+
+
+IMPORT_FIELDS = ("title", "author", "cover", "inventory", "daily_fee")
+IMPORT_FORMATS = ("csv", "jsonl")
+MAX_REPORTED_ERRORS = 20
+
+STAGING_TABLE = "book_import_staging"
+VALID_TABLE = "book_import_valid"
+
+# Evaluated per staging row: NULL for a valid row, the reason otherwise.
+ROW_ERROR_SQL = r"""
+    CASE
+        WHEN title IS NULL THEN 'title is required'
+        WHEN length(title) > 100 THEN 'title is longer than 100 characters'
+        WHEN author IS NULL THEN 'author is required'
+        WHEN length(author) > 100 THEN 'author is longer than 100 characters'
+        WHEN cover IS NOT NULL AND NOT cover = ANY(%(covers)s)
+            THEN 'cover is not a valid choice'
+        WHEN inventory IS NOT NULL AND inventory !~ '^-?\d{1,9}$'
+            THEN 'inventory must be an integer'
+        WHEN inventory IS NOT NULL AND inventory::integer < 0
+            THEN 'inventory must be greater than or equal to 0'
+        WHEN daily_fee IS NOT NULL AND daily_fee !~ '^\d{1,3}(\.\d{1,2})?$'
+            THEN 'daily_fee must be a decimal between 0 and 999.99'
+    END
+"""
+
+
+@dataclass
+class ImportResult:
+    received: int = 0
+    inserted: int = 0
+    updated: int = 0
+    rejected: int = 0
+    errors: list = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        if not self.seconds:
+            return 0.0
+        return self.received / self.seconds
+
+    def as_dict(self) -> dict:
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def read_rows(stream, file_format: str):
+    """Yield one tuple of IMPORT_FIELDS per record of a text stream."""
+    if file_format == "csv":
+        for record in csv.DictReader(stream):
+            yield tuple(_clean(record.get(name)) for name in IMPORT_FIELDS)
+    elif file_format == "jsonl":
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(f"Line {number} is not a JSON object.")
+            yield tuple(_clean(record.get(name)) for name in IMPORT_FIELDS)
+    else:
+        raise ValueError(f"Unsupported import format: {file_format}")
+
+
+def import_books(stream, file_format: str) -> ImportResult:
+    """
+    Stream books from a CSV or JSONL text stream into the catalog.
+
+    Rows are copied into a temporary staging table with COPY FROM STDIN and
+    validated in SQL. Valid rows are merged into the catalog by
+    (title, author): existing books get their cover, inventory and daily
+    fee updated, and new books are inserted. When the same book appears
+    more than once, the last row wins.
+    """
+    result = ImportResult()
+    started = time.perf_counter()
+    table = Book._meta.db_table
+    params = {
+        "covers": list(Book.Cover.values),
+        "inventory": str(Book._meta.get_field("inventory").default),
+        "daily_fee": str(Book._meta.get_field("daily_fee").default),
+    }
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            CREATE TEMP TABLE {STAGING_TABLE} (
+                line bigint, title text, author text, cover text,
+                inventory text, daily_fee text
+            ) ON COMMIT DROP
+            """
+        )
+        with cursor.copy(
+            f"COPY {STAGING_TABLE} (line, {', '.join(IMPORT_FIELDS)}) FROM STDIN"
+        ) as copy:
+            for line, row in enumerate(read_rows(stream, file_format), start=1):
+                copy.write_row((line, *row))
+                result.received = line
+
+        cursor.execute(
+            f"""
+            SELECT line, error, count(*) OVER ()
+            FROM (SELECT line, {ROW_ERROR_SQL} AS error FROM {STAGING_TABLE}) rows
+            WHERE error IS NOT NULL
+            ORDER BY line
+            LIMIT {MAX_REPORTED_ERRORS}
+            """,
+            params,
+        )
+        for line, error, rejected in cursor.fetchall():
+            result.errors.append({"line": line, "error": error})
+            result.rejected = rejected
+
+        cursor.execute(
+            f"""
+            CREATE TEMP TABLE {VALID_TABLE} ON COMMIT DROP AS
+            SELECT DISTINCT ON (title, author)
+                title,
+                author,
+                cover,
+                COALESCE(inventory, %(inventory)s)::integer AS inventory,
+                COALESCE(daily_fee, %(daily_fee)s)::numeric(5, 2) AS daily_fee
+            FROM {STAGING_TABLE}
+            WHERE ({ROW_ERROR_SQL}) IS NULL
+            ORDER BY title, author, line DESC
+            """,
+            params,
+        )
+        cursor.execute(f"ANALYZE {VALID_TABLE}")
+        # The imported inventory replaces the copies held in shards.
+        cursor.execute(
+            f"""
+            UPDATE {BookInventoryShard._meta.db_table} AS shard
+            SET count = 0
+            FROM {table} AS book
+            JOIN {VALID_TABLE} AS valid
+                ON book.title = valid.title AND book.author = valid.author
+            WHERE shard.book_id = book.id AND book.shard_count > 0
+            """
+        )
+        cursor.execute(
+            f"""
+            UPDATE {table} AS book
+            SET cover = valid.cover,
+                inventory = valid.inventory,
+                daily_fee = valid.daily_fee
+            FROM {VALID_TABLE} AS valid
+            WHERE book.title = valid.title AND book.author = valid.author
+            """
+        )
+        result.updated = cursor.rowcount
+        cursor.execute(
+            f"""
+            DELETE FROM {VALID_TABLE} AS valid
+            USING {table} AS book
+            WHERE book.title = valid.title AND book.author = valid.author
+            """
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (title, author, cover, inventory, daily_fee)
+            SELECT title, author, cover, inventory, daily_fee FROM {VALID_TABLE}
+            """
+        )
+        result.inserted = cursor.rowcount
+        cursor.execute(f"DROP TABLE {STAGING_TABLE}, {VALID_TABLE}")
+
+        if result.inserted or result.updated:
+            bump_version("book", "book:titles", "book:catalog")
+
+    result.seconds = time.perf_counter() - started
+    return result
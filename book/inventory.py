@@ -0,0 +1,256 @@
+from django.db import connection, transaction
+
+from book.models import Book, BookInventoryShard
+from utils.cache import bump_version
+
+
+# Takes one copy of every requested book: from a random non-empty shard of
+# sharded books and from the book row of the others (or when the shards are
+# empty). Books whose shards were all locked by other checkouts are reported
+# as contended, so they can be retried with a blocking lock.
+RESERVE_SQL = """
+    WITH requested AS (
+        SELECT book_id FROM unnest(%(book_ids)s::bigint[]) AS r(book_id)
+        ORDER BY book_id
+    ),
+    picked AS (
+        SELECT slot.id, requested.book_id
+        FROM requested
+        CROSS JOIN LATERAL (
+            SELECT id FROM {shards}
+            WHERE book_id = requested.book_id AND count > 0
+            ORDER BY random()
+            LIMIT 1
+            FOR UPDATE {skip_locked}
+        ) AS slot
+    ),
+    from_shards AS (
+        UPDATE {shards} AS shard
+        SET count = shard.count - 1
+        FROM picked
+        WHERE shard.id = picked.id
+        RETURNING shard.book_id
+    ),
+    from_books AS (
+        UPDATE {books}
+        SET inventory = inventory - 1
+        WHERE id IN (
+            SELECT id FROM {books}
+            WHERE id = ANY(%(book_ids)s)
+                AND id NOT IN (SELECT book_id FROM from_shards)
+            ORDER BY id
+            FOR NO KEY UPDATE
+        )
+            AND inventory > 0
+        RETURNING id
+    )
+    SELECT book_id, true FROM from_shards
+    UNION ALL
+    SELECT id, true FROM from_books
+    UNION ALL
+    SELECT book_id, false FROM requested
+    WHERE book_id NOT IN (SELECT book_id FROM picked)
+        AND book_id NOT IN (SELECT id FROM from_books)
+        AND EXISTS (
+            SELECT 1 FROM {shards}
+            WHERE book_id = requested.book_id AND count > 0
+        )
+"""
+
+
+def reserve_books(book_ids: list[int]) -> list[int]:
+    """
+    Take one copy of every book in a single conditional UPDATE.
+
+    Only books in stock are decremented. Sharded books take the copy from a
+    random shard, so concurrent checkouts of a hot title don't queue on one
+    row. Book rows are locked in id order so concurrent reservations of
+    overlapping books can't deadlock, and with FOR NO KEY UPDATE so the
+    foreign key checks of other checkouts aren't blocked. Returns the ids
+    that couldn't be reserved. The caller is expected to roll the
+    transaction back when that list isn't empty.
+    """
+    book_ids = list(dict.fromkeys(book_ids))
+    reserved, contended = _reserve(book_ids, skip_locked=True)
+    if contended:
+        # Every shard with copies left was locked, wait for one of them.
+        retried, _ = _reserve(sorted(contended), skip_locked=False)
+        reserved |= retried
+
+    if reserved:
+        bump_version("book")
+    return [book_id for book_id in book_ids if book_id not in reserved]
+
+
+def _reserve(book_ids, skip_locked):
+    sql = RESERVE_SQL.format(
+        books=Book._meta.db_table,
+        shards=BookInventoryShard._meta.db_table,
+        skip_locked="SKIP LOCKED" if skip_locked else "",
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {"book_ids": book_ids})
+        rows = cursor.fetchall()
+    reserved = {book_id for book_id, taken in rows if taken}
+    contended = {book_id for book_id, taken in rows if not taken}
+    return reserved, contended - reserved
+
+
+def release_books(copies: dict[int, int]) -> None:
+    """
+    Put returned copies back in one statement.
+
+    `copies` maps book ids to the number of returned copies. Sharded books
+    get them in a random shard, the others on the book row.
+    """
+    if not copies:
+        return
+
+    books = Book._meta.db_table
+    shards = BookInventoryShard._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH returned AS (
+                SELECT * FROM unnest(%(book_ids)s::bigint[], %(copies)s::integer[])
+                    AS r(book_id, copies)
+            ),
+            picked AS (
+                SELECT DISTINCT ON (shard.book_id) shard.id, returned.copies
+                FROM {shards} AS shard
+                JOIN returned ON returned.book_id = shard.book_id
+                ORDER BY shard.book_id, random()
+            ),
+            to_shards AS (
+                UPDATE {shards} AS shard
+                SET count = shard.count + picked.copies
+                FROM picked
+                WHERE shard.id = picked.id
+                RETURNING shard.book_id
+            )
+            UPDATE {books} AS book
+            SET inventory = book.inventory + returned.copies
+            FROM returned
+            WHERE book.id = returned.book_id
+                AND book.id IN (
+                    SELECT id FROM {books}
+                    WHERE id = ANY(%(book_ids)s)
+                        AND id NOT IN (SELECT book_id FROM to_shards)
+                    ORDER BY id
+                    FOR NO KEY UPDATE
+                )
+            """,
+            {"book_ids": list(copies), "copies": list(copies.values())},
+        )
+    bump_version("book")
+
+
+def shard_inventory(book_id: int, shard_count: int, inventory: int = None) -> int:
+    """
+    Spread the inventory of a book over `shard_count` shards.
+
+    A shard count of 0 moves all copies back to the book row. When
+    `inventory` is given it replaces the current total. Returns the total.
+    """
+    with transaction.atomic():
+        book = Book.objects.select_for_update(no_key=True).get(pk=book_id)
+        shards = list(book.inventory_shards.select_for_update())
+        if inventory is None:
+            inventory = book.inventory + sum(shard.count for shard in shards)
+
+        book.inventory_shards.all().delete()
+        if shard_count:
+            per_shard, extra = divmod(inventory, shard_count)
+            BookInventoryShard.objects.bulk_create(
+                BookInventoryShard(
+                    book=book, slot=slot, count=per_shard + (slot < extra)
+                )
+                for slot in range(shard_count)
+            )
+            book.inventory = 0
+        else:
+            book.inventory = inventory
+        book.shard_count = shard_count
+        book.save(update_fields=["inventory", "shard_count"])
+
+    return inventory
+
+
+def adjust_inventory(adjustments: list[dict]) -> tuple[int, list[dict]]:
+    """
+    Apply many inventory changes in one UPDATE statement.
+
+    Every adjustment has a `book_id` and either a relative `delta` or an
+    absolute `inventory`. Rows that don't exist or would break the
+    inventory_gte_0 constraint are skipped and reported, while the rest of
+    the batch is applied. Sharded books can only be restocked with a
+    positive delta, which goes to the book row. Returns the number of
+    updated books and the failures in input order.
+    """
+    if not adjustments:
+        return 0, []
+
+    table = Book._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH changes AS (
+                SELECT *
+                FROM unnest(%s::bigint[], %s::integer[], %s::integer[])
+                    WITH ORDINALITY AS c(book_id, delta, inventory, position)
+            ),
+            updated AS (
+                UPDATE {table} AS book
+                SET inventory = COALESCE(changes.inventory,
+                                         book.inventory + changes.delta)
+                FROM changes
+                WHERE book.id = changes.book_id
+                    AND COALESCE(changes.inventory,
+                                 book.inventory + changes.delta) >= 0
+                    AND (book.shard_count = 0
+                         OR (changes.inventory IS NULL AND changes.delta >= 0))
+                RETURNING book.id
+            )
+            SELECT changes.book_id, changes.delta, changes.inventory,
+                book.id IS NOT NULL, book.inventory, book.shard_count
+            FROM changes
+            LEFT JOIN updated ON updated.id = changes.book_id
+            LEFT JOIN {table} AS book ON book.id = changes.book_id
+            WHERE updated.id IS NULL
+            ORDER BY changes.position
+            """,
+            [
+                [adjustment["book_id"] for adjustment in adjustments],
+                [adjustment.get("delta") for adjustment in adjustments],
+                [adjustment.get("inventory") for adjustment in adjustments],
+            ],
+        )
+        failures = []
+        for row in cursor.fetchall():
+            book_id, delta, inventory, exists, current, sharded = row
+            if not exists:
+                error = "Book does not exist."
+            elif sharded:
+                error = (
+                    "Inventory of a sharded book can only be increased "
+                    "with a positive delta."
+                )
+            else:
+                error = (
+                    f"Inventory can't be negative "
+                    f"(current {current}, delta {delta})."
+                )
+            failures.append(
+                {
+                    "book_id": book_id,
+                    "delta": delta,
+                    "inventory": inventory,
+                    "error": error,
+                }
+            )
+
+        updated = len(adjustments) - len(failures)
+        if updated:
+            bump_version("book")
+
+    return updated, failures
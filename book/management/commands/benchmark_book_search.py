@@ -0,0 +1,110 @@
+import statistics
+import time
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F, Max, Q
+
+from book.models import Book, SEARCH_CONFIG
+from book.sample_data import AUTHORS, WORDS
+from book.views import SEARCH_MAX_RESULTS
+
+
+DEFAULT_TERMS = ["river", "silent garden", "shevchenko", "war and peace", "zebra"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ranked full-text search with icontains scans on the book "
+        "catalog, seeding synthetic books up to --rows first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--term", action="append", dest="terms")
+        parser.add_argument(
+            "--cleanup",
+            action="store_true",
+            help="Delete the seeded books after the benchmark.",
+        )
+
+    def handle(self, *args, **options):
+        first_seeded_id = self.seed(options["rows"])
+        try:
+            self.stdout.write(
+                f"{'term':<20}{'fts ms':>10}{'icontains ms':>15}"
+                f"{'fts hits':>10}{'icontains hits':>16}"
+            )
+            for term in options["terms"] or DEFAULT_TERMS:
+                fts_ms, fts_hits = self.measure(
+                    self.fts_queryset(term), options["repeat"]
+                )
+                scan_ms, scan_hits = self.measure(
+                    self.icontains_queryset(term), options["repeat"]
+                )
+                self.stdout.write(
+                    f"{term:<20}{fts_ms:>10.1f}{scan_ms:>15.1f}"
+                    f"{fts_hits:>10}{scan_hits:>16}"
+                )
+        finally:
+            if options["cleanup"] and first_seeded_id is not None:
+                deleted, _ = Book.objects.filter(id__gte=first_seeded_id).delete()
+                self.stdout.write(f"Deleted {deleted} seeded books.")
+
+    def seed(self, rows):
+        missing = rows - Book.objects.count()
+        if missing <= 0:
+            return None
+
+        self.stdout.write(f"Seeding {missing} books...")
+        started = time.perf_counter()
+        last_id = Book.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {Book._meta.db_table}
+                    (title, author, cover, inventory, daily_fee)
+                SELECT
+                    initcap(w[1 + (i * 7) %% cardinality(w)] || ' '
+                        || w[1 + (i * 13) %% cardinality(w)] || ' '
+                        || w[1 + (i / 31) %% cardinality(w)]),
+                    a[1 + (i * 11) %% cardinality(a)] || ' '
+                        || a[1 + (i / 17) %% cardinality(a)],
+                    CASE WHEN i %% 2 = 0 THEN 'HR' ELSE 'SF' END,
+                    i %% 5,
+                    ((i %% 300) / 100.0)::numeric(5, 2)
+                FROM generate_series(1, %s) AS i,
+                    (SELECT %s::text[] AS w, %s::text[] AS a) AS pools
+                """,
+                [missing, WORDS, AUTHORS],
+            )
+            cursor.execute(f"ANALYZE {Book._meta.db_table}")
+        self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s")
+        return last_id + 1
+
+    @staticmethod
+    def fts_queryset(term):
+        query = SearchQuery(term, search_type="websearch", config=SEARCH_CONFIG)
+        return (
+            Book.objects.filter(search_vector=query)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank", "title", "id")[:SEARCH_MAX_RESULTS]
+        )
+
+    @staticmethod
+    def icontains_queryset(term):
+        return Book.objects.filter(
+            Q(title__icontains=term) | Q(author__icontains=term)
+        ).order_by("title", "id")[:SEARCH_MAX_RESULTS]
+
+    @staticmethod
+    def measure(queryset, repeat):
+        timings = []
+        hits = 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            hits = len(list(queryset.all()))
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), hits
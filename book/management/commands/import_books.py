@@ -0,0 +1,50 @@
+import csv
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from book.importer import IMPORT_FORMATS, import_books
+
+
+class Command(BaseCommand):
+    help = "Import books from a CSV or JSONL file (use '-' to read stdin)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format",
+            dest="file_format",
+            choices=IMPORT_FORMATS,
+            help="Input format. Detected from the file extension by default.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["file_format"]
+        if file_format is None:
+            suffix = Path(path).suffix.lstrip(".").lower()
+            file_format = "jsonl" if suffix in ("jsonl", "ndjson") else suffix
+        if file_format not in IMPORT_FORMATS:
+            raise CommandError("Can't detect the input format, pass --format.")
+
+        try:
+            if path == "-":
+                result = import_books(sys.stdin, file_format)
+            else:
+                with open(path, encoding="utf-8", newline="") as stream:
+                    result = import_books(stream, file_format)
+        except (OSError, ValueError, csv.Error) as error:
+            raise CommandError(f"Can't import books: {error}")
+
+        for error in result.errors:
+            self.stdout.write(
+                self.style.WARNING(f"Line {error['line']}: {error['error']}")
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Received {result.received} rows: {result.inserted} inserted, "
+                f"{result.updated} updated, {result.rejected} rejected "
+                f"in {result.seconds:.1f}s ({result.rows_per_second:.0f} rows/s)."
+            )
+        )
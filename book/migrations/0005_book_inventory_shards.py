@@ -0,0 +1,56 @@
+# Generated by Django 5.1.1 on 2026-10-16 23:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book", "0004_book_title_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="shard_count",
+            field=models.PositiveSmallIntegerField(
+                db_default=0, default=0, editable=False
+            ),
+        ),
+        migrations.CreateModel(
+            name="BookInventoryShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("slot", models.PositiveSmallIntegerField()),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="inventory_shards",
+                        to="book.book",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("book", "slot"), name="unique_book_slot"
+                    ),
+                    models.CheckConstraint(
+                        condition=models.Q(("count__gte", 0)),
+                        name="inventory_shard_count_gte_0",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -1,8 +1,31 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
-from django.db.models import Q
+from django.db.models import Case, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
 
 
+SEARCH_CONFIG = "english"
+
+
+class BookQuerySet(models.QuerySet):
+    def with_available_inventory(self):
+        """Annotate the copies held in inventory shards of sharded books."""
+        shards_total = (
+            BookInventoryShard.objects.filter(book=OuterRef("pk"))
+            .values("book")
+            .annotate(total=Sum("count"))
+            .values("total")
+        )
+        return self.annotate(
+            sharded_inventory=Case(
+                When(shard_count=0, then=Value(0)),
+                default=Coalesce(Subquery(shards_total), 0),
+            )
+        )
+
+
 class Book(models.Model):
     class Cover(models.TextChoices):
         HARD = "HR", _("Hard")
@@ -13,6 +36,27 @@ class Book(models.Model):
     cover = models.CharField(max_length=8, choices=Cover, null=True, blank=True)
     inventory = models.IntegerField(default=1)
     daily_fee = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    search_vector = models.GeneratedField(
+        expression=SearchVector("title", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("author", weight="B", config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+    shard_count = models.PositiveSmallIntegerField(
+        default=0, db_default=0, editable=False
+    )
+
+    objects = BookQuerySet.as_manager()
+
+    @property
+    def available_inventory(self) -> int:
+        """Copies on the book row plus copies in its inventory shards."""
+        if not self.shard_count:
+            return self.inventory
+        sharded = getattr(self, "sharded_inventory", None)
+        if sharded is None:
+            sharded = self.inventory_shards.aggregate(total=Sum("count"))["total"]
+        return self.inventory + (sharded or 0)
 
     def __str__(self):
         return f"{self.title} - {self.author} ({self.inventory})"
@@ -25,3 +69,26 @@ class Book(models.Model):
                 name="inventory_gte_0"
             )
         ]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="book_search_vector_idx"),
+            models.Index(fields=["title", "id"], name="book_title_id_idx"),
+        ]
+
+
+class BookInventoryShard(models.Model):
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name="inventory_shards"
+    )
+    slot = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.book_id}#{self.slot}: {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["book", "slot"], name="unique_book_slot"),
+            models.CheckConstraint(
+                condition=Q(count__gte=0), name="inventory_shard_count_gte_0"
+            ),
+        ]
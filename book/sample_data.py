@@ -0,0 +1,12 @@
+# Word lists for the synthetic books of the seeding and benchmark commands.
+
+WORDS = [
+    "history", "river", "silent", "garden", "empire", "winter", "shadow",
+    "ocean", "journey", "secret", "science", "mountain", "kingdom", "light",
+    "memory", "stone", "war", "peace", "city", "forest", "machine", "dream",
+    "island", "fire", "glass", "night", "road", "storm", "gold", "house",
+]
+AUTHORS = [
+    "Smith", "Kovalenko", "Garcia", "Muller", "Tanaka", "Rossi", "Novak",
+    "Dubois", "Jensen", "Silva", "Brown", "Shevchenko", "Lopez", "Ivanova",
+]
@@ -1,9 +1,138 @@
+from pathlib import Path
+
+from django.db import transaction
 from rest_framework import serializers
 
+from book.importer import IMPORT_FORMATS
+from book.inventory import shard_inventory
 from book.models import Book
 
 
+MAX_INVENTORY_SHARDS = 64
+
+
 class BookSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = ["id", "title", "author", "cover", "inventory", "daily_fee"]
+
+    def update(self, instance, validated_data):
+        if not instance.shard_count or "inventory" not in validated_data:
+            return super().update(instance, validated_data)
+
+        inventory = validated_data.pop("inventory")
+        with transaction.atomic():
+            instance = super().update(instance, validated_data)
+            shard_inventory(instance.id, instance.shard_count, inventory)
+        instance.inventory = 0
+        instance.sharded_inventory = inventory
+        return instance
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data["inventory"] = instance.available_inventory
+        return data
+
+
+class BookShardingSerializer(serializers.ModelSerializer):
+    shard_count = serializers.IntegerField(
+        min_value=0, max_value=MAX_INVENTORY_SHARDS
+    )
+    inventory = serializers.IntegerField(
+        source="available_inventory", read_only=True
+    )
+
+    class Meta:
+        model = Book
+        fields = ["id", "shard_count", "inventory"]
+
+    def update(self, instance, validated_data):
+        shard_count = validated_data["shard_count"]
+        inventory = shard_inventory(instance.id, shard_count)
+        instance.refresh_from_db()
+        instance.sharded_inventory = inventory - instance.inventory
+        return instance
+
+
+class BookSearchSerializer(BookSerializer):
+    rank = serializers.FloatField(read_only=True)
+    title_highlight = serializers.CharField(read_only=True)
+    author_highlight = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Book
+        fields = BookSerializer.Meta.fields + [
+            "rank",
+            "title_highlight",
+            "author_highlight",
+        ]
+
+
+class BookImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    file_format = serializers.ChoiceField(choices=IMPORT_FORMATS, required=False)
+
+    def validate(self, data):
+        if "file_format" not in data:
+            suffix = Path(data["file"].name).suffix.lstrip(".").lower()
+            if suffix in ("jsonl", "ndjson"):
+                suffix = "jsonl"
+            if suffix not in IMPORT_FORMATS:
+                raise serializers.ValidationError(
+                    {"file_format": "Can't detect the file format, please set it."}
+                )
+            data["file_format"] = suffix
+        return data
+
+
+class BookImportResultSerializer(serializers.Serializer):
+    received = serializers.IntegerField()
+    inserted = serializers.IntegerField()
+    updated = serializers.IntegerField()
+    rejected = serializers.IntegerField()
+    errors = serializers.ListField(child=serializers.DictField())
+    seconds = serializers.FloatField()
+    rows_per_second = serializers.FloatField()
+
+
+class InventoryAdjustmentSerializer(serializers.Serializer):
+    book_id = serializers.IntegerField(min_value=1)
+    delta = serializers.IntegerField(
+        required=False, min_value=-1_000_000, max_value=1_000_000
+    )
+    inventory = serializers.IntegerField(
+        required=False, min_value=0, max_value=1_000_000
+    )
+
+    def validate(self, data):
+        if ("delta" in data) == ("inventory" in data):
+            raise serializers.ValidationError(
+                "Set either delta or inventory for the book."
+            )
+        return data
+
+
+class InventoryBatchSerializer(serializers.Serializer):
+    adjustments = InventoryAdjustmentSerializer(
+        many=True, allow_empty=False, max_length=10_000
+    )
+
+    def validate_adjustments(self, adjustments):
+        book_ids = [adjustment["book_id"] for adjustment in adjustments]
+        if len(book_ids) != len(set(book_ids)):
+            raise serializers.ValidationError(
+                "Every book can be adjusted only once per batch."
+            )
+        return adjustments
+
+
+class InventoryFailureSerializer(serializers.Serializer):
+    book_id = serializers.IntegerField()
+    delta = serializers.IntegerField(allow_null=True)
+    inventory = serializers.IntegerField(allow_null=True)
+    error = serializers.CharField()
+
+
+class InventoryBatchResultSerializer(serializers.Serializer):
+    updated = serializers.IntegerField()
+    failed = InventoryFailureSerializer(many=True)
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from book.models import Book
+from utils.cache import bump_version
+
+
+# Fields that only move the stock, not the catalog snapshot.
+INVENTORY_FIELDS = {"inventory", "shard_count"}
+
+
+@receiver(post_save, sender=Book)
+def bump_catalog_version(sender, update_fields=None, **kwargs):
+    namespaces = ["book"]
+    if update_fields is None or "title" in update_fields:
+        namespaces.append("book:titles")
+    if update_fields is None or not INVENTORY_FIELDS.issuperset(update_fields):
+        namespaces.append("book:catalog")
+    bump_version(*namespaces)
+
+
+@receiver(post_delete, sender=Book)
+def bump_catalog_version_on_delete(sender, **kwargs):
+    bump_version("book", "book:titles", "book:catalog")
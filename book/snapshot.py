@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from book.models import Book
+from book.serializers import BookSerializer
+from utils.cache import get_versions
+
+
+MANIFEST_NAME = "catalog.json"
+SNAPSHOT_CHUNK_SIZE = 5000
+
+
+class _HashingWriter:
+    """File wrapper that hashes everything written through it."""
+
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+
+def snapshot_dir() -> Path:
+    return Path(settings.CATALOG_SNAPSHOT_DIR)
+
+
+def read_manifest() -> dict | None:
+    try:
+        with open(snapshot_dir() / MANIFEST_NAME, encoding="utf-8") as manifest:
+            return json.load(manifest)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_manifest(manifest: dict) -> None:
+    directory = snapshot_dir()
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, suffix=".tmp", delete=False, encoding="utf-8"
+    ) as file:
+        json.dump(manifest, file)
+    os.replace(file.name, directory / MANIFEST_NAME)
+
+
+def build_catalog_snapshot(force: bool = False) -> dict:
+    """
+    Write all books as gzip-compressed NDJSON, unless nothing has changed.
+
+    This is a full rebuild, keyed on the "book:catalog" stamp that only
+    catalog edits and imports bump. Checkouts and returns only move the
+    inventory ("book" stamp): they refresh the snapshot once it is older
+    than CATALOG_SNAPSHOT_MAX_AGE, so a busy library doesn't re-serialize
+    the catalog on every run. Repeated calls on an unchanged snapshot cost
+    one cache read. Rows are streamed from a server-side cursor without
+    model instances or serializers.
+    """
+    version, inventory_version = get_versions("book:catalog", "book")
+    manifest = read_manifest()
+    directory = snapshot_dir()
+    if (
+        not force
+        and manifest is not None
+        and manifest["version"] == version
+        and (
+            manifest.get("inventory_version") == inventory_version
+            or time.time() - manifest["generated_at"]
+            < settings.CATALOG_SNAPSHOT_MAX_AGE
+        )
+        and (directory / manifest["file"]).exists()
+    ):
+        return manifest
+
+    directory.mkdir(parents=True, exist_ok=True)
+    fields = BookSerializer.Meta.fields
+    rows = 0
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=directory, suffix=".tmp", delete=False
+    ) as file:
+        writer = _HashingWriter(file)
+        with gzip.GzipFile(fileobj=writer, mode="wb", mtime=0) as archive:
+            books = (
+                Book.objects.with_available_inventory()
+                .order_by("id")
+                .values_list(*fields, "sharded_inventory")
+                .iterator(chunk_size=SNAPSHOT_CHUNK_SIZE)
+            )
+            for *values, sharded_inventory in books:
+                record = dict(zip(fields, values))
+                record["inventory"] += sharded_inventory
+                record["daily_fee"] = str(record["daily_fee"])
+                archive.write(json.dumps(record).encode() + b"\n")
+                rows += 1
+
+    sha256 = writer.sha256.hexdigest()
+    file_name = f"catalog-{sha256[:16]}.ndjson.gz"
+    os.replace(file.name, directory / file_name)
+
+    new_manifest = {
+        "version": version,
+        "inventory_version": inventory_version,
+        "file": file_name,
+        "etag": f'"{sha256}"',
+        "rows": rows,
+        "size": (directory / file_name).stat().st_size,
+        "generated_at": int(time.time()),
+    }
+    _write_manifest(new_manifest)
+
+    # The previous file is kept for downloads that are still in flight.
+    keep = {file_name, manifest["file"] if manifest else None}
+    for path in directory.glob("catalog-*.ndjson.gz"):
+        if path.name not in keep:
+            path.unlink(missing_ok=True)
+
+    return new_manifest
@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from book.snapshot import build_catalog_snapshot
+
+
+@shared_task
+def refresh_catalog_snapshot():
+    manifest = build_catalog_snapshot()
+    return {"version": manifest["version"], "rows": manifest["rows"]}
@@ -1,14 +1,29 @@
+import gzip
+import json
+import tempfile
+import threading
+import time
+
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.urls import reverse
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from book.models import Book
+from book.inventory import release_books, reserve_books
+from book.models import Book, BookInventoryShard
 from book.serializers import BookSerializer
+from book.snapshot import build_catalog_snapshot
+from utils.cache import get_or_compute
 
 BOOK_URL = reverse("book:book-list")
+BOOK_IMPORT_URL = reverse("book:book-import-books")
+BOOK_INVENTORY_URL = reverse("book:book-adjust-inventory")
+BOOK_SNAPSHOT_URL = reverse("book:book-snapshot")
 
 
 book_payload = {
@@ -30,6 +45,10 @@ def detail_url(book_id):
     return reverse("book:book-detail", args=[book_id])
 
 
+def shards_url(book_id):
+    return reverse("book:book-shard-inventory", args=[book_id])
+
+
 class UnauthenticatedBookApiTests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -63,6 +82,188 @@ class UnauthenticatedBookApiTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+class BookSearchApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_search_books_by_title_and_author(self):
+        book_title = sample_book(title="The Silent River", author="Jane Doe")
+        book_author = sample_book(title="Other Book", author="River Phoenix")
+        sample_book(title="Mountain Garden", author="John Smith")
+
+        response = self.client.get(BOOK_URL, {"q": "river"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [book["id"] for book in response.data]
+        self.assertEqual(ids, [book_title.id, book_author.id])
+
+    def test_search_highlights_matches(self):
+        sample_book(title="The Silent River", author="Jane Doe")
+
+        response = self.client.get(BOOK_URL, {"q": "rivers"})
+
+        self.assertEqual(
+            response.data[0]["title_highlight"], "The Silent <b>River</b>"
+        )
+        self.assertEqual(response.data[0]["author_highlight"], "Jane Doe")
+        self.assertGreater(response.data[0]["rank"], 0)
+
+    def test_search_updated_book(self):
+        book = sample_book(title="Old Title")
+        Book.objects.filter(id=book.id).update(title="New Adventures")
+
+        response = self.client.get(BOOK_URL, {"q": "adventure"})
+
+        self.assertEqual([book["id"] for book in response.data], [book.id])
+
+
+class BookCursorPaginationApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.books = [
+            sample_book(title=title)
+            for title in ["Book A", "Book B", "Book B", "Book C", "Book D"]
+        ]
+
+    def test_list_books_without_cursor_is_not_paginated(self):
+        response = self.client.get(BOOK_URL)
+
+        self.assertEqual(len(response.data), 5)
+
+    def test_walk_pages_forward_and_back(self):
+        with CaptureQueriesContext(connection) as queries:
+            first_page = self.client.get(BOOK_URL, {"cursor": "", "page_size": 2})
+            second_page = self.client.get(first_page.data["next"])
+            last_page = self.client.get(second_page.data["next"])
+            previous_page = self.client.get(last_page.data["previous"])
+
+        ids = [book.id for book in self.books]
+        self.assertEqual([b["id"] for b in first_page.data["results"]], ids[:2])
+        self.assertEqual([b["id"] for b in second_page.data["results"]], ids[2:4])
+        self.assertEqual([b["id"] for b in last_page.data["results"]], ids[4:])
+        self.assertEqual(previous_page.data["results"], second_page.data["results"])
+        self.assertIsNone(first_page.data["previous"])
+        self.assertIsNone(last_page.data["next"])
+        for query in queries.captured_queries:
+            self.assertNotIn("COUNT(", query["sql"])
+            self.assertNotIn("OFFSET", query["sql"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(BOOK_URL, {"cursor": "not-a-cursor"})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BookCacheApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_list_books_served_from_cache(self):
+        sample_book(title="Test Book 1")
+        self.client.get(BOOK_URL)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(BOOK_URL)
+
+        self.assertEqual(len(response.data), 1)
+
+    def test_book_changes_invalidate_cache(self):
+        book = sample_book(title="Test Book 1")
+        self.client.get(BOOK_URL)
+        self.client.get(detail_url(book.id))
+
+        book.title = "Updated Title"
+        book.save()
+        sample_book(title="Test Book 2")
+
+        list_response = self.client.get(BOOK_URL)
+        detail_response = self.client.get(detail_url(book.id))
+
+        self.assertEqual(len(list_response.data), 2)
+        self.assertEqual(detail_response.data["title"], "Updated Title")
+
+    def test_missing_book_not_cached(self):
+        book = sample_book()
+        url = detail_url(book.id)
+        book.delete()
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    get_or_compute("test-single-flight", compute)
+                )
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 5)
+
+
+class BookConditionalGetApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_not_modified_runs_no_queries(self):
+        sample_book(title="Test Book 1")
+        response = self.client.get(BOOK_URL)
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(
+                BOOK_URL, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+
+    def test_if_modified_since(self):
+        book = sample_book()
+        response = self.client.get(detail_url(book.id))
+
+        not_modified = self.client.get(
+            detail_url(book.id), HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_missing_book_is_not_found_even_if_not_modified(self):
+        response = self.client.get(BOOK_URL)
+
+        missing = self.client.get(
+            detail_url(1000), HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_book_change_invalidates_etag(self):
+        book = sample_book()
+        response = self.client.get(BOOK_URL)
+
+        book.inventory = 10
+        book.save()
+        modified = self.client.get(BOOK_URL, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(modified["ETag"], response["ETag"])
+
+
 class AuthenticatedBookApiTests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -155,3 +356,285 @@ class AdminBookApiTests(TestCase):
             response.status_code,
             status.HTTP_204_NO_CONTENT
         )
+
+
+class BookImportApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "admin@mail.com", "TestPassword12345", is_staff=True
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_import_csv_upserts_books(self):
+        existing = sample_book(title="Old Book", author="Author", inventory=1)
+        content = (
+            "title,author,cover,inventory,daily_fee\n"
+            "Old Book,Author,HR,7,1.25\n"
+            "New Book,Author,SF,2,0.50\n"
+            "New Book,Author,SF,4,0.50\n"
+            "Bad Cover,Author,XX,1,1\n"
+            "Negative,Author,HR,-1,1\n"
+        )
+        upload = SimpleUploadedFile("books.csv", content.encode())
+
+        response = self.client.post(BOOK_IMPORT_URL, {"file": upload})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["received"], 5)
+        self.assertEqual(response.data["updated"], 1)
+        self.assertEqual(response.data["inserted"], 1)
+        self.assertEqual(response.data["rejected"], 2)
+        self.assertEqual(
+            [error["line"] for error in response.data["errors"]], [4, 5]
+        )
+        existing.refresh_from_db()
+        self.assertEqual(existing.inventory, 7)
+        self.assertEqual(existing.cover, "HR")
+        self.assertEqual(Book.objects.get(title="New Book").inventory, 4)
+
+    def test_import_jsonl(self):
+        content = (
+            '{"title": "Json Book", "author": "Author", "inventory": 3}\n'
+            '{"title": "Json Book 2", "author": "Author", "daily_fee": 0.75}\n'
+        )
+        upload = SimpleUploadedFile("books.jsonl", content.encode())
+
+        response = self.client.post(BOOK_IMPORT_URL, {"file": upload})
+
+        self.assertEqual(response.data["inserted"], 2)
+        self.assertEqual(Book.objects.get(title="Json Book").inventory, 3)
+        self.assertEqual(Book.objects.get(title="Json Book 2").inventory, 1)
+
+    def test_import_jsonl_rejects_lines_that_are_not_objects(self):
+        content = '{"title": "Json Book", "author": "Author"}\n[1, 2]\n'
+        upload = SimpleUploadedFile("books.jsonl", content.encode())
+
+        response = self.client.post(BOOK_IMPORT_URL, {"file": upload})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Line 2", str(response.data["file"]))
+        self.assertFalse(Book.objects.exists())
+
+    def test_import_forbidden_for_not_admin(self):
+        self.client.force_authenticate(
+            get_user_model().objects.create_user("user@mail.com", "TestPassword12345")
+        )
+        upload = SimpleUploadedFile("books.csv", b"title,author\n")
+
+        response = self.client.post(BOOK_IMPORT_URL, {"file": upload})
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BookInventoryBatchApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "admin@mail.com", "TestPassword12345", is_staff=True
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_adjust_inventory_in_one_statement(self):
+        books = [sample_book(title=f"Book {i}", inventory=2) for i in range(50)]
+        payload = {
+            "adjustments": [{"book_id": book.id, "delta": 3} for book in books]
+        }
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(BOOK_INVENTORY_URL, payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"updated": 50, "failed": []})
+        updates = [q for q in queries.captured_queries if "UPDATE" in q["sql"]]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            set(Book.objects.values_list("inventory", flat=True)), {5}
+        )
+
+    def test_adjust_inventory_reports_failures(self):
+        book_delta = sample_book(title="Delta", inventory=2)
+        book_set = sample_book(title="Set", inventory=2)
+        book_negative = sample_book(title="Negative", inventory=1)
+        payload = {
+            "adjustments": [
+                {"book_id": book_delta.id, "delta": -2},
+                {"book_id": book_negative.id, "delta": -2},
+                {"book_id": book_set.id, "inventory": 10},
+                {"book_id": 999999, "delta": 1},
+            ]
+        }
+
+        response = self.client.post(BOOK_INVENTORY_URL, payload, format="json")
+
+        self.assertEqual(response.data["updated"], 2)
+        self.assertEqual(
+            [failure["book_id"] for failure in response.data["failed"]],
+            [book_negative.id, 999999],
+        )
+        book_delta.refresh_from_db()
+        book_set.refresh_from_db()
+        book_negative.refresh_from_db()
+        self.assertEqual(book_delta.inventory, 0)
+        self.assertEqual(book_set.inventory, 10)
+        self.assertEqual(book_negative.inventory, 1)
+
+    def test_adjust_inventory_requires_delta_or_inventory(self):
+        book = sample_book()
+        payload = {
+            "adjustments": [{"book_id": book.id, "delta": 1, "inventory": 2}]
+        }
+
+        response = self.client.post(BOOK_INVENTORY_URL, payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BookShardedInventoryApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "admin@mail.com", "TestPassword12345", is_staff=True
+        )
+        self.client.force_authenticate(self.user)
+        self.book = sample_book(inventory=10)
+
+    def shard_counts(self):
+        return list(
+            BookInventoryShard.objects.filter(book=self.book)
+            .order_by("slot")
+            .values_list("count", flat=True)
+        )
+
+    def test_enable_and_disable_sharding(self):
+        response = self.client.post(shards_url(self.book.id), {"shard_count": 4})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data, {"id": self.book.id, "shard_count": 4, "inventory": 10}
+        )
+        self.assertEqual(self.shard_counts(), [3, 3, 2, 2])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+
+        response = self.client.post(shards_url(self.book.id), {"shard_count": 0})
+
+        self.assertEqual(response.data["inventory"], 10)
+        self.assertEqual(self.shard_counts(), [])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 10)
+
+    def test_sharded_book_exposes_total_inventory(self):
+        self.client.post(shards_url(self.book.id), {"shard_count": 3})
+
+        list_response = self.client.get(BOOK_URL)
+        detail_response = self.client.get(detail_url(self.book.id))
+
+        self.assertEqual(list_response.data[0]["inventory"], 10)
+        self.assertEqual(detail_response.data["inventory"], 10)
+        self.assertNotIn("shard_count", detail_response.data)
+
+    def test_update_inventory_of_sharded_book(self):
+        self.client.post(shards_url(self.book.id), {"shard_count": 3})
+
+        response = self.client.patch(detail_url(self.book.id), {"inventory": 7})
+
+        self.assertEqual(response.data["inventory"], 7)
+        self.assertEqual(self.shard_counts(), [3, 2, 2])
+
+    def test_reserve_and_release_use_shards(self):
+        self.client.post(shards_url(self.book.id), {"shard_count": 4})
+        other_book = sample_book(title="Plain", inventory=1)
+
+        unavailable = reserve_books([self.book.id, other_book.id])
+
+        self.assertEqual(unavailable, [])
+        self.assertEqual(sum(self.shard_counts()), 9)
+        other_book.refresh_from_db()
+        self.assertEqual(other_book.inventory, 0)
+
+        release_books({self.book.id: 1, other_book.id: 1})
+
+        self.assertEqual(sum(self.shard_counts()), 10)
+        self.book.refresh_from_db()
+        other_book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+        self.assertEqual(other_book.inventory, 1)
+
+    def test_reserve_sharded_book_until_empty(self):
+        self.client.post(shards_url(self.book.id), {"shard_count": 4})
+
+        results = [reserve_books([self.book.id]) for _ in range(11)]
+
+        self.assertEqual(results, [[]] * 10 + [[self.book.id]])
+        self.assertEqual(self.shard_counts(), [0, 0, 0, 0])
+
+    def test_sharding_forbidden_for_not_admin(self):
+        user = get_user_model().objects.create_user("user@mail.com", "Password123")
+        self.client.force_authenticate(user)
+
+        response = self.client.post(shards_url(self.book.id), {"shard_count": 4})
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BookSnapshotApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        settings_override = override_settings(CATALOG_SNAPSHOT_DIR=snapshot_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_snapshot_not_ready(self):
+        response = self.client.get(BOOK_SNAPSHOT_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_download_snapshot(self):
+        books = [sample_book(title="Book 1"), sample_book(title="Book 2")]
+        build_catalog_snapshot()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(BOOK_SNAPSHOT_URL)
+            content = b"".join(response.streaming_content)
+
+        rows = [
+            json.loads(line) for line in gzip.decompress(content).splitlines()
+        ]
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(rows, BookSerializer(books, many=True).data)
+
+    def test_snapshot_not_modified(self):
+        sample_book()
+        build_catalog_snapshot()
+        response = self.client.get(BOOK_SNAPSHOT_URL)
+
+        not_modified = self.client.get(
+            BOOK_SNAPSHOT_URL, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_snapshot_rebuilt_only_after_catalog_change(self):
+        book = sample_book()
+        manifest = build_catalog_snapshot()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(build_catalog_snapshot(), manifest)
+
+        book.inventory = 10
+        book.save()
+
+        self.assertNotEqual(build_catalog_snapshot()["etag"], manifest["etag"])
+
+    def test_checkouts_refresh_snapshot_only_once_it_is_old(self):
+        book = sample_book()
+        manifest = build_catalog_snapshot()
+
+        reserve_books([book.id])
+
+        self.assertEqual(build_catalog_snapshot(), manifest)
+        with override_settings(CATALOG_SNAPSHOT_MAX_AGE=0):
+            self.assertNotEqual(build_catalog_snapshot()["etag"], manifest["etag"])
@@ -1,13 +1,51 @@
-from rest_framework import mixins
+import csv
+import io
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import F
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from rest_framework import mixins, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from book.models import Book
+from book.importer import import_books
+from book.inventory import adjust_inventory
+from book.models import Book, SEARCH_CONFIG
+from book.snapshot import read_manifest, snapshot_dir
 from book.permissions import AdminOrReadOnly
-from book.serializers import BookSerializer
+from book.serializers import (
+    BookSerializer,
+    BookSearchSerializer,
+    BookImportSerializer,
+    BookImportResultSerializer,
+    BookShardingSerializer,
+    InventoryBatchSerializer,
+    InventoryBatchResultSerializer,
+)
+from utils.cache import CachedResponseMixin, ConditionalGetMixin
+from utils.pagination import KeysetPagination
+
+
+SEARCH_MAX_RESULTS = 50
+
+
+class BookPagination(KeysetPagination):
+    ordering = ("title", "id")
+    page_size = 50
+    max_page_size = 200
 
 
 class BookViewSet(
+    ConditionalGetMixin,
+    CachedResponseMixin,
     mixins.CreateModelMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
@@ -15,7 +53,170 @@ class BookViewSet(
     mixins.DestroyModelMixin,
     GenericViewSet,
 ):
-    queryset = Book.objects.all()
+    queryset = Book.objects.with_available_inventory()
     serializer_class = BookSerializer
     authentication_classes = (JWTAuthentication, )
     permission_classes = (AdminOrReadOnly, )
+    pagination_class = BookPagination
+    cache_namespaces = ("book",)
+    query_budgets = {
+        "list": 1,
+        "create": 1,
+        "retrieve": 1,
+        "update": 11,
+        "partial_update": 11,
+        "destroy": 4,
+        "import_books": 12,
+        "adjust_inventory": 3,
+        "shard_inventory": 9,
+        "snapshot": 0,
+    }
+
+    def get_search_query(self):
+        if self.action != "list":
+            return None
+        q = self.request.query_params.get("q", "").strip()
+        if not q:
+            return None
+        return SearchQuery(q, search_type="websearch", config=SEARCH_CONFIG)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        query = self.get_search_query()
+
+        if query is not None:
+            highlight_options = {
+                "config": SEARCH_CONFIG,
+                "start_sel": "<b>",
+                "stop_sel": "</b>",
+                "highlight_all": True,
+            }
+            queryset = (
+                queryset.filter(search_vector=query)
+                .annotate(rank=SearchRank(F("search_vector"), query))
+                .annotate(
+                    title_highlight=SearchHeadline("title", query, **highlight_options),
+                    author_highlight=SearchHeadline(
+                        "author", query, **highlight_options
+                    ),
+                )
+                .order_by("-rank", "title", "id")[:SEARCH_MAX_RESULTS]
+            )
+
+        return queryset
+
+    def paginate_queryset(self, queryset):
+        if self.get_search_query() is not None:
+            return None
+        return super().paginate_queryset(queryset)
+
+    def get_serializer_class(self):
+        if self.action == "import_books":
+            return BookImportSerializer
+        if self.action == "adjust_inventory":
+            return InventoryBatchSerializer
+        if self.action == "shard_inventory":
+            return BookShardingSerializer
+        if self.get_search_query() is not None:
+            return BookSearchSerializer
+        return BookSerializer
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="q",
+                description="Full-text search by title and author "
+                            "(results are ranked by relevance)",
+                required=False,
+                type=str,
+            ),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @extend_schema(responses=BookImportResultSerializer)
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="import",
+        permission_classes=(IsAdminUser,),
+        parser_classes=(MultiPartParser,),
+    )
+    def import_books(self, request):
+        """Import books from an uploaded CSV or JSONL file (admin only)"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        uploaded = serializer.validated_data["file"]
+        stream = io.TextIOWrapper(uploaded.file, encoding="utf-8", newline="")
+        try:
+            result = import_books(stream, serializer.validated_data["file_format"])
+        except (ValueError, csv.Error) as error:
+            raise ValidationError({"file": f"Can't read the file: {error}"})
+
+        return Response(result.as_dict(), status=status.HTTP_200_OK)
+
+    @extend_schema(responses=InventoryBatchResultSerializer)
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="inventory",
+        permission_classes=(IsAdminUser,),
+    )
+    def adjust_inventory(self, request):
+        """Change the inventory of many books at once (admin only)"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        updated, failed = adjust_inventory(serializer.validated_data["adjustments"])
+
+        return Response(
+            InventoryBatchResultSerializer({"updated": updated, "failed": failed}).data,
+            status=status.HTTP_200_OK,
+        )
+
+    @action(
+        methods=["POST"],
+        detail=True,
+        url_path="shards",
+        permission_classes=(IsAdminUser,),
+    )
+    def shard_inventory(self, request, pk=None):
+        """Spread the inventory of a hot title over shard_count counters (admin only)"""
+        book = self.get_object()
+        serializer = self.get_serializer(book, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @extend_schema(responses={(200, "application/gzip"): bytes})
+    @action(methods=["GET"], detail=False, url_path="snapshot")
+    def snapshot(self, request):
+        """Download the whole catalog as gzip-compressed NDJSON"""
+        manifest = read_manifest()
+        try:
+            file = open(snapshot_dir() / manifest["file"], "rb")
+        except (TypeError, FileNotFoundError):
+            return Response(
+                {"detail": "Catalog snapshot is not ready yet."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "300"},
+            )
+
+        response = get_conditional_response(
+            request, etag=manifest["etag"], last_modified=manifest["generated_at"]
+        )
+        if response is not None:
+            file.close()
+        else:
+            response = FileResponse(
+                file,
+                as_attachment=True,
+                filename="catalog.ndjson.gz",
+                content_type="application/gzip",
+            )
+        response["ETag"] = manifest["etag"]
+        response["Last-Modified"] = http_date(manifest["generated_at"])
+        return response
@@ -3,4 +3,16 @@ from django.contrib import admin
 from borrowing.models import Borrowing
 
 
-admin.site.register(Borrowing)
+@admin.register(Borrowing)
+class BorrowingAdmin(admin.ModelAdmin):
+    # Borrowing.__str__ shows the user and the titles of the books.
+    list_select_related = ("user",)
+    query_budgets = {"changelist": 6}
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related("book")
+
+    def save_model(self, request, obj, form, change):
+        if not change or "book" in form.changed_data:
+            obj.take_snapshot(form.cleaned_data["book"])
+        super().save_model(request, obj, form, change)
@@ -0,0 +1,374 @@
+import json
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from itertools import count
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from book.models import Book
+from borrowing.models import Borrowing
+from borrowing.returns import return_borrowings
+from notification.models import Notification
+from payment.models import StripeEvent
+from payment.tasks import apply_stripe_events
+from utils.fake_stripe import sign_webhook
+
+
+EMAIL_DOMAIN = "bench.library.test"
+PASSWORD = "benchmark-password"
+WEBHOOK_SECRET = "whsec_benchmark"
+# Endpoints in the order a client calls them in every round.
+ENDPOINTS = [
+    "token obtain",
+    "book list",
+    "book retrieve",
+    "borrowing create",
+    "borrowing list",
+    "payment create",
+    "stripe webhook",
+    "payment success",
+    "borrowing return",
+]
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, percent):
+    """Interpolate between the closest ranks of sorted `values`."""
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def change(value, baseline):
+    if not baseline:
+        return "-"
+    return f"{(value - baseline) / baseline * 100:+.1f}%"
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the API in process: concurrent clients log in, browse books, "
+        "borrow, pay and return through the real URL conf against the "
+        "configured database (fill it with seed_library first). Stripe is "
+        "stubbed and the queued notifications are dropped. Reports latency "
+        "percentiles, requests per second and queries per request of every "
+        "endpoint, and saves them as JSON to compare with a --baseline run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=4)
+        parser.add_argument(
+            "--rounds",
+            type=int,
+            default=25,
+            help="Rounds per client, every round calls each endpoint once.",
+        )
+        parser.add_argument("--output", default="benchmark_api.json")
+        parser.add_argument(
+            "--baseline", help="Results of an earlier run to compare with."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if min(options["clients"], options["rounds"]) < 1:
+            raise CommandError("--clients and --rounds must be positive.")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)
+        book_ids = list(
+            Book.objects.filter(inventory__gte=options["clients"])
+            .order_by("?")
+            .values_list("id", flat=True)[:1000]
+        )
+        if not book_ids:
+            raise CommandError(
+                "No books to borrow, fill the database with seed_library first."
+            )
+        if settings.DEBUG:
+            self.stderr.write(
+                "DEBUG is on: queries are logged and the debug toolbar runs, "
+                "latencies will be higher than in production."
+            )
+
+        database = {
+            "users": get_user_model().objects.count(),
+            "books": Book.objects.count(),
+            "borrowings": Borrowing.objects.count(),
+        }
+        self.remove_clients()
+        password = make_password(PASSWORD)
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"client{n}@{EMAIL_DOMAIN}", password=password)
+            for n in range(options["clients"])
+        )
+        self.stdout.write(
+            f"{options['clients']} clients x {options['rounds']} rounds against "
+            f"{database['books']} books and {database['borrowings']} borrowings..."
+        )
+
+        started_at = datetime.now(timezone.utc)
+        last_notification = Notification.objects.aggregate(id=Max("id"))["id"] or 0
+        try:
+            with self.stubs(), override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+            ), ThreadPoolExecutor(options["clients"]) as executor:
+                started = time.perf_counter()
+                runs = executor.map(
+                    self.run_client,
+                    users,
+                    [options["rounds"]] * len(users),
+                    [book_ids] * len(users),
+                    [options["seed"] + n for n in range(len(users))],
+                )
+                samples = {endpoint: [] for endpoint in ENDPOINTS}
+                for client_samples in runs:
+                    for endpoint, calls in client_samples.items():
+                        samples[endpoint].extend(calls)
+                seconds = time.perf_counter() - started
+        finally:
+            self.remove_clients()
+            Notification.objects.filter(id__gt=last_notification).delete()
+            StripeEvent.objects.filter(id__startswith="evt_bench_").delete()
+
+        results = self.summarize(samples, seconds)
+        results = {
+            "started_at": started_at.isoformat(),
+            "clients": options["clients"],
+            "rounds": options["rounds"],
+            "database": database,
+            **results,
+        }
+        with open(options["output"], "w") as file:
+            json.dump(results, file, indent=2)
+        self.report(results, baseline)
+        self.stdout.write(self.style.SUCCESS(f"Saved to {options['output']}."))
+
+    @staticmethod
+    @contextmanager
+    def stubs():
+        """Answer Stripe in process."""
+        session_ids = count()
+
+        def create_session(**kwargs):
+            session_id = f"cs_bench_{next(session_ids)}"
+            return SimpleNamespace(
+                id=session_id, url=f"https://checkout.stripe.com/c/pay/{session_id}"
+            )
+
+        patches = [
+            mock.patch("stripe.checkout.Session.create", side_effect=create_session),
+            override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET),
+        ]
+        with ExitStack() as stack:
+            for patch in patches:
+                stack.enter_context(patch)
+            yield
+
+    @staticmethod
+    def remove_clients():
+        """Return what benchmark clients still hold and delete them."""
+        users = get_user_model().objects.filter(email__endswith=f"@{EMAIL_DOMAIN}")
+        borrowings = Borrowing.objects.filter(user__in=users)
+        active_ids = list(
+            borrowings.filter(actual_return_date__isnull=True).values_list(
+                "id", flat=True
+            )
+        )
+        if active_ids:
+            return_borrowings(borrowings, active_ids)
+        users.delete()
+
+    def run_client(self, user, rounds, book_ids, seed):
+        client = Client(raise_request_exception=False)
+        picker = random.Random(seed)
+        samples = {endpoint: [] for endpoint in ENDPOINTS}
+        try:
+            for _ in range(rounds):
+                self.run_round(client, samples, user, picker.choice(book_ids))
+        finally:
+            connections.close_all()
+        return samples
+
+    def run_round(self, client, samples, user, book_id):
+        """Log in, look at a book, borrow it, pay for it and return it."""
+
+        def call(endpoint, method, path, data=None, headers=None):
+            queries = 0
+
+            def count_query(execute, sql, params, many, context):
+                nonlocal queries
+                queries += 1
+                return execute(sql, params, many, context)
+
+            kwargs = {"content_type": "application/json"} if method == "post" else {}
+            with connection.execute_wrapper(count_query):
+                started = time.perf_counter()
+                response = getattr(client, method)(
+                    path, data, headers=headers, **kwargs
+                )
+                elapsed = time.perf_counter() - started
+            ok = response.status_code < 400
+            samples[endpoint].append((elapsed * 1000, queries, ok))
+            return response if ok else None
+
+        response = call(
+            "token obtain",
+            "post",
+            reverse("user:token_obtain_pair"),
+            {"email": user.email, "password": PASSWORD},
+        )
+        if response is None:
+            return
+        headers = {"authorization": f"Bearer {response.json()['access']}"}
+
+        # The first keyset page, the unpaginated list returns the whole catalog.
+        call(
+            "book list",
+            "get",
+            reverse("book:book-list"),
+            {"cursor": ""},
+            headers=headers,
+        )
+        call(
+            "book retrieve",
+            "get",
+            reverse("book:book-detail", args=[book_id]),
+            headers=headers,
+        )
+        response = call(
+            "borrowing create",
+            "post",
+            reverse("borrowing:borrowing-list"),
+            {
+                "book": [book_id],
+                "expected_return_date": str(date.today() + timedelta(days=14)),
+            },
+            headers=headers,
+        )
+        if response is None:
+            return
+        response = call(
+            "borrowing list",
+            "get",
+            reverse("borrowing:borrowing-list"),
+            {"is_active": "true"},
+            headers=headers,
+        )
+        if response is None:
+            return
+        borrowing_id = max(row["id"] for row in response.json()["results"])
+
+        response = call(
+            "payment create",
+            "post",
+            reverse("payment:payment-create-payment"),
+            {"borrowing": borrowing_id},
+            headers=headers,
+        )
+        if response is not None:
+            session_id = response.json()["session_url"].rsplit("/", 1)[-1]
+            event = json.dumps(
+                {
+                    "id": f"evt_bench_{session_id}",
+                    "type": "checkout.session.completed",
+                    "data": {"object": {"id": session_id, "payment_status": "paid"}},
+                }
+            )
+            call(
+                "stripe webhook",
+                "post",
+                reverse("payment:payment-webhook"),
+                event,
+                headers={"stripe-signature": sign_webhook(event, WEBHOOK_SECRET)},
+            )
+            # What the worker does between requests, left out of the timings.
+            apply_stripe_events()
+            call(
+                "payment success",
+                "get",
+                reverse("payment:payment-success"),
+                {"session_id": session_id},
+            )
+        call(
+            "borrowing return",
+            "post",
+            reverse("borrowing:borrowing-return-book", args=[borrowing_id]),
+            headers=headers,
+        )
+
+    @staticmethod
+    def summarize(samples, seconds):
+        endpoints = {}
+        for endpoint, calls in samples.items():
+            if not calls:
+                continue
+            latencies = sorted(latency for latency, _, _ in calls)
+            endpoints[endpoint] = {
+                "requests": len(calls),
+                "errors": sum(not ok for _, _, ok in calls),
+                "requests_per_second": len(calls) / seconds,
+                "latency_ms": {
+                    f"p{percent}": percentile(latencies, percent)
+                    for percent in PERCENTILES
+                },
+                "queries_per_request": sum(queries for _, queries, _ in calls)
+                / len(calls),
+            }
+        requests = sum(len(calls) for calls in samples.values())
+        return {
+            "seconds": seconds,
+            "requests": requests,
+            "requests_per_second": requests / seconds,
+            "endpoints": endpoints,
+        }
+
+    def report(self, results, baseline=None):
+        header = (
+            f"{'endpoint':<18}{'requests':>9}{'errors':>7}{'req/s':>8}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        )
+        if baseline:
+            header += f"{'p95 vs base':>13}{'req/s vs base':>15}"
+        self.stdout.write(header)
+        for endpoint, stats in results["endpoints"].items():
+            latency = stats["latency_ms"]
+            line = (
+                f"{endpoint:<18}{stats['requests']:>9}{stats['errors']:>7}"
+                f"{stats['requests_per_second']:>8.1f}{latency['p50']:>9.1f}"
+                f"{latency['p95']:>9.1f}{latency['p99']:>9.1f}"
+                f"{stats['queries_per_request']:>9.1f}"
+            )
+            if baseline:
+                base = baseline["endpoints"].get(endpoint)
+                if base is None:
+                    line += f"{'new':>13}{'new':>15}"
+                else:
+                    p95 = change(latency["p95"], base["latency_ms"]["p95"])
+                    rate = change(
+                        stats["requests_per_second"], base["requests_per_second"]
+                    )
+                    line += f"{p95:>13}{rate:>15}"
+            self.stdout.write(line)
+        total = f"{results['requests']} requests in {results['seconds']:.1f}s, "
+        total += f"{results['requests_per_second']:.1f} req/s"
+        if baseline:
+            rate = change(
+                results["requests_per_second"], baseline["requests_per_second"]
+            )
+            total += f" ({rate} vs baseline)"
+        self.stdout.write(total)
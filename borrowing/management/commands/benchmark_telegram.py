@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import telegram
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.fake_telegram import FakeTelegramServer
+from utils.telegram import TelegramClient
+
+
+TOKEN = "123456:benchmark"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure Telegram notification throughput against a local fake Bot API "
+        "server: a new Bot and event loop per message, as before, against the "
+        "pooled client sending to one or many chats."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=20,
+            help="Milliseconds the fake server takes to answer.",
+        )
+        parser.add_argument(
+            "--chats",
+            type=int,
+            default=4,
+            help="Chats the pooled client sends to in parallel.",
+        )
+        parser.add_argument(
+            "--rate-limited",
+            action="store_true",
+            help=(
+                "Pace the pooled client with the configured Telegram rates "
+                "(20 messages per minute per chat), instead of measuring its "
+                "unthrottled transport throughput."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if min(options["messages"], options["chats"]) < 1:
+            raise CommandError("--messages and --chats must be positive.")
+        messages = [f"Benchmark message {n}" for n in range(options["messages"])]
+        # Unthrottled rows measure the transport only: Telegram itself never
+        # accepts more than TELEGRAM_CHAT_MESSAGES_PER_MINUTE in one chat.
+        rates = {"messages_per_second": 10**6, "chat_messages_per_minute": 10**8}
+        pacing = "unthrottled"
+        if options["rate_limited"]:
+            rates = {
+                "messages_per_second": settings.TELEGRAM_MESSAGES_PER_SECOND,
+                "chat_messages_per_minute": settings.TELEGRAM_CHAT_MESSAGES_PER_MINUTE,
+            }
+            pacing = "rate-limited"
+
+        self.stdout.write(
+            f"{'mode':<42}{'messages':>9}{'seconds':>9}{'msg/s':>9}"
+            f"{'connections':>13}"
+        )
+        self.measure("bot per message", options, self.send_one_by_one, messages)
+        self.measure(
+            f"pooled client, 1 chat ({pacing})",
+            options,
+            self.send_pooled,
+            messages,
+            rates,
+            1,
+        )
+        if options["chats"] > 1:
+            self.measure(
+                f"pooled client, {options['chats']} chats ({pacing})",
+                options,
+                self.send_pooled,
+                messages,
+                rates,
+                options["chats"],
+            )
+
+    def measure(self, mode, options, send, messages, *args):
+        with FakeTelegramServer(latency=options["latency"] / 1000) as fake:
+            started = time.perf_counter()
+            send(fake, messages, *args)
+            seconds = time.perf_counter() - started
+            sent = len(fake.messages)
+            connections = fake.connections
+        self.stdout.write(
+            f"{mode:<42}{sent:>9}{seconds:>9.2f}{sent / seconds:>9.1f}"
+            f"{connections:>13}"
+        )
+
+    @staticmethod
+    def send_one_by_one(fake, messages):
+        """What every caller did before: a new Bot in a new event loop."""
+
+        async def send(message):
+            bot = telegram.Bot(token=TOKEN, base_url=fake.base_url)
+            await bot.send_message(chat_id=1, text=message)
+
+        for message in messages:
+            asyncio.run(send(message))
+
+    @staticmethod
+    def send_pooled(fake, messages, rates, chats):
+        client = TelegramClient(TOKEN, chat_id=1, base_url=fake.base_url, **rates)
+        try:
+            futures = [
+                client.submit(messages[chat::chats], chat_id=chat + 1)
+                for chat in range(chats)
+            ]
+            for future in futures:
+                future.result()
+        finally:
+            client.close()
@@ -0,0 +1,380 @@
+import random
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from book.models import Book
+from book.sample_data import AUTHORS, WORDS
+from borrowing.models import Borrowing, BorrowingReminder, fine_multiplier
+from borrowing.reminders import future_reminders
+from payment.models import Payment
+from utils.cache import bump_version
+
+
+FIRST_NAMES = [
+    "Olena", "Andrii", "Maria", "John", "Anna", "Taras", "Sofia", "Peter",
+    "Iryna", "David", "Kateryna", "Oleh", "Emma", "Mykola", "Laura", "Ivan",
+]
+EMAIL_DOMAIN = "seed.library.test"
+# (value, weight) pairs of loan periods in days and of books per borrowing.
+LOAN_DAYS = [(7, 2), (14, 5), (21, 2), (30, 1)]
+BOOKS_PER_BORROWING = [(1, 7), (2, 2), (3, 1)]
+# Share of borrowings returned late, and the mean delay of those in days.
+LATE_SHARE = 0.15
+MEAN_DELAY_DAYS = 6
+# Share of borrowings that are never returned.
+LOST_SHARE = 0.01
+# Share of payments (and fines) still waiting to be paid.
+PENDING_PAYMENT_SHARE = 0.03
+PENDING_FINE_SHARE = 0.2
+NULL = "\\N"
+
+
+def weighted(pairs):
+    """Expand (value, weight) pairs into a table to pick uniformly from."""
+    return [value for value, weight in pairs for _ in range(weight)]
+
+
+def cents(amount: int) -> str:
+    return f"{amount // 100}.{amount % 100:02d}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with a synthetic library: users, books, borrowings "
+        "with realistic return and overdue distributions, and their payments. "
+        "The same --seed always generates the same data (relative to today)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=400_000)
+        parser.add_argument("--books", type=int, default=300_000)
+        parser.add_argument("--borrowings", type=int, default=2_000_000)
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=3 * 365,
+            help="Spread borrow dates over this many past days.",
+        )
+        parser.add_argument("--batch-size", type=int, default=50_000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if min(options["users"], options["books"]) < 1:
+            raise CommandError("At least one user and one book are needed.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive.")
+        if fine_multiplier() is None:
+            raise CommandError("FINE_MULTIPLIER is needed to seed the fines.")
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.email_prefix = f"seed{options['seed']}-reader"
+        if get_user_model().objects.filter(email=self.email(0)).exists():
+            raise CommandError(
+                f"The library was already seeded with --seed {options['seed']}."
+            )
+
+        models = [
+            get_user_model(),
+            Book,
+            Borrowing,
+            Borrowing.book.through,
+            BorrowingReminder,
+            Payment,
+        ]
+        started = time.perf_counter()
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Check foreign keys row by row, instead of queueing millions of
+            # deferred checks until the commit.
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            deferred = self.drop_indexes_of_empty_tables(cursor, models)
+            user_ids = self.seed_users(cursor, options["users"])
+            books = self.seed_books(cursor, options["books"])
+            rows = {"users": len(user_ids), "books": len(books)}
+            rows.update(
+                self.seed_borrowings(
+                    cursor, options["borrowings"], books, user_ids, options["days"]
+                )
+            )
+            cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+            if deferred:
+                self.stdout.write("Building indexes and foreign keys...")
+            for statement in deferred:
+                cursor.execute(statement)
+        with connection.cursor() as cursor:
+            tables = ", ".join(model._meta.db_table for model in models)
+            cursor.execute(f"ANALYZE {tables}")
+        bump_version("book", "book:titles", "borrowing")
+
+        seconds = time.perf_counter() - started
+        total = sum(rows.values())
+        for name, count in rows.items():
+            self.stdout.write(f"{name:<16}{count:>10}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {total} rows in {seconds:.1f}s "
+                f"({total / seconds:.0f} rows/s)."
+            )
+        )
+
+    def email(self, number):
+        return f"{self.email_prefix}{number}@{EMAIL_DOMAIN}"
+
+    @staticmethod
+    def reserve_ids(cursor, model, count):
+        """Take `count` consecutive ids from the sequence of the model table."""
+        table = model._meta.db_table
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+            "nextval(pg_get_serial_sequence(%s, 'id')) + %s - 1)",
+            [table, table, count],
+        )
+        return cursor.fetchone()[0] - count + 1
+
+    @staticmethod
+    def drop_indexes_of_empty_tables(cursor, models):
+        """
+        Drop secondary indexes and foreign keys of empty tables.
+
+        Building an index or validating a foreign key once after the load is
+        much cheaper than doing it for every copied row. Indexes backing
+        primary keys and unique constraints are kept. Returns the statements
+        that recreate what was dropped.
+        """
+        statements = []
+        for model in models:
+            table = model._meta.db_table
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+            if cursor.fetchone()[0]:
+                continue
+            cursor.execute(
+                """
+                SELECT indexname, indexdef FROM pg_indexes
+                WHERE schemaname = current_schema() AND tablename = %s
+                    AND indexname NOT IN (SELECT conname FROM pg_constraint)
+                """,
+                [table],
+            )
+            for name, definition in cursor.fetchall():
+                cursor.execute(f'DROP INDEX "{name}"')
+                statements.append(definition)
+            cursor.execute(
+                """
+                SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+                WHERE conrelid = %s::regclass AND contype = 'f'
+                """,
+                [table],
+            )
+            for name, definition in cursor.fetchall():
+                cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+                statements.append(
+                    f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}'
+                )
+        return statements
+
+    def copy(self, cursor, model, columns, lines):
+        """
+        COPY lines of tab-separated values into the model table in batches.
+
+        Generated values never contain tabs, newlines or backslashes, so they
+        are written without escaping. Returns the number of rows.
+        """
+        statement = f"COPY {model._meta.db_table} ({', '.join(columns)}) FROM STDIN"
+        lines = iter(lines)
+        copied = 0
+        while batch := list(islice(lines, self.batch_size)):
+            with cursor.copy(statement) as copy:
+                copy.write("".join(batch))
+            copied += len(batch)
+        return copied
+
+    def seed_users(self, cursor, count):
+        """Insert the users and return the range of their ids."""
+        first_id = self.reserve_ids(cursor, get_user_model(), count)
+        choice = self.random.choice
+        joined = date.today().isoformat()
+        lines = (
+            f"{first_id + n}\t!\tf\tf\tt\t{joined}\t{self.email(n)}\t"
+            f"{choice(FIRST_NAMES)}\t{choice(AUTHORS)}\n"
+            for n in range(count)
+        )
+        self.copy(
+            cursor,
+            get_user_model(),
+            [
+                "id",
+                "password",
+                "is_superuser",
+                "is_staff",
+                "is_active",
+                "date_joined",
+                "email",
+                "first_name",
+                "last_name",
+            ],
+            lines,
+        )
+        return range(first_id, first_id + count)
+
+    def seed_books(self, cursor, count):
+        """Insert the books and return (id, title, daily fee in cents) of each."""
+        first_id = self.reserve_ids(cursor, Book, count)
+        choice = self.random.choice
+        rand = self.random.random
+        books = [
+            (
+                first_id + n,
+                f"{choice(WORDS).title()} {choice(WORDS)} {n}",
+                10 + int(rand() * 291),
+            )
+            for n in range(count)
+        ]
+        covers = Book.Cover.values
+        lines = (
+            f"{book_id}\t{title}\t{choice(AUTHORS)}\t{choice(covers)}\t"
+            f"{int(rand() * 11)}\t{cents(fee)}\n"
+            for book_id, title, fee in books
+        )
+        self.copy(
+            cursor,
+            Book,
+            ["id", "title", "author", "cover", "inventory", "daily_fee"],
+            lines,
+        )
+        return books
+
+    def seed_borrowings(self, cursor, count, books, user_ids, days):
+        """
+        Insert borrowings with their books, payments and fines.
+
+        Borrow dates are uniform over the last `days` days. Most books come
+        back within the loan period, LATE_SHARE of them after it and
+        LOST_SHARE never; borrowings that aren't back by today are active.
+        Every borrowing has a payment, and those returned late a fine.
+        Active borrowings get the reminders that are still ahead.
+        """
+        first_id = self.reserve_ids(cursor, Borrowing, count)
+        rand = self.random.random
+        expovariate = self.random.expovariate
+        fine_percent = int(fine_multiplier() * 100)
+        loan_days = weighted(LOAN_DAYS)
+        books_per_borrowing = weighted(BOOKS_PER_BORROWING)
+        # Day n of the seeded period is dates[n], today is dates[days].
+        first_day = date.today() - timedelta(days=days)
+        dates = [
+            (first_day + timedelta(days=n)).isoformat()
+            for n in range(days + max(loan_days) + 1)
+        ]
+        paid, pending = Payment.Status.PAID.value, Payment.Status.PENDING.value
+        payment, fine = Payment.Type.PAYMENT.value, Payment.Type.FINE.value
+        # Reminder lines of an active borrowing by its expected return day.
+        reminder_lines = [
+            [
+                f"{reminder.kind}\t{reminder.remind_at.isoformat()}"
+                for reminder in future_reminders(
+                    None, first_day + timedelta(days=n)
+                )
+            ]
+            for n in range(len(dates))
+        ]
+        rows = {"borrowings": 0, "borrowed books": 0, "reminders": 0, "payments": 0}
+
+        for batch_start in range(0, count, self.batch_size):
+            borrowings = []
+            links = []
+            reminders = []
+            payments = []
+            for borrowing_id in range(
+                first_id + batch_start,
+                first_id + min(batch_start + self.batch_size, count),
+            ):
+                borrowed = int(rand() * (days + 1))
+                loan = loan_days[int(rand() * len(loan_days))]
+                expected = borrowed + loan
+                if rand() < LOST_SHARE:
+                    returned = None
+                elif rand() < LATE_SHARE:
+                    returned = expected + 1 + int(expovariate(1 / MEAN_DELAY_DAYS))
+                else:
+                    returned = borrowed + int(rand() * (loan + 1))
+                if returned is not None and returned > days:
+                    returned = None
+
+                # Popular books are borrowed much more often than the rest.
+                picked = sorted(
+                    {
+                        books[int(len(books) * rand() ** 3)]
+                        for _ in range(
+                            books_per_borrowing[int(rand() * len(books_per_borrowing))]
+                        )
+                    },
+                    key=lambda book: book[1],
+                )
+                fee = sum(book[2] for book in picked)
+
+                borrowings.append(
+                    f"{borrowing_id}\t{dates[borrowed]}\t{dates[expected]}\t"
+                    f"{NULL if returned is None else dates[returned]}\t"
+                    f"{user_ids[int(rand() * len(user_ids))]}\t{cents(fee)}\t"
+                    f"{len(picked)}\t{', '.join(book[1] for book in picked)}\n"
+                )
+                links.extend(f"{borrowing_id}\t{book[0]}\n" for book in picked)
+                if returned is None:
+                    reminders.extend(
+                        f"{borrowing_id}\t{line}\n" for line in reminder_lines[expected]
+                    )
+
+                # One payment per borrowing and at most one fine (unique_payment).
+                status = paid
+                if returned is None and rand() < PENDING_PAYMENT_SHARE:
+                    status = pending
+                payments.append(
+                    f"{status}\t{payment}\t{borrowing_id}\t\t"
+                    f"{cents(fee * (loan + 1))}\n"
+                )
+                if returned is not None and returned > expected:
+                    status = pending if rand() < PENDING_FINE_SHARE else paid
+                    amount = fee * (returned - expected) * fine_percent // 100
+                    payments.append(
+                        f"{status}\t{fine}\t{borrowing_id}\t\t{cents(amount)}\n"
+                    )
+
+            rows["borrowings"] += self.copy(
+                cursor,
+                Borrowing,
+                [
+                    "id",
+                    "borrow_date",
+                    "expected_return_date",
+                    "actual_return_date",
+                    "user_id",
+                    "daily_fee_total",
+                    "book_count",
+                    "book_titles",
+                ],
+                borrowings,
+            )
+            rows["borrowed books"] += self.copy(
+                cursor, Borrowing.book.through, ["borrowing_id", "book_id"], links
+            )
+            rows["reminders"] += self.copy(
+                cursor,
+                BorrowingReminder,
+                ["borrowing_id", "kind", "remind_at"],
+                reminders,
+            )
+            rows["payments"] += self.copy(
+                cursor,
+                Payment,
+                ["status", "type", "borrowing_id", "session_url", "money_to_pay"],
+                payments,
+            )
+            self.stdout.write(
+                f"Borrowings: {rows['borrowings']}/{count}", ending="\r"
+            )
+        self.stdout.write("")
+        return rows
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:03
+
+from django.db import migrations, models
+
+
+BACKFILL_SNAPSHOT_SQL = """
+    UPDATE borrowing_borrowing AS borrowing
+    SET daily_fee_total = snapshot.daily_fee_total,
+        book_count = snapshot.book_count,
+        book_titles = snapshot.book_titles
+    FROM (
+        SELECT borrowed.borrowing_id,
+            sum(book.daily_fee) AS daily_fee_total,
+            count(*) AS book_count,
+            string_agg(book.title, ', ' ORDER BY book.title) AS book_titles
+        FROM borrowing_borrowing_book AS borrowed
+        JOIN book_book AS book ON book.id = borrowed.book_id
+        GROUP BY borrowed.borrowing_id
+    ) AS snapshot
+    WHERE borrowing.id = snapshot.borrowing_id
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0004_alter_borrowing_options"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="borrowing",
+            name="book_count",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="borrowing",
+            name="book_titles",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="borrowing",
+            name="daily_fee_total",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=8, null=True
+            ),
+        ),
+        migrations.RunSQL(BACKFILL_SNAPSHOT_SQL, migrations.RunSQL.noop),
+    ]
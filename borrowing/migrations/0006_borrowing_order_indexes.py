@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book", "0005_book_inventory_shards"),
+        ("borrowing", "0005_borrowing_pricing_snapshot"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["actual_return_date", "-borrow_date", "id"],
+                name="borrowing_order_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["user", "actual_return_date", "-borrow_date", "id"],
+                name="borrowing_user_order_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book", "0005_book_inventory_shards"),
+        ("borrowing", "0006_borrowing_order_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", True)),
+                fields=["expected_return_date"],
+                name="borrowing_active_due_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                condition=models.Q(
+                    ("expected_return_date__lt", models.F("actual_return_date"))
+                ),
+                fields=["user"],
+                name="borrowing_overdue_user_idx",
+            ),
+        ),
+    ]
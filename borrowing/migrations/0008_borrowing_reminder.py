@@ -0,0 +1,77 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Active borrowings get the reminders that are still in the future, at
+# midnight local time of their due date and of the day after.
+BACKFILL_REMINDERS_SQL = """
+    INSERT INTO borrowing_borrowingreminder (borrowing_id, kind, remind_at)
+    SELECT borrowing.id, reminder.kind, reminder.remind_at
+    FROM borrowing_borrowing AS borrowing
+    CROSS JOIN LATERAL (
+        SELECT kind,
+            (borrowing.expected_return_date + days)::timestamp
+                AT TIME ZONE %s AS remind_at
+        FROM (VALUES ('DUE', 0), ('OVERDUE', 1)) AS kinds (kind, days)
+    ) AS reminder
+    WHERE borrowing.actual_return_date IS NULL
+        AND borrowing.expected_return_date >= current_date - 1
+        AND reminder.remind_at > now()
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0007_borrowing_access_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BorrowingReminder",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("DUE", "Due"), ("OVERDUE", "Overdue")], max_length=8
+                    ),
+                ),
+                ("remind_at", models.DateTimeField()),
+                (
+                    "borrowing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reminders",
+                        to="borrowing.borrowing",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["remind_at", "id"], name="borrowing_reminder_due_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("borrowing", "kind"), name="unique_borrowing_reminder"
+                    )
+                ],
+            },
+        ),
+        migrations.RunSQL(
+            [(BACKFILL_REMINDERS_SQL, [settings.TIME_ZONE])], migrations.RunSQL.noop
+        ),
+    ]
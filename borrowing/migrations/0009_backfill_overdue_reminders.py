@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.db import migrations
+
+
+# Borrowings that were already overdue when reminders were introduced never
+# got one, and nothing else reports them anymore: remind about them now.
+BACKFILL_OVERDUE_REMINDERS_SQL = """
+    INSERT INTO borrowing_borrowingreminder (borrowing_id, kind, remind_at)
+    SELECT id, 'OVERDUE', now()
+    FROM borrowing_borrowing
+    WHERE actual_return_date IS NULL
+        AND (expected_return_date + 1)::timestamp AT TIME ZONE %s <= now()
+    ON CONFLICT (borrowing_id, kind) DO NOTHING
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0008_borrowing_reminder"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            [(BACKFILL_OVERDUE_REMINDERS_SQL, [settings.TIME_ZONE])],
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,7 +1,11 @@
 import os
+from datetime import date
 
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import DEFERRED, Exists, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.translation import gettext_lazy as _
 from decimal import Decimal
 from dotenv import load_dotenv
 from rest_framework.exceptions import ValidationError
@@ -12,6 +16,91 @@ from book.models import Book
 load_dotenv()
 
 
+class DaysBetween(models.Func):
+    """Whole days from `start` to `end` (PostgreSQL date subtraction)."""
+
+    arg_joiner = " - "
+    template = "(%(expressions)s)"
+    output_field = models.IntegerField()
+
+    def __init__(self, end, start, **extra):
+        super().__init__(end, start, **extra)
+
+
+class BorrowingQuerySet(models.QuerySet):
+    def overdue(self, due_date):
+        """Active borrowings expected back on or before `due_date`."""
+        return self.filter(
+            expected_return_date__lte=due_date, actual_return_date__isnull=True
+        )
+
+    def returned_late(self):
+        return self.filter(
+            actual_return_date__isnull=False,
+            expected_return_date__lt=F("actual_return_date"),
+        )
+
+    def without_paid(self, payment_type):
+        """Borrowings that have no paid payment of `payment_type`."""
+        payments = self.model.payments.field.model.objects
+        return self.exclude(
+            Exists(
+                payments.filter(
+                    borrowing=OuterRef("pk"), type=payment_type, status="PAID"
+                )
+            )
+        )
+
+    def with_amounts(self):
+        """
+        Annotate the payment amount and the fine accrued so far in SQL.
+
+        The daily fee comes from the pricing snapshot, or from the books for
+        borrowings created before it existed. Active borrowings accrue the
+        fine up to today.
+        """
+        amount_field = models.DecimalField(max_digits=12, decimal_places=2)
+        books_fee = (
+            Borrowing.book.through.objects.filter(borrowing=OuterRef("pk"))
+            .values("borrowing")
+            .annotate(total=Sum("book__daily_fee"))
+            .values("total")
+        )
+        daily_fee = Coalesce(
+            F("daily_fee_total"),
+            Subquery(books_fee),
+            Value(Decimal(0)),
+            output_field=amount_field,
+        )
+        payment_days = DaysBetween(F("expected_return_date"), F("borrow_date")) + 1
+        fine_days = Greatest(
+            DaysBetween(
+                Coalesce(F("actual_return_date"), Value(date.today())),
+                F("expected_return_date"),
+            ),
+            0,
+        )
+        multiplier = fine_multiplier()
+        if multiplier is None:
+            fine_amount = Value(None, output_field=amount_field)
+        else:
+            fine_amount = models.ExpressionWrapper(
+                daily_fee * fine_days * Value(multiplier), output_field=amount_field
+            )
+        return self.annotate(
+            annotated_payment_amount=models.ExpressionWrapper(
+                daily_fee * payment_days, output_field=amount_field
+            ),
+            annotated_fine_amount=fine_amount,
+        )
+
+
+def fine_multiplier() -> Decimal | None:
+    """The FINE_MULTIPLIER setting, None when it isn't configured."""
+    multiplier = os.getenv("FINE_MULTIPLIER")
+    return Decimal(multiplier) if multiplier else None
+
+
 class Borrowing(models.Model):
     borrow_date = models.DateField(auto_now_add=True)
     expected_return_date = models.DateField()
@@ -20,25 +109,87 @@ class Borrowing(models.Model):
     user = models.ForeignKey(
         get_user_model(), on_delete=models.CASCADE, related_name="borrowings"
     )
+    # Pricing snapshot taken when the borrowing is created.
+    daily_fee_total = models.DecimalField(
+        max_digits=8, decimal_places=2, null=True, blank=True
+    )
+    book_count = models.PositiveIntegerField(null=True, blank=True)
+    book_titles = models.TextField(null=True, blank=True)
+
+    objects = BorrowingQuerySet.as_manager()
+
+    RETURN_DATE_FIELDS = ("expected_return_date", "actual_return_date")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_return_dates()
+        return instance
+
+    def remember_return_dates(self) -> None:
+        """Keep the stored return dates, to tell whether a save changes them."""
+        self._stored_return_dates = tuple(
+            self.__dict__.get(name, DEFERRED) for name in self.RETURN_DATE_FIELDS
+        )
+
+    @property
+    def return_dates_changed(self) -> bool:
+        return getattr(self, "_stored_return_dates", None) != tuple(
+            getattr(self, name) for name in self.RETURN_DATE_FIELDS
+        )
+
+    def take_snapshot(self, books) -> None:
+        """Freeze the fees and titles of the borrowed books."""
+        books = sorted(books, key=lambda book: book.title)
+        self.daily_fee_total = sum((book.daily_fee for book in books), Decimal(0))
+        self.book_count = len(books)
+        self.book_titles = ", ".join(book.title for book in books)
+
+    def get_daily_fee_total(self) -> Decimal:
+        if self.daily_fee_total is not None:
+            return self.daily_fee_total
+        return sum((book.daily_fee for book in self.book.all()), Decimal(0))
 
     def calculate_payment_amount(self) -> Decimal:
         delta_days = (self.expected_return_date - self.borrow_date).days + 1
-        amount = sum([book.daily_fee for book in self.book.all()]) * Decimal(delta_days)
+        amount = self.get_daily_fee_total() * Decimal(delta_days)
         return amount
 
     def calculate_fine_amount(self) -> Decimal:
         if self.actual_return_date > self.expected_return_date:
+            multiplier = fine_multiplier()
+            if multiplier is None:
+                raise ValidationError("Fine multiplier is not configured")
             delta_days = (self.actual_return_date - self.expected_return_date).days
-            amount = (
-                sum([book.daily_fee for book in self.book.all()])
-                * Decimal(delta_days)
-                * Decimal(os.getenv("FINE_MULTIPLIER"))
-            )
+            amount = self.get_daily_fee_total() * Decimal(delta_days) * multiplier
             return amount
         raise ValidationError("Borrowing is not overdue")
 
+    @property
+    def payment_amount(self) -> Decimal:
+        if hasattr(self, "annotated_payment_amount"):
+            return self.annotated_payment_amount
+        return self.calculate_payment_amount()
+
+    @property
+    def fine_amount(self) -> Decimal | None:
+        """
+        Fine for the days overdue so far, 0 when not overdue and None when
+        the fine multiplier isn't configured.
+        """
+        if hasattr(self, "annotated_fine_amount"):
+            return self.annotated_fine_amount
+        multiplier = fine_multiplier()
+        if multiplier is None:
+            return None
+        end_date = self.actual_return_date or date.today()
+        delta_days = max((end_date - self.expected_return_date).days, 0)
+        return self.get_daily_fee_total() * Decimal(delta_days) * multiplier
+
     @property
     def books_in_borrowing(self):
+        if self.book_titles is not None:
+            return self.book_titles
         return ", ".join([book.title for book in self.book.all()])
 
     def __str__(self):
@@ -46,3 +197,57 @@ class Borrowing(models.Model):
 
     class Meta:
         ordering = ["actual_return_date", "-borrow_date"]
+        indexes = [
+            models.Index(
+                fields=["actual_return_date", "-borrow_date", "id"],
+                name="borrowing_order_idx",
+            ),
+            models.Index(
+                fields=["user", "actual_return_date", "-borrow_date", "id"],
+                name="borrowing_user_order_idx",
+            ),
+            # Active borrowings by due date, for the overdue checks.
+            models.Index(
+                fields=["expected_return_date"],
+                condition=models.Q(actual_return_date__isnull=True),
+                name="borrowing_active_due_idx",
+            ),
+            # Borrowings returned late, which need a fine.
+            models.Index(
+                fields=["user"],
+                condition=models.Q(expected_return_date__lt=F("actual_return_date")),
+                name="borrowing_overdue_user_idx",
+            ),
+        ]
+
+
+class BorrowingReminder(models.Model):
+    """
+    A pending reminder about an active borrowing, fired at `remind_at`.
+
+    Rows only live until they fire or the books are returned, so the due
+    reminders are always a short range scan of the `remind_at` index.
+    """
+
+    class Kind(models.TextChoices):
+        DUE = "DUE", _("Due")
+        OVERDUE = "OVERDUE", _("Overdue")
+
+    borrowing = models.ForeignKey(
+        Borrowing, on_delete=models.CASCADE, related_name="reminders"
+    )
+    kind = models.CharField(max_length=8, choices=Kind.choices)
+    remind_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["borrowing", "kind"], name="unique_borrowing_reminder"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["remind_at", "id"], name="borrowing_reminder_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} reminder of borrowing {self.borrowing_id}"
@@ -0,0 +1,106 @@
+from datetime import date, datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from borrowing.models import Borrowing, BorrowingReminder
+from notification.outbox import enqueue_notifications
+
+
+REMINDER_BATCH_SIZE = 500
+HEADINGS = {
+    BorrowingReminder.Kind.DUE: "Borrowing due today:",
+    BorrowingReminder.Kind.OVERDUE: "Overdue borrowing:",
+}
+
+
+def borrowing_entry(heading: str, borrowing: Borrowing) -> str:
+    return (
+        f"{heading}\n"
+        f"User: {borrowing.user.full_name}\n"
+        f"Books: {borrowing.books_in_borrowing}\n"
+        f"Expected return: {borrowing.expected_return_date}\n"
+        f"Borrow on: {borrowing.borrow_date}"
+    )
+
+
+def reminder_times(expected_return_date: date) -> dict[str, datetime]:
+    """When a borrowing becomes due and overdue, at midnight local time."""
+    due = timezone.make_aware(datetime.combine(expected_return_date, time.min))
+    overdue = timezone.make_aware(
+        datetime.combine(expected_return_date + timedelta(days=1), time.min)
+    )
+    return {BorrowingReminder.Kind.DUE: due, BorrowingReminder.Kind.OVERDUE: overdue}
+
+
+def future_reminders(borrowing_id: int, expected_return_date: date, now=None):
+    """The reminders of an active borrowing that haven't fired yet."""
+    now = now or timezone.now()
+    return [
+        BorrowingReminder(borrowing_id=borrowing_id, kind=kind, remind_at=remind_at)
+        for kind, remind_at in reminder_times(expected_return_date).items()
+        if remind_at > now
+    ]
+
+
+def schedule_reminders(borrowing: Borrowing, created: bool = False) -> None:
+    """
+    (Re)schedule the reminders of a borrowing after its return dates changed.
+
+    A new borrowing only needs an INSERT and a returned one keeps none. A
+    changed one replaces its reminders that aren't due yet, while those
+    already due still fire, unless they are now scheduled for later.
+    """
+    if borrowing.actual_return_date is not None:
+        if not created:
+            cancel_reminders([borrowing.id])
+        return
+    # Unsaved values may still be strings, e.g. "2024-10-17".
+    expected_return_date = Borrowing._meta.get_field(
+        "expected_return_date"
+    ).to_python(borrowing.expected_return_date)
+    now = timezone.now()
+    reminders = future_reminders(borrowing.id, expected_return_date, now)
+    if not created:
+        BorrowingReminder.objects.filter(borrowing_id=borrowing.id).filter(
+            Q(remind_at__gt=now) | Q(kind__in=[reminder.kind for reminder in reminders])
+        ).delete()
+    BorrowingReminder.objects.bulk_create(reminders)
+
+
+def cancel_reminders(borrowing_ids) -> None:
+    BorrowingReminder.objects.filter(borrowing_id__in=borrowing_ids).delete()
+
+
+def send_due_reminders(batch_size: int = REMINDER_BATCH_SIZE) -> int:
+    """
+    Queue the notifications of the reminders due by now, then drop them.
+
+    Reminders are claimed with SKIP LOCKED and deleted in the transaction
+    that queues their notifications, so concurrent ticks never report one
+    twice. Returns how many reminders fired.
+    """
+    fired = 0
+    while True:
+        with transaction.atomic():
+            reminders = list(
+                BorrowingReminder.objects.filter(remind_at__lte=timezone.now())
+                .select_related("borrowing__user")
+                .select_for_update(skip_locked=True, of=("self",))
+                .order_by("remind_at", "id")[:batch_size]
+            )
+            if not reminders:
+                break
+            enqueue_notifications(
+                borrowing_entry(HEADINGS[reminder.kind], reminder.borrowing)
+                for reminder in reminders
+                if reminder.borrowing.actual_return_date is None
+            )
+            BorrowingReminder.objects.filter(
+                id__in=[reminder.id for reminder in reminders]
+            ).delete()
+        fired += len(reminders)
+        if len(reminders) < batch_size:
+            break
+    return fired
@@ -0,0 +1,77 @@
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Count
+
+from book.inventory import release_books
+from borrowing.models import Borrowing
+from borrowing.reminders import cancel_reminders
+from borrowing.signals import bump_borrowing_version
+
+
+FINE_URL = "http://127.0.0.1:8000/api/library/payments/create_fine"
+MAX_BULK_RETURNS = 500
+
+
+def return_borrowings(queryset, borrowing_ids: list[int]) -> list[dict]:
+    """
+    Return many borrowings in one transaction.
+
+    Only borrowings in `queryset` can be returned. The return date is set
+    with one UPDATE and the books go back to the inventory with one grouped
+    statement. Returns one result per id in input order: returned
+    borrowings report whether they are overdue (with the URL to pay the
+    fine), the others an error.
+    """
+    borrowing_ids = list(dict.fromkeys(borrowing_ids))
+    return_date = date.today()
+
+    with transaction.atomic():
+        # Locked in id order, so overlapping bulk returns can't deadlock.
+        borrowings = (
+            queryset.filter(id__in=borrowing_ids)
+            .order_by("id")
+            .select_for_update(of=("self",))
+            .in_bulk()
+        )
+        active_ids = {
+            borrowing.id
+            for borrowing in borrowings.values()
+            if borrowing.actual_return_date is None
+        }
+
+        if active_ids:
+            Borrowing.objects.filter(id__in=active_ids).update(
+                actual_return_date=return_date
+            )
+            copies = (
+                Borrowing.book.through.objects.filter(borrowing_id__in=active_ids)
+                .values("book_id")
+                .annotate(copies=Count("id"))
+            )
+            release_books({row["book_id"]: row["copies"] for row in copies})
+            cancel_reminders(active_ids)
+            bump_borrowing_version(
+                *{borrowings[borrowing_id].user_id for borrowing_id in active_ids}
+            )
+
+    results = []
+    for borrowing_id in borrowing_ids:
+        borrowing = borrowings.get(borrowing_id)
+        if borrowing is None:
+            results.append({"id": borrowing_id, "error": "Not found."})
+        elif borrowing.id not in active_ids:
+            results.append(
+                {"id": borrowing_id, "error": "Books have already been returned."}
+            )
+        else:
+            borrowing.actual_return_date = return_date
+            result = {
+                "id": borrowing_id,
+                "books": borrowing.books_in_borrowing,
+                "overdue": return_date > borrowing.expected_return_date,
+            }
+            if result["overdue"]:
+                result["fine_url"] = FINE_URL
+            results.append(result)
+    return results
@@ -1,15 +1,18 @@
 from django.db import transaction
 from rest_framework import serializers
 
+from book.inventory import reserve_books
 from book.models import Book
 from book.serializers import BookSerializer
 from borrowing.models import Borrowing
+from borrowing.returns import MAX_BULK_RETURNS
 from payment.serializers import PaymentSlimSerializer
 from user.serializers import UserShortSerializer
+from utils.fields import BulkPrimaryKeyRelatedField
 
 
 class BorrowingAdminSerializer(serializers.ModelSerializer):
-    book = serializers.PrimaryKeyRelatedField(
+    book = BulkPrimaryKeyRelatedField(
         many=True, queryset=Book.objects.all(), required=True
     )
 
@@ -18,22 +21,28 @@ class BorrowingAdminSerializer(serializers.ModelSerializer):
         fields = ["id", "user", "book", "expected_return_date"]
 
     def create(self, validated_data):
-        with transaction.atomic():
-            books_data = validated_data.pop("book")
-            borrowing = Borrowing.objects.create(**validated_data)
-
-            for book in books_data:
-                if book.inventory > 0:
-                    borrowing.book.add(book.id)
-                    book.inventory -= 1
-                    book.save()
+        books = list(dict.fromkeys(validated_data.pop("book")))
 
-                else:
-                    raise serializers.ValidationError(
+        with transaction.atomic():
+            unavailable = reserve_books([book.id for book in books])
+            if unavailable:
+                raise serializers.ValidationError(
+                    [
                         f"Book {book.title} isn't available for borrowing today."
-                    )
+                        for book in books
+                        if book.id in unavailable
+                    ]
+                )
 
+            borrowing = Borrowing(**validated_data)
+            borrowing.take_snapshot(books)
             borrowing.save()
+            Borrowing.book.through.objects.bulk_create(
+                [
+                    Borrowing.book.through(borrowing=borrowing, book=book)
+                    for book in books
+                ]
+            )
 
             return borrowing
 
@@ -52,6 +61,12 @@ class BorrowingListAdminSerializer(serializers.ModelSerializer):
     )
     user = UserShortSerializer()
     payment = PaymentSlimSerializer(many=True, source="payments")
+    payment_amount = serializers.DecimalField(
+        max_digits=12, decimal_places=2, read_only=True
+    )
+    fine_amount = serializers.DecimalField(
+        max_digits=12, decimal_places=2, read_only=True
+    )
 
     class Meta:
         model = Borrowing
@@ -63,6 +78,8 @@ class BorrowingListAdminSerializer(serializers.ModelSerializer):
             "book",
             "user",
             "payment",
+            "payment_amount",
+            "fine_amount",
         ]
 
 
@@ -81,3 +98,19 @@ class BorrowingListUserSerializer(BorrowingListAdminSerializer):
 
 class BorrowingRetrieveSerializer(BorrowingListAdminSerializer):
     book = BookSerializer(many=True, read_only=True)
+
+
+class BorrowingBulkReturnSerializer(serializers.Serializer):
+    borrowings = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RETURNS,
+    )
+
+
+class BorrowingReturnResultSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    books = serializers.CharField(required=False)
+    overdue = serializers.BooleanField(required=False)
+    fine_url = serializers.URLField(required=False)
+    error = serializers.CharField(required=False)
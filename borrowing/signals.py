@@ -1,20 +1,72 @@
-import asyncio
-
-from django.db import transaction
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
 from borrowing.models import Borrowing
-from utils.telegram import send_telegram_message
+from borrowing.reminders import schedule_reminders
+from notification.outbox import enqueue_notification
+from utils.cache import bump_version
+
+
+def bump_borrowing_version(*user_ids):
+    bump_version("borrowing", *[f"borrowing:user:{user_id}" for user_id in user_ids])
+
+
+def enqueue_borrowing_created(borrowing: Borrowing) -> None:
+    enqueue_notification(
+        f"New borrowing created: {borrowing.books_in_borrowing} "
+        f"by {borrowing.user.full_name}"
+    )
 
 
 @receiver(post_save, sender=Borrowing)
 def send_borrowing_notification(sender, instance, created, **kwargs):
-    if created:
-        transaction.on_commit(lambda: _send_borrowing_notification(instance))
+    if not created:
+        return
+    if instance.book_titles is None:
+        # Without a snapshot the titles are only known once books are added.
+        instance._notify_on_books_added = True
+    else:
+        enqueue_borrowing_created(instance)
+
+
+@receiver(m2m_changed, sender=Borrowing.book.through)
+def send_borrowing_notification_on_books_added(
+    sender, instance, action, reverse, **kwargs
+):
+    if (
+        action == "post_add"
+        and not reverse
+        and instance.__dict__.pop("_notify_on_books_added", False)
+    ):
+        enqueue_borrowing_created(instance)
+
+
+@receiver(post_save, sender=Borrowing)
+def schedule_borrowing_reminders(sender, instance, created, **kwargs):
+    if created or instance.return_dates_changed:
+        schedule_reminders(instance, created)
+        instance.remember_return_dates()
+
+
+@receiver(post_save, sender=Borrowing)
+@receiver(post_delete, sender=Borrowing)
+def bump_borrowing_version_on_change(sender, instance, **kwargs):
+    bump_borrowing_version(instance.user_id)
 
 
-def _send_borrowing_notification(instance):
-    message = (f"New borrowing created: {instance.books_in_borrowing} "
-               f"by {instance.user.full_name}")
-    asyncio.run(send_telegram_message(message))
+@receiver(m2m_changed, sender=Borrowing.book.through)
+def bump_borrowing_version_on_books_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        bump_borrowing_version(instance.user_id)
+    elif pk_set:
+        bump_borrowing_version(
+            *Borrowing.objects.filter(pk__in=pk_set)
+            .values_list("user_id", flat=True)
+            .distinct()
+        )
+    else:
+        bump_version("borrowing")
@@ -1,27 +1,156 @@
-import asyncio
 from datetime import date, timedelta
-from celery import shared_task
+from celery import chord, shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.db.models import F
 
 from borrowing.models import Borrowing
-from utils.telegram import send_telegram_message
+from borrowing.reminders import borrowing_entry, send_due_reminders
+from utils.telegram import pack_messages, send_telegram_messages
+
+
+OVERDUE_CHUNK_SIZE = 2000
+# Partitions that were reported stay marked for a couple of days, so re-runs
+# of a check skip them.
+PARTITION_DONE_TIMEOUT = 2 * 24 * 60 * 60
+
+
+def overdue_entries(due_date: date, id_range: tuple[int, int] = None):
+    """
+    Describe every borrowing overdue on `due_date`, `id_range` = [start, end).
+
+    Rows are streamed from a server-side cursor with their users joined in,
+    and the book titles come from the snapshot taken at borrowing time.
+    """
+    borrowings = (
+        Borrowing.objects.overdue(due_date)
+        .select_related("user")
+        .only(
+            "borrow_date",
+            "expected_return_date",
+            "book_titles",
+            "user__first_name",
+            "user__last_name",
+        )
+        .order_by("expected_return_date", "id")
+    )
+    if id_range is not None:
+        borrowings = borrowings.filter(id__gte=id_range[0], id__lt=id_range[1])
+    for borrowing in borrowings.iterator(chunk_size=OVERDUE_CHUNK_SIZE):
+        yield borrowing_entry("Overdue borrowing:", borrowing)
+
+
+def overdue_digest(due_date: date) -> list[str]:
+    """The borrowings overdue on `due_date` in Telegram-sized messages."""
+    return list(pack_messages(overdue_entries(due_date)))
 
 
 @shared_task
 def check_borrowings_overdue():
     overdue_date = date.today() + timedelta(days=1)
-    overdue_borrowings = Borrowing.objects.filter(
-        expected_return_date__lte=overdue_date, actual_return_date__isnull=True
+    messages = overdue_digest(overdue_date) or ["No borrowings overdue today."]
+    send_telegram_messages(messages)
+
+
+def overdue_partitions(due_date: date, size: int) -> list[int]:
+    """
+    Numbers of the id partitions holding borrowings overdue on `due_date`.
+
+    Partition n covers the ids in [n * size, (n + 1) * size), so the same
+    borrowings always land in the same partition and a re-run can tell which
+    ones were already reported.
+    """
+    return list(
+        Borrowing.objects.overdue(due_date)
+        .annotate(partition=F("id") / size)
+        .values_list("partition", flat=True)
+        .order_by("partition")
+        .distinct()
     )
 
-    if overdue_borrowings.exists():
-        for borrowing in overdue_borrowings:
-            message = (
-                f"Overdue borrowing:\n"
-                f"User: {borrowing.user.full_name}\n"
-                f"Books: {[book.title for book in borrowing.book.all()]}\n"
-                f"Expected return: {borrowing.expected_return_date}\n"
-                f"Borrow on: {borrowing.borrow_date}\n\n"
-            )
-            asyncio.run(send_telegram_message(message))
-    else:
-        asyncio.run(send_telegram_message("No borrowings overdue today."))
+
+def partition_key(due_date: date, size: int, partition: int) -> str:
+    return f"overdue:{due_date.isoformat()}:{size}:{partition}"
+
+
+class PartitionNotSent(Exception):
+    """Some messages of an overdue partition couldn't be sent."""
+
+
+@shared_task(
+    autoretry_for=(DatabaseError, PartitionNotSent), retry_backoff=True, max_retries=3
+)
+def check_overdue_partitions(due_date: str, size: int, partitions: list[int]):
+    """
+    Report the overdue borrowings of some id partitions.
+
+    Every partition is marked as reported once all its messages were sent,
+    so a retry or a re-run of the check only sends what is still missing.
+    A partition that wasn't fully sent raises PartitionNotSent.
+    """
+    due_date = date.fromisoformat(due_date)
+    totals = {"partitions": 0, "borrowings": 0, "messages": 0}
+    for partition in partitions:
+        key = partition_key(due_date, size, partition)
+        result = cache.get(key)
+        if result is None:
+            id_range = (partition * size, (partition + 1) * size)
+            entries = list(overdue_entries(due_date, id_range))
+            messages = list(pack_messages(entries))
+            sent = send_telegram_messages(messages)
+            if sent != len(messages):
+                raise PartitionNotSent(
+                    f"Partition {partition}: {sent} of {len(messages)} messages sent"
+                )
+            result = {"borrowings": len(entries), "messages": len(messages)}
+            cache.set(key, result, PARTITION_DONE_TIMEOUT)
+        totals["partitions"] += 1
+        for name, count in result.items():
+            totals[name] += count
+    return totals
+
+
+@shared_task
+def summarize_overdue_check(results: list[dict], due_date: str):
+    totals = {"partitions": 0, "borrowings": 0, "messages": 0}
+    for result in results:
+        for name, count in result.items():
+            totals[name] += count
+    message = (
+        f"Overdue check for {due_date}: {totals['borrowings']} borrowings "
+        f"reported in {totals['messages']} messages "
+        f"from {totals['partitions']} partitions."
+    )
+    send_telegram_messages([message])
+    return totals
+
+
+@shared_task
+def fan_out_overdue_check(due_date: str = None):
+    """
+    Split the overdue check over id partitions checked in parallel.
+
+    Partitions of OVERDUE_PARTITION_SIZE ids are dealt to at most
+    OVERDUE_CONCURRENCY subtasks, run as a chord whose callback sends a
+    summary. Pass the `due_date` of a failed run to re-run it.
+    """
+    if due_date is None:
+        due_date = (date.today() + timedelta(days=1)).isoformat()
+    size = settings.OVERDUE_PARTITION_SIZE
+    partitions = overdue_partitions(date.fromisoformat(due_date), size)
+    if not partitions:
+        send_telegram_messages(["No borrowings overdue today."])
+        return None
+
+    concurrency = min(settings.OVERDUE_CONCURRENCY, len(partitions))
+    header = [
+        check_overdue_partitions.s(due_date, size, partitions[n::concurrency])
+        for n in range(concurrency)
+    ]
+    return chord(header)(summarize_overdue_check.s(due_date)).id
+
+
+@shared_task
+def send_borrowing_reminders():
+    return send_due_reminders()
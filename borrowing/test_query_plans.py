@@ -0,0 +1,179 @@
+import json
+from datetime import date, timedelta
+
+from django.db import connection
+from django.test import TestCase
+
+from borrowing.models import Borrowing
+from payment.models import Payment
+
+
+USERS = 2_000
+BOOKS = 2_000
+BORROWINGS = 100_000
+ORDERING = ("actual_return_date", "-borrow_date", "id")
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Hot borrowing and payment queries must be served by indexes.
+
+    The tables are seeded with a realistic volume and analyzed, then every
+    query is explained and checked for sequential scans and sorts.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = date.today()
+        with connection.cursor() as cursor:
+            # Check foreign keys while seeding, instead of queueing deferred
+            # checks that every test would run again on teardown.
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(
+                """
+                INSERT INTO user_user (
+                    password, is_superuser, first_name, last_name,
+                    is_staff, is_active, date_joined, email
+                )
+                SELECT '!', false, 'First', 'Last', false, true, now(),
+                    'plan' || n || '@mail.com'
+                FROM generate_series(1, %s) AS n
+                """,
+                [USERS],
+            )
+            cursor.execute(
+                """
+                INSERT INTO book_book (title, author, cover, inventory, daily_fee)
+                SELECT 'Book ' || n, 'Author ' || n %% 300, 'SF', 10, 0.5
+                FROM generate_series(1, %s) AS n
+                """,
+                [BOOKS],
+            )
+            # One borrowing in 20 is still active, every 7th returned late.
+            cursor.execute(
+                """
+                INSERT INTO borrowing_borrowing (
+                    borrow_date, expected_return_date, actual_return_date,
+                    user_id, daily_fee_total, book_count, book_titles
+                )
+                SELECT borrow_date, borrow_date + 14,
+                    CASE
+                        WHEN n %% 20 = 0 THEN NULL
+                        WHEN n %% 7 = 0 THEN borrow_date + 20
+                        ELSE borrow_date + n %% 14
+                    END,
+                    (SELECT min(id) FROM user_user) + n %% %(users)s,
+                    0.5, 1, 'Book'
+                FROM (
+                    SELECT n, %(today)s::date - n %% 1500 AS borrow_date
+                    FROM generate_series(1, %(borrowings)s) AS n
+                ) AS seed
+                """,
+                {"users": USERS, "today": today, "borrowings": BORROWINGS},
+            )
+            cursor.execute(
+                """
+                INSERT INTO borrowing_borrowing_book (borrowing_id, book_id)
+                SELECT borrowing.id, (SELECT min(id) FROM book_book)
+                    + borrowing.id %% %s
+                FROM borrowing_borrowing AS borrowing
+                """,
+                [BOOKS],
+            )
+            # Most borrowings are paid, a few payments are still pending.
+            cursor.execute(
+                """
+                INSERT INTO payment_payment (
+                    status, type, borrowing_id, session_url, money_to_pay
+                )
+                SELECT CASE WHEN id % 50 = 0 THEN 'PENDING' ELSE 'PAID' END,
+                    'PAYMENT', id, '', 7
+                FROM borrowing_borrowing
+                UNION ALL
+                SELECT CASE WHEN id % 3 = 0 THEN 'PENDING' ELSE 'PAID' END,
+                    'FINE', id, '', 6
+                FROM borrowing_borrowing
+                WHERE expected_return_date < actual_return_date
+                """
+            )
+            cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+            cursor.execute(
+                "ANALYZE user_user, book_book, borrowing_borrowing, "
+                "borrowing_borrowing_book, payment_payment"
+            )
+            cursor.execute("SELECT max(id) FROM user_user")
+            cls.user_id = cursor.fetchone()[0]
+
+    def assertIndexed(self, queryset, allow_sort=False):
+        plan = json.loads(queryset.explain(format="json"))[0]["Plan"]
+        for node in plan_nodes(plan):
+            self.assertNotEqual(
+                node["Node Type"],
+                "Seq Scan",
+                f"Sequential scan on {node.get('Relation Name')}:\n"
+                f"{queryset.query}",
+            )
+            if not allow_sort:
+                self.assertNotIn(
+                    node["Node Type"],
+                    ("Sort", "Incremental Sort"),
+                    f"Sort in the plan of:\n{queryset.query}",
+                )
+
+    def test_user_borrowings_page(self):
+        queryset = Borrowing.objects.filter(user_id=self.user_id).order_by(*ORDERING)
+
+        self.assertIndexed(queryset[:10])
+
+    def test_active_borrowings_page(self):
+        queryset = Borrowing.objects.filter(actual_return_date__isnull=True).order_by(
+            *ORDERING
+        )
+
+        self.assertIndexed(queryset[:10])
+
+    def test_active_borrowings_of_users(self):
+        user_ids = [self.user_id, self.user_id - 1, self.user_id - 2]
+        queryset = Borrowing.objects.filter(
+            user_id__in=user_ids, actual_return_date__isnull=True
+        ).order_by(*ORDERING)
+
+        # Rows of several users are merged, which needs a (small) sort.
+        self.assertIndexed(queryset[:10], allow_sort=True)
+
+    def test_overdue_borrowings(self):
+        queryset = Borrowing.objects.overdue(date.today() + timedelta(days=1))
+
+        self.assertIndexed(queryset.order_by("id"), allow_sort=True)
+
+    def test_borrowings_returned_late_without_paid_fine(self):
+        queryset = (
+            Borrowing.objects.returned_late()
+            .without_paid(Payment.Type.FINE)
+            .filter(user_id=self.user_id)
+        )
+
+        self.assertIndexed(queryset, allow_sort=True)
+
+    def test_borrowing_without_paid_payment(self):
+        borrowing_id = Borrowing.objects.filter(user_id=self.user_id).first().id
+        # Looked up with in_bulk() by the payment serializers, without ordering.
+        queryset = (
+            Borrowing.objects.without_paid(Payment.Type.PAYMENT)
+            .filter(user_id=self.user_id)
+            .filter(pk__in=[borrowing_id])
+            .order_by()
+        )
+
+        self.assertIndexed(queryset)
+
+    def test_pending_payments_of_user(self):
+        queryset = Payment.objects.unpaid().filter(borrowing__user_id=self.user_id)
+
+        self.assertIndexed(queryset)
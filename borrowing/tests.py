@@ -1,11 +1,31 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
 from django.contrib.auth import get_user_model
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 
+from book.inventory import shard_inventory
 from book.models import Book
-from borrowing.models import Borrowing
+from borrowing.management.commands.benchmark_api import ENDPOINTS
+from borrowing.models import Borrowing, BorrowingReminder
+from borrowing.reminders import reminder_times, send_due_reminders
+from borrowing.returns import FINE_URL
 from borrowing.serializers import (
     BorrowingListUserSerializer,
     BorrowingListAdminSerializer,
@@ -13,8 +33,20 @@ from borrowing.serializers import (
     BorrowingUserSerializer,
     BorrowingAdminSerializer,
 )
+from borrowing.tasks import (
+    PartitionNotSent,
+    check_borrowings_overdue,
+    check_overdue_partitions,
+    fan_out_overdue_check,
+    overdue_partitions,
+)
+from library_api_service.celery import app as celery_app
+from notification.models import Notification
+from payment.models import Payment
+from utils.telegram import pack_messages
 
 BORROWING_URL = reverse("borrowing:borrowing-list")
+BORROWING_RETURN_URL = reverse("borrowing:borrowing-return-books")
 
 
 def sample_book(**kwargs):
@@ -42,6 +74,10 @@ def detail_url(borrowing_id):
     return reverse("borrowing:borrowing-detail", args=[borrowing_id])
 
 
+def return_url(borrowing_id):
+    return reverse("borrowing:borrowing-return-book", args=[borrowing_id])
+
+
 class UnauthenticatedBorrowingAPITests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -113,6 +149,34 @@ class AuthenticatedBorrowingAPITests(TestCase):
         self.assertIn(serializer_in.data, response.data["results"])
         self.assertNotIn(serializer_out.data, response.data["results"])
 
+    def test_borrowing_list_not_modified(self):
+        borrowing = Borrowing.objects.create(
+            expected_return_date="2024-10-17",
+            user=self.user,
+        )
+        borrowing.book.add(sample_book())
+        response = self.client.get(BORROWING_URL)
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(
+                BORROWING_URL, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_borrowing_list_etag_changes_with_user_borrowings(self):
+        response = self.client.get(BORROWING_URL)
+
+        borrowing = Borrowing.objects.create(
+            expected_return_date="2024-10-17",
+            user=self.user,
+        )
+        borrowing.book.add(sample_book())
+        modified = self.client.get(BORROWING_URL, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(modified.data["results"]), 1)
+
     def test_retrieve_borrowing(self):
         book1 = sample_book(title="Book1")
         book2 = sample_book(title="Book2")
@@ -126,6 +190,7 @@ class AuthenticatedBorrowingAPITests(TestCase):
 
         url = detail_url(borrowing.id)
         response = self.client.get(url)
+        borrowing.refresh_from_db()
         serializer = BorrowingRetrieveSerializer(borrowing)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -146,6 +211,21 @@ class AuthenticatedBorrowingAPITests(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_retrieve_other_borrowing_not_found_if_modified_since(self):
+        other_user = sample_user(email="other_user@mail.com")
+        borrowing_other_user = Borrowing.objects.create(
+            expected_return_date="2024-10-17",
+            user=other_user,
+        )
+        future = http_date(time.time() + 3600)
+
+        for borrowing_id in (borrowing_other_user.id, 1000):
+            response = self.client.get(
+                detail_url(borrowing_id), HTTP_IF_MODIFIED_SINCE=future
+            )
+
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_create_borrowing(self):
         book1 = sample_book(title="Book1")
         book2 = sample_book(title="Book2")
@@ -272,7 +352,9 @@ class AdminBorrowingAPITests(TestCase):
 
         response = self.client.get(BORROWING_URL, {"is_active": "True"})
 
+        borrowing1.refresh_from_db()
         serializer_in = BorrowingListAdminSerializer(borrowing1)
+        borrowing2.refresh_from_db()
         serializer_out = BorrowingListAdminSerializer(borrowing2)
 
         self.assertIn(serializer_in.data, response.data["results"])
@@ -308,8 +390,11 @@ class AdminBorrowingAPITests(TestCase):
 
         response = self.client.get(BORROWING_URL, {"user_id": [self.user.id, user1.id]})
 
+        borrowing.refresh_from_db()
         serializer_in = BorrowingListAdminSerializer(borrowing)
+        borrowing1.refresh_from_db()
         serializer_in1 = BorrowingListAdminSerializer(borrowing1)
+        borrowing2.refresh_from_db()
         serializer_out2 = BorrowingListAdminSerializer(borrowing2)
 
         self.assertIn(serializer_in.data, response.data["results"])
@@ -329,6 +414,7 @@ class AdminBorrowingAPITests(TestCase):
 
         url = detail_url(borrowing.id)
         response = self.client.get(url)
+        borrowing.refresh_from_db()
         serializer = BorrowingRetrieveSerializer(borrowing)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -346,6 +432,7 @@ class AdminBorrowingAPITests(TestCase):
 
         url = detail_url(borrowing_other_user.id)
         response = self.client.get(url)
+        borrowing_other_user.refresh_from_db()
         serializer = BorrowingRetrieveSerializer(borrowing_other_user)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -417,3 +504,849 @@ class AdminBorrowingAPITests(TestCase):
         response = self.client.delete(url)
 
         self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class BorrowingReservationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(is_staff=True)
+        self.client.force_authenticate(user=self.user)
+
+    def test_create_borrowing_query_count(self):
+        books = [sample_book(title=f"Book{i}") for i in range(20)]
+        payload = {
+            "expected_return_date": "2024-10-17",
+            "book": [book.id for book in books],
+            "user": self.user.id,
+        }
+        serializer = BorrowingAdminSerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+
+        with self.assertNumQueries(6):
+            borrowing = serializer.save()
+
+        self.assertEqual(borrowing.book.count(), 20)
+        self.assertEqual(
+            set(Book.objects.values_list("inventory", flat=True)), {2}
+        )
+
+    def test_create_borrowing_reports_unavailable_books(self):
+        available = sample_book(title="Available")
+        missing1 = sample_book(title="Missing1", inventory=0)
+        missing2 = sample_book(title="Missing2", inventory=0)
+        payload = {
+            "expected_return_date": "2024-10-17",
+            "book": [available.id, missing1.id, missing2.id],
+            "user": self.user.id,
+        }
+
+        response = self.client.post(BORROWING_URL, payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data,
+            [
+                "Book Missing1 isn't available for borrowing today.",
+                "Book Missing2 isn't available for borrowing today.",
+            ],
+        )
+        available.refresh_from_db()
+        self.assertEqual(available.inventory, 3)
+        self.assertFalse(Borrowing.objects.exists())
+
+
+class BorrowingPricingSnapshotTests(TestCase):
+    def setUp(self):
+        self.user = sample_user(is_staff=True)
+
+    def create_borrowing(self, books):
+        serializer = BorrowingAdminSerializer(
+            data={
+                "expected_return_date": date.today() + timedelta(days=4),
+                "book": [book.id for book in books],
+                "user": self.user.id,
+            }
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_snapshot_taken_on_create(self):
+        books = [
+            sample_book(title="B Title", daily_fee=1.25),
+            sample_book(title="A Title", daily_fee=0.5),
+        ]
+
+        borrowing = Borrowing.objects.get(id=self.create_borrowing(books).id)
+
+        self.assertEqual(borrowing.daily_fee_total, Decimal("1.75"))
+        self.assertEqual(borrowing.book_count, 2)
+        self.assertEqual(borrowing.book_titles, "A Title, B Title")
+        with self.assertNumQueries(0):
+            self.assertEqual(borrowing.books_in_borrowing, "A Title, B Title")
+            self.assertEqual(
+                borrowing.calculate_payment_amount(), Decimal("1.75") * 5
+            )
+
+    def test_snapshot_freezes_prices(self):
+        book = sample_book(daily_fee=1)
+        borrowing = self.create_borrowing([book])
+
+        Book.objects.filter(id=book.id).update(daily_fee=10, title="Renamed")
+        borrowing = Borrowing.objects.get(id=borrowing.id)
+
+        self.assertEqual(borrowing.calculate_payment_amount(), Decimal(5))
+        self.assertEqual(borrowing.books_in_borrowing, "Test Book Title")
+
+    def test_borrowing_without_snapshot_reads_books(self):
+        borrowing = Borrowing.objects.create(
+            expected_return_date=date.today(), user=self.user
+        )
+        borrowing.book.add(sample_book(title="Legacy", daily_fee=2))
+
+        self.assertEqual(borrowing.calculate_payment_amount(), Decimal(2))
+        self.assertEqual(borrowing.books_in_borrowing, "Legacy")
+
+
+class BorrowingAmountAnnotationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(is_staff=True)
+        self.client.force_authenticate(user=self.user)
+
+    def create_borrowings(self, count, **kwargs):
+        book = sample_book(title=f"Book {count}", daily_fee=1.5)
+        for _ in range(count):
+            borrowing = Borrowing.objects.create(user=self.user, **kwargs)
+            borrowing.book.add(book)
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(BORROWING_URL, {"user_id": self.user.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        self.create_borrowings(1, expected_return_date=date.today())
+        one_row_queries = self.list_queries()
+
+        self.create_borrowings(9, expected_return_date=date.today())
+
+        self.assertEqual(self.list_queries(), one_row_queries)
+
+    @mock.patch.dict(os.environ, {"FINE_MULTIPLIER": "2"})
+    def test_amounts_of_overdue_borrowings(self):
+        today = date.today()
+        active = Borrowing.objects.create(
+            user=self.user, expected_return_date=today - timedelta(days=3)
+        )
+        active.take_snapshot([sample_book(daily_fee=2)])
+        active.save()
+        Borrowing.objects.filter(id=active.id).update(
+            borrow_date=today - timedelta(days=10)
+        )
+
+        response = self.client.get(detail_url(active.id))
+
+        # 8 days booked, 3 days overdue so far at FINE_MULTIPLIER 2.
+        self.assertEqual(response.data["payment_amount"], "16.00")
+        self.assertEqual(response.data["fine_amount"], "12.00")
+        active.refresh_from_db()
+        self.assertEqual(active.payment_amount, Decimal(16))
+        self.assertEqual(active.fine_amount, Decimal(12))
+
+    @mock.patch.dict(os.environ)
+    def test_list_without_fine_multiplier(self):
+        os.environ.pop("FINE_MULTIPLIER", None)
+        self.create_borrowings(1, expected_return_date=date.today())
+
+        response = self.client.get(BORROWING_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data["results"][0]["fine_amount"])
+
+    def test_fine_amounts_are_revalidated_every_day(self):
+        self.create_borrowings(1, expected_return_date=date.today())
+        response = self.client.get(BORROWING_URL)
+        self.assertEqual(
+            self.client.get(
+                BORROWING_URL, HTTP_IF_NONE_MATCH=response["ETag"]
+            ).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+
+        tomorrow = date.today() + timedelta(days=1)
+        with mock.patch("borrowing.views.date") as mock_date:
+            mock_date.today.return_value = tomorrow
+            modified = self.client.get(
+                BORROWING_URL, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+
+
+class BulkReturnBorrowingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        self.book = sample_book(title="Shared", inventory=0)
+
+    def create_borrowing(self, user=None, expected_return_date=None, books=()):
+        borrowing = Borrowing(
+            user=user or self.user,
+            expected_return_date=expected_return_date or date.today(),
+        )
+        books = Book.objects.filter(id__in=[self.book.id, *[b.id for b in books]])
+        borrowing.take_snapshot(books)
+        borrowing.save()
+        borrowing.book.add(*books)
+        return borrowing
+
+    def test_bulk_return(self):
+        on_time = self.create_borrowing()
+        overdue = self.create_borrowing(
+            expected_return_date=date.today() - timedelta(days=2)
+        )
+        returned = self.create_borrowing()
+        returned.actual_return_date = date.today()
+        returned.save()
+
+        response = self.client.post(
+            BORROWING_RETURN_URL,
+            {"borrowings": [overdue.id, on_time.id, returned.id, 999999]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            [
+                {
+                    "id": overdue.id,
+                    "books": "Shared",
+                    "overdue": True,
+                    "fine_url": FINE_URL,
+                },
+                {
+                    "id": on_time.id,
+                    "books": "Shared",
+                    "overdue": False,
+                },
+                {"id": returned.id, "error": "Books have already been returned."},
+                {"id": 999999, "error": "Not found."},
+            ],
+        )
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 2)
+        self.assertEqual(
+            Borrowing.objects.filter(actual_return_date=date.today()).count(), 3
+        )
+
+    def test_bulk_return_query_count_does_not_depend_on_size(self):
+        other_book = sample_book(title="Other", inventory=0)
+        borrowings = [self.create_borrowing(books=[other_book]) for _ in range(30)]
+
+        with self.assertNumQueries(7):
+            self.client.post(
+                BORROWING_RETURN_URL,
+                {"borrowings": [borrowing.id for borrowing in borrowings]},
+                format="json",
+            )
+
+        other_book.refresh_from_db()
+        self.assertEqual(other_book.inventory, 30)
+
+    def test_user_can_return_only_own_borrowings(self):
+        user = sample_user(email="reader@mail.com")
+        own = self.create_borrowing(user=user)
+        other = self.create_borrowing()
+        self.client.force_authenticate(user=user)
+
+        response = self.client.post(
+            BORROWING_RETURN_URL, {"borrowings": [own.id, other.id]}, format="json"
+        )
+
+        self.assertNotIn("error", response.data[0])
+        self.assertEqual(response.data[1]["error"], "Not found.")
+        other.refresh_from_db()
+        self.assertIsNone(other.actual_return_date)
+
+    def test_return_book_uses_bulk_return(self):
+        borrowing = self.create_borrowing(
+            expected_return_date=date.today() - timedelta(days=1)
+        )
+
+        response = self.client.post(return_url(borrowing.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["fine_url"], FINE_URL)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 1)
+
+        response = self.client.post(return_url(borrowing.id))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BorrowingPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        today = date.today()
+        for days in range(7):
+            borrowing = Borrowing.objects.create(
+                user=self.user, expected_return_date=today
+            )
+            Borrowing.objects.filter(id=borrowing.id).update(
+                borrow_date=today - timedelta(days=days % 3),
+                actual_return_date=None if days % 2 else today - timedelta(days),
+            )
+        self.ordered_ids = list(
+            Borrowing.objects.order_by(
+                "actual_return_date", "-borrow_date", "id"
+            ).values_list("id", flat=True)
+        )
+
+    def test_walk_cursor_pages_forward_and_back(self):
+        pages = [self.client.get(BORROWING_URL, {"cursor": "", "page_size": 2})]
+        while pages[-1].data["next"]:
+            pages.append(self.client.get(pages[-1].data["next"]))
+        backward = [pages[-1]]
+        while backward[-1].data["previous"]:
+            backward.append(self.client.get(backward[-1].data["previous"]))
+
+        forward_ids = [
+            borrowing["id"] for page in pages for borrowing in page.data["results"]
+        ]
+        backward_ids = [
+            borrowing["id"]
+            for page in reversed(backward)
+            for borrowing in page.data["results"]
+        ]
+        self.assertEqual(forward_ids, self.ordered_ids)
+        self.assertEqual(backward_ids, self.ordered_ids)
+        self.assertNotIn("count", pages[0].data)
+
+    def test_page_size_is_bounded(self):
+        response = self.client.get(BORROWING_URL, {"page_size": 3})
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assertEqual(response.data["count"], 7)
+
+        response = self.client.get(BORROWING_URL, {"page_size": 1000})
+        self.assertEqual(len(response.data["results"]), 7)
+
+    def test_skip_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                BORROWING_URL, {"count": "false", "page_size": 3, "page": 2}
+            )
+
+        self.assertNotIn("count", response.data)
+        self.assertEqual(
+            [borrowing["id"] for borrowing in response.data["results"]],
+            self.ordered_ids[3:6],
+        )
+        self.assertIn("page=3", response.data["next"])
+        self.assertIn("page=1", response.data["previous"])
+        for query in queries.captured_queries:
+            self.assertNotIn("COUNT(", query["sql"])
+
+        response = self.client.get(BORROWING_URL, {"count": "false", "page": 3})
+        self.assertIsNone(response.data["next"])
+
+
+class BorrowingBookFieldTests(TestCase):
+    def setUp(self):
+        self.user = sample_user(is_staff=True)
+
+    def test_books_resolved_in_one_query(self):
+        books = [sample_book(title=f"Book{i}") for i in range(20)]
+        book_ids = [book.id for book in reversed(books)]
+        serializer = BorrowingAdminSerializer(
+            data={
+                "expected_return_date": "2024-10-17",
+                "book": book_ids,
+                "user": self.user.id,
+            }
+        )
+
+        # One query for the books and one for the user.
+        with self.assertNumQueries(2):
+            self.assertTrue(serializer.is_valid())
+
+        self.assertEqual(
+            [book.id for book in serializer.validated_data["book"]], book_ids
+        )
+
+    def test_missing_and_invalid_books_reported(self):
+        book = sample_book()
+        serializer = BorrowingAdminSerializer(
+            data={
+                "expected_return_date": "2024-10-17",
+                "book": [book.id, 999998, 999999],
+                "user": self.user.id,
+            }
+        )
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            serializer.errors["book"],
+            [
+                'Invalid pk "999998" - object does not exist.',
+                'Invalid pk "999999" - object does not exist.',
+            ],
+        )
+
+        serializer = BorrowingAdminSerializer(
+            data={
+                "expected_return_date": "2024-10-17",
+                "book": [book.id, "abc"],
+                "user": self.user.id,
+            }
+        )
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            serializer.errors["book"],
+            ["Incorrect type. Expected pk value, received str."],
+        )
+
+
+@mock.patch.dict(os.environ, {"FINE_MULTIPLIER": "2"})
+class SeedLibraryCommandTests(TestCase):
+    def seed(self, **options):
+        options = {
+            "users": 20,
+            "books": 15,
+            "borrowings": 300,
+            "batch_size": 64,
+            "seed": 7,
+            "stdout": io.StringIO(),
+            **options,
+        }
+        call_command("seed_library", **options)
+
+    def snapshot(self):
+        return list(
+            Borrowing.objects.order_by("id").values_list(
+                "borrow_date",
+                "expected_return_date",
+                "actual_return_date",
+                "user__email",
+                "daily_fee_total",
+                "book_titles",
+            )
+        )
+
+    def test_seeds_consistent_library(self):
+        self.seed()
+
+        self.assertEqual(get_user_model().objects.count(), 20)
+        self.assertEqual(Book.objects.count(), 15)
+        self.assertEqual(Borrowing.objects.count(), 300)
+        self.assertEqual(Payment.objects.filter(type=Payment.Type.PAYMENT).count(), 300)
+        self.assertEqual(
+            Payment.objects.filter(type=Payment.Type.FINE).count(),
+            Borrowing.objects.returned_late().count(),
+        )
+        for borrowing in Borrowing.objects.prefetch_related("book")[:50]:
+            books = sorted(borrowing.book.all(), key=lambda book: book.title)
+            self.assertEqual(borrowing.book_count, len(books))
+            self.assertEqual(
+                borrowing.book_titles, ", ".join(book.title for book in books)
+            )
+            self.assertEqual(
+                borrowing.daily_fee_total, sum(book.daily_fee for book in books)
+            )
+            self.assertLess(borrowing.borrow_date, borrowing.expected_return_date)
+            if borrowing.actual_return_date is not None:
+                self.assertLessEqual(borrowing.actual_return_date, date.today())
+        for reminder in BorrowingReminder.objects.select_related("borrowing"):
+            self.assertIsNone(reminder.borrowing.actual_return_date)
+            self.assertEqual(
+                reminder.remind_at,
+                reminder_times(reminder.borrowing.expected_return_date)[reminder.kind],
+            )
+        self.assertFalse(
+            BorrowingReminder.objects.filter(remind_at__lte=timezone.now()).exists()
+        )
+
+    def test_same_seed_generates_same_data(self):
+        self.seed()
+        first = self.snapshot()
+        Borrowing.objects.all().delete()
+        Book.objects.all().delete()
+        get_user_model().objects.all().delete()
+
+        self.seed()
+
+        self.assertEqual(self.snapshot(), first)
+
+    def test_seed_can_only_be_used_once(self):
+        self.seed()
+
+        with self.assertRaises(CommandError):
+            self.seed()
+        self.seed(seed=8)
+        self.assertEqual(Borrowing.objects.count(), 600)
+
+
+class OverdueDigestTests(TestCase):
+    def setUp(self):
+        self.user = sample_user(first_name="Ann", last_name="Reader")
+        self.books = [
+            sample_book(title=f"{n} {'Long ' * 19}", daily_fee=Decimal("0.50"))
+            for n in range(3)
+        ]
+
+    def create_borrowing(self, expected_return_date, **kwargs):
+        borrowing = Borrowing(
+            user=self.user, expected_return_date=expected_return_date, **kwargs
+        )
+        borrowing.take_snapshot(self.books)
+        borrowing.save()
+        borrowing.book.add(*self.books)
+        return borrowing
+
+    @mock.patch("borrowing.tasks.send_telegram_messages")
+    def test_overdue_borrowings_are_packed_into_telegram_messages(self, send):
+        today = date.today()
+        overdue = [
+            self.create_borrowing(today - timedelta(days=n)) for n in range(30)
+        ]
+        self.create_borrowing(today + timedelta(days=5))
+        self.create_borrowing(
+            today - timedelta(days=3), actual_return_date=today - timedelta(days=4)
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            check_borrowings_overdue()
+
+        self.assertEqual(len(queries), 1)
+        send.assert_called_once()
+        messages = send.call_args.args[0]
+        self.assertGreater(len(messages), 1)
+        self.assertLess(len(messages), len(overdue))
+        for message in messages:
+            self.assertLessEqual(len(message), 4096)
+        entries = "\n\n".join(messages).split("\n\n")
+        self.assertEqual(len(entries), len(overdue))
+        for entry, borrowing in zip(entries, reversed(overdue)):
+            self.assertIn("User: Ann Reader", entry)
+            self.assertIn(f"Books: {borrowing.book_titles}", entry)
+            self.assertIn(f"Expected return: {borrowing.expected_return_date}", entry)
+
+    @mock.patch("borrowing.tasks.send_telegram_messages")
+    def test_no_overdue_borrowings(self, send):
+        self.create_borrowing(date.today() + timedelta(days=5))
+
+        check_borrowings_overdue()
+
+        send.assert_called_once_with(["No borrowings overdue today."])
+
+    def test_pack_messages(self):
+        parts = ["a" * 4, "b" * 4, "c" * 12, "d" * 3]
+
+        self.assertEqual(
+            list(pack_messages(parts, separator="|", limit=10)),
+            ["aaaa|bbbb", "c" * 10, "cc|ddd"],
+        )
+        self.assertEqual(list(pack_messages([])), [])
+
+
+@override_settings(OVERDUE_PARTITION_SIZE=10, OVERDUE_CONCURRENCY=2)
+@mock.patch("borrowing.tasks.send_telegram_messages", side_effect=len)
+class OverdueFanOutTests(TestCase):
+    def setUp(self):
+        # Run the chord in process, like a worker would.
+        for name in ("task_always_eager", "task_eager_propagates"):
+            self.addCleanup(setattr, celery_app.conf, name, celery_app.conf[name])
+            celery_app.conf[name] = True
+        cache.clear()
+        user = sample_user(first_name="Ann", last_name="Reader")
+        book = sample_book(daily_fee=Decimal("0.50"))
+        self.overdue = []
+        for n in range(45):
+            borrowing = Borrowing(
+                user=user, expected_return_date=date.today() - timedelta(days=1)
+            )
+            if n % 3 == 0:
+                borrowing.actual_return_date = date.today()
+            borrowing.take_snapshot([book])
+            borrowing.save()
+            if n % 3:
+                self.overdue.append(borrowing.id)
+        self.due_date = date.today() + timedelta(days=1)
+
+    @staticmethod
+    def sent_entries(send):
+        return [
+            entry
+            for call in send.call_args_list
+            for message in call.args[0]
+            for entry in message.split("\n\n")
+            if entry.startswith("Overdue borrowing:")
+        ]
+
+    def test_partitions_hold_overdue_ids(self, send):
+        partitions = overdue_partitions(self.due_date, 10)
+
+        self.assertEqual(partitions, sorted({pk // 10 for pk in self.overdue}))
+
+    def test_every_partition_is_reported_with_a_summary(self, send):
+        fan_out_overdue_check()
+
+        self.assertEqual(len(self.sent_entries(send)), len(self.overdue))
+        summary = send.call_args_list[-1].args[0]
+        self.assertEqual(len(summary), 1)
+        partitions = overdue_partitions(self.due_date, 10)
+        self.assertIn(f"{len(self.overdue)} borrowings", summary[0])
+        self.assertIn(f"from {len(partitions)} partitions", summary[0])
+
+    def test_re_run_only_reports_missing_partitions(self, send):
+        partitions = overdue_partitions(self.due_date, 10)
+        # A first run that only got through the first partition.
+        check_overdue_partitions(self.due_date.isoformat(), 10, partitions[:1])
+        reported = len(self.sent_entries(send))
+        send.reset_mock()
+
+        fan_out_overdue_check(self.due_date.isoformat())
+
+        self.assertEqual(len(self.sent_entries(send)), len(self.overdue) - reported)
+        summary = send.call_args_list[-1].args[0][0]
+        self.assertIn(f"{len(self.overdue)} borrowings", summary)
+
+    def test_unsent_partitions_are_not_marked_reported(self, send):
+        partitions = overdue_partitions(self.due_date, 10)
+        send.side_effect = lambda messages: 0
+
+        with self.assertRaises(PartitionNotSent):
+            check_overdue_partitions.run(
+                self.due_date.isoformat(), 10, partitions[:1]
+            )
+        send.side_effect = len
+        send.reset_mock()
+
+        check_overdue_partitions(self.due_date.isoformat(), 10, partitions[:1])
+
+        self.assertTrue(self.sent_entries(send))
+
+    def test_nothing_overdue(self, send):
+        Borrowing.objects.update(actual_return_date=date.today())
+
+        fan_out_overdue_check()
+
+        send.assert_called_once_with(["No borrowings overdue today."])
+
+
+class BorrowingReminderTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(first_name="Ann", last_name="Reader")
+        self.client.force_authenticate(user=self.user)
+        self.book = sample_book(title="Dune")
+
+    def create_borrowing(self, days):
+        self.client.post(
+            BORROWING_URL,
+            {
+                "book": [self.book.id],
+                "expected_return_date": date.today() + timedelta(days=days),
+            },
+        )
+        return Borrowing.objects.filter(user=self.user).latest("id")
+
+    def reminders(self, borrowing):
+        return dict(borrowing.reminders.values_list("kind", "remind_at"))
+
+    def test_new_borrowing_is_reminded_when_due_and_overdue(self):
+        borrowing = self.create_borrowing(days=3)
+
+        times = reminder_times(date.today() + timedelta(days=3))
+        self.assertEqual(self.reminders(borrowing), times)
+        self.assertEqual(
+            timezone.localtime(times[BorrowingReminder.Kind.OVERDUE]).date(),
+            date.today() + timedelta(days=4),
+        )
+
+    def test_changed_due_date_reschedules_reminders(self):
+        borrowing = self.create_borrowing(days=3)
+
+        borrowing.expected_return_date = date.today() + timedelta(days=10)
+        borrowing.save()
+
+        self.assertEqual(
+            self.reminders(borrowing),
+            reminder_times(date.today() + timedelta(days=10)),
+        )
+
+    def test_save_without_date_change_keeps_due_reminders(self):
+        borrowing = self.create_borrowing(days=3)
+        due = timezone.now() - timedelta(minutes=1)
+        borrowing.reminders.filter(kind=BorrowingReminder.Kind.DUE).update(
+            remind_at=due
+        )
+
+        borrowing = Borrowing.objects.get(id=borrowing.id)
+        borrowing.book_titles = "Dune (2nd edition)"
+        borrowing.save()
+
+        self.assertEqual(self.reminders(borrowing)[BorrowingReminder.Kind.DUE], due)
+
+    def test_changed_due_date_keeps_reminders_already_due(self):
+        borrowing = self.create_borrowing(days=3)
+        due = timezone.now() - timedelta(minutes=1)
+        borrowing.reminders.filter(kind=BorrowingReminder.Kind.OVERDUE).update(
+            remind_at=due
+        )
+
+        borrowing = Borrowing.objects.get(id=borrowing.id)
+        borrowing.expected_return_date = date.today() - timedelta(days=2)
+        borrowing.save()
+
+        overdue = BorrowingReminder.Kind.OVERDUE
+        self.assertEqual(self.reminders(borrowing), {overdue: due})
+
+    def test_return_cancels_reminders(self):
+        borrowing = self.create_borrowing(days=3)
+
+        self.client.post(return_url(borrowing.id))
+
+        self.assertFalse(borrowing.reminders.exists())
+
+    def test_due_reminders_are_queued_once(self):
+        borrowings = [self.create_borrowing(days=days) for days in (1, 2, 5)]
+        Notification.objects.all().delete()
+        BorrowingReminder.objects.filter(borrowing__in=borrowings[:2]).update(
+            remind_at=timezone.now() - timedelta(minutes=1)
+        )
+        Borrowing.objects.filter(id=borrowings[1].id).update(
+            actual_return_date=date.today()
+        )
+
+        fired = send_due_reminders(batch_size=3)
+
+        self.assertEqual(fired, 4)
+        self.assertEqual(
+            set(BorrowingReminder.objects.values_list("borrowing", flat=True)),
+            {borrowings[2].id},
+        )
+        message = Notification.objects.get().message
+        self.assertEqual(message.count("User: Ann Reader"), 2)
+        self.assertIn("Borrowing due today:", message)
+        self.assertIn("Overdue borrowing:", message)
+        self.assertEqual(send_due_reminders(), 0)
+
+
+class ConcurrentBorrowingTests(TransactionTestCase):
+    def borrow_concurrently(self, book, clients_count):
+        users = [
+            sample_user(email=f"user{i}@mail.com") for i in range(clients_count)
+        ]
+        barrier = threading.Barrier(clients_count)
+        statuses = []
+
+        def borrow(user):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            payload = {"expected_return_date": "2024-10-17", "book": [book.id]}
+            try:
+                barrier.wait()
+                response = client.post(BORROWING_URL, payload, format="json")
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=borrow, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses
+
+    def test_hot_title_is_never_oversold(self):
+        inventory = 5
+        clients_count = 20
+        book = sample_book(title="Hot Title", inventory=inventory)
+
+        statuses = self.borrow_concurrently(book, clients_count)
+
+        book.refresh_from_db()
+        self.assertEqual(statuses.count(status.HTTP_302_FOUND), inventory)
+        self.assertEqual(
+            statuses.count(status.HTTP_400_BAD_REQUEST), clients_count - inventory
+        )
+        self.assertEqual(book.inventory, 0)
+        self.assertEqual(
+            Borrowing.book.through.objects.filter(book=book).count(), inventory
+        )
+
+    def test_sharded_hot_title_is_never_oversold(self):
+        inventory = 8
+        clients_count = 20
+        book = sample_book(title="Hot Title", inventory=inventory)
+        shard_inventory(book.id, 4)
+
+        statuses = self.borrow_concurrently(book, clients_count)
+
+        book.refresh_from_db()
+        self.assertEqual(statuses.count(status.HTTP_302_FOUND), inventory)
+        self.assertEqual(
+            statuses.count(status.HTTP_400_BAD_REQUEST), clients_count - inventory
+        )
+        self.assertEqual(book.available_inventory, 0)
+        self.assertEqual(
+            Borrowing.book.through.objects.filter(book=book).count(), inventory
+        )
+
+
+class BenchmarkApiCommandTests(TransactionTestCase):
+    def benchmark(self, output, **options):
+        stdout = io.StringIO()
+        call_command(
+            "benchmark_api",
+            clients=2,
+            rounds=2,
+            output=output,
+            stdout=stdout,
+            stderr=io.StringIO(),
+            **options,
+        )
+        return stdout.getvalue()
+
+    def test_reports_every_endpoint_and_leaves_data_untouched(self):
+        books = [sample_book(title=f"Book {n}", inventory=5) for n in range(3)]
+        sample_user()
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            self.benchmark(output)
+            with open(output) as file:
+                results = json.load(file)
+
+            comparison = self.benchmark(
+                os.path.join(directory, "next.json"), baseline=output
+            )
+
+        self.assertIn("vs baseline", comparison)
+        self.assertEqual(list(results["endpoints"]), ENDPOINTS)
+        for endpoint, stats in results["endpoints"].items():
+            self.assertEqual(stats["requests"], 4, endpoint)
+            self.assertEqual(stats["errors"], 0, endpoint)
+            latency = stats["latency_ms"]
+            self.assertLessEqual(latency["p50"], latency["p95"])
+            self.assertLessEqual(latency["p95"], latency["p99"])
+            self.assertGreater(stats["queries_per_request"], 0)
+        self.assertEqual(results["requests"], 4 * len(ENDPOINTS))
+        self.assertEqual(results["database"]["books"], 3)
+
+        self.assertEqual(get_user_model().objects.count(), 1)
+        self.assertFalse(Borrowing.objects.exists())
+        for book in books:
+            book.refresh_from_db()
+            self.assertEqual(book.inventory, 5)
+
+    def test_needs_books_to_borrow(self):
+        with self.assertRaises(CommandError):
+            self.benchmark(os.devnull)
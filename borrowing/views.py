@@ -1,14 +1,19 @@
+import hashlib
+import time
 from datetime import date
 
-from django.db import transaction
+from django.db.models import Prefetch
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework import mixins, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.viewsets import GenericViewSet
 
+from book.models import Book
 from borrowing.models import Borrowing
 from borrowing.permissions import AdminOrIsAuthenticatedCreateAndReadOnly
 from borrowing.serializers import (
@@ -17,16 +22,103 @@ from borrowing.serializers import (
     BorrowingListAdminSerializer,
     BorrowingListUserSerializer,
     BorrowingRetrieveSerializer,
+    BorrowingBulkReturnSerializer,
+    BorrowingReturnResultSerializer,
 )
+from borrowing.returns import return_borrowings
 from payment.models import Payment
+from utils.cache import ConditionalGetMixin
+from utils.pagination import KeysetPagination
+
+
+class BorrowingCursorPagination(KeysetPagination):
+    ordering = ("actual_return_date", "-borrow_date", "id")
+    page_size = 10
+    max_page_size = 50
 
 
 class BorrowingPagination(PageNumberPagination):
+    """
+    Page numbers by default, keyset pages when `cursor` is passed.
+
+    `count=false` skips the COUNT(*) query of numbered pages; the response
+    then only has next/previous links.
+    """
+
     page_size = 10
+    page_size_query_param = "page_size"
     max_page_size = 50
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        cursor_pagination = BorrowingCursorPagination()
+        if cursor_pagination.cursor_query_param in request.query_params:
+            self.cursor_pagination = cursor_pagination
+            return cursor_pagination.paginate_queryset(queryset, request, view)
+
+        self.with_count = request.query_params.get(
+            self.count_query_param, ""
+        ).lower() not in ("false", "0")
+        if self.with_count:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            self.page_number = 0
+        if self.page_number < 1:
+            raise NotFound(
+                self.invalid_page_message.format(
+                    page_number=request.query_params.get(self.page_query_param),
+                    message="That page number is not valid",
+                )
+            )
+
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        if self.with_count:
+            return super().get_paginated_response(data)
+
+        url = self.request.build_absolute_uri()
+        next_link = previous_link = None
+        if self.has_next:
+            next_link = replace_query_param(
+                url, self.page_query_param, self.page_number + 1
+            )
+        if self.page_number > 1:
+            previous_link = replace_query_param(
+                url, self.page_query_param, self.page_number - 1
+            )
+        return Response(
+            {"next": next_link, "previous": previous_link, "results": data}
+        )
+
+    def get_schema_operation_parameters(self, view):
+        cursor_pagination = BorrowingCursorPagination()
+        cursor_parameter = cursor_pagination.get_schema_operation_parameters(view)[0]
+        return super().get_schema_operation_parameters(view) + [
+            cursor_parameter,
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Pass false to skip counting all borrowings.",
+                "schema": {"type": "boolean"},
+            },
+        ]
 
 
 class BorrowingViewSet(
+    ConditionalGetMixin,
     mixins.CreateModelMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
@@ -35,12 +127,27 @@ class BorrowingViewSet(
     queryset = Borrowing.objects.all()
     permission_classes = (AdminOrIsAuthenticatedCreateAndReadOnly,)
     pagination_class = BorrowingPagination
+    vary_on_user = True
+    query_budgets = {
+        "list": 4,
+        "create": 9,
+        "retrieve": 3,
+        "return_book": 9,
+        "return_books": 7,
+    }
 
     def get_queryset(self):
-        queryset = self.queryset
+        queryset = super().get_queryset()
         is_active = self.request.query_params.get("is_active")
         user_id = self.request.query_params.getlist("user_id")
 
+        if self.renders_amounts():
+            queryset = queryset.with_amounts()
+        if self.action == "retrieve":
+            queryset = queryset.select_related("user").prefetch_related(
+                Prefetch("book", queryset=Book.objects.with_available_inventory()),
+                "payments",
+            )
         if self.action == "list":
             queryset = queryset.select_related().prefetch_related("book", "payments")
             if is_active == "true" or is_active == "True" or is_active == "1":
@@ -55,6 +162,32 @@ class BorrowingViewSet(
             return queryset
         return queryset.filter(user=user)
 
+    def renders_amounts(self) -> bool:
+        return self.action == "retrieve" or (
+            self.action == "list" and self.request.user.is_staff
+        )
+
+    def get_validators(self, request):
+        etag, last_modified = super().get_validators(request)
+        if not self.renders_amounts():
+            return etag, last_modified
+        # Fines of active borrowings grow every day, with no version bump.
+        today = date.today()
+        raw_etag = f"{etag}|{today.isoformat()}"
+        etag = f'"{hashlib.sha256(raw_etag.encode()).hexdigest()[:32]}"'
+        return etag, max(last_modified, int(time.mktime(today.timetuple())))
+
+    def get_version_namespaces(self):
+        user = self.request.user
+        if user.is_staff:
+            borrowing_namespace = "borrowing"
+        else:
+            borrowing_namespace = f"borrowing:user:{user.id}"
+
+        if self.action == "retrieve":
+            return borrowing_namespace, "book"
+        return borrowing_namespace, "book:titles"
+
     def get_serializer_class(self):
         user = self.request.user
         if self.action == "list" and user.is_staff:
@@ -77,7 +210,7 @@ class BorrowingViewSet(
 
     def create(self, request, *args, **kwargs):
         user = self.request.user
-        if Payment.objects.filter(borrowing__user=user, status="PENDING").exists():
+        if Payment.objects.unpaid().filter(borrowing__user=user).exists():
             return Response(
                 {
                     "detail": "You have at least one pending payment - "
@@ -102,7 +235,6 @@ class BorrowingViewSet(
     )
     def return_book(self, request, pk=None):
         borrowing = self.get_object()
-        return_date = date.today()
 
         if borrowing.actual_return_date is not None:
             return Response(
@@ -110,30 +242,49 @@ class BorrowingViewSet(
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        with transaction.atomic():
-            borrowing.actual_return_date = return_date
-            borrowing.save()
-            for book in borrowing.book.all():
-                book.inventory += 1
-                book.save()
+        titles = [book.title for book in borrowing.book.all()]
+        result = return_borrowings(self.get_queryset(), [borrowing.id])[0]
+        if "error" in result:
+            return Response(
+                {"detail": result["error"]}, status=status.HTTP_400_BAD_REQUEST
+            )
 
-        if return_date > borrowing.expected_return_date:
-            redirect_url = "http://127.0.0.1:8000/api/library/payments/create_fine"
+        if result["overdue"]:
             return Response(
                 {
-                    "detail": f"Books {[book.title for book in borrowing.book.all()]} "
-                              f"have been returned. "
+                    "detail": f"Books {titles} have been returned. "
                     f"Borrowing is overdue. Please pay the fine.",
-                    "fine_url": redirect_url,
+                    "fine_url": result["fine_url"],
                 },
                 status=status.HTTP_200_OK,
             )
 
         return Response(
-            {
-                "detail": f"Books {[book.title for book in borrowing.book.all()]} "
-                          f"have been returned."
-            },
+            {"detail": f"Books {titles} have been returned."},
+            status=status.HTTP_200_OK,
+        )
+
+    @extend_schema(
+        request=BorrowingBulkReturnSerializer,
+        responses=BorrowingReturnResultSerializer(many=True),
+    )
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="return",
+        permission_classes=(IsAuthenticated,),
+    )
+    def return_books(self, request):
+        """Return many borrowings at once, reporting the result of every id"""
+        serializer = BorrowingBulkReturnSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = return_borrowings(
+            self.get_queryset(), serializer.validated_data["borrowings"]
+        )
+
+        return Response(
+            BorrowingReturnResultSerializer(results, many=True).data,
             status=status.HTTP_200_OK,
         )
 
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "django_celery_beat",
     "drf_spectacular",
     "rest_framework",
@@ -54,6 +55,7 @@ INSTALLED_APPS = [
     "borrowing",
     "payment",
     "user",
+    "notification",
 ]
 
 MIDDLEWARE = [
@@ -112,6 +114,28 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHE_URL = os.getenv("CACHE_URL")
+
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+            "TIMEOUT": 10 * 60,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "TIMEOUT": 10 * 60,
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -176,6 +200,18 @@ INTERNAL_IPS = [
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
+# Telegram allows about 30 messages per second in total and 20 per minute
+# in a group or channel. Every HTTP call to it is bounded by the timeout.
+TELEGRAM_MESSAGES_PER_SECOND = 30
+TELEGRAM_CHAT_MESSAGES_PER_MINUTE = 20
+TELEGRAM_SEND_TIMEOUT = 10
+TELEGRAM_POOL_SIZE = 4
+# Flood errors are waited out a few times, if Telegram asks for a short wait.
+TELEGRAM_FLOOD_RETRIES = 3
+TELEGRAM_MAX_FLOOD_WAIT = 60
+# Deadline of a whole batch, well below CELERY_TASK_TIME_LIMIT.
+TELEGRAM_BATCH_TIMEOUT = 10 * 60
 
 CELERY_TIMEZONE = "Europe/Kiev"
 CELERY_TASK_TRACK_STARTED = True
@@ -185,14 +221,44 @@ CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 
+# The overdue check is split into partitions of this many borrowing ids,
+# dealt to at most OVERDUE_CONCURRENCY parallel subtasks.
+OVERDUE_PARTITION_SIZE = int(os.getenv("OVERDUE_PARTITION_SIZE", 100_000))
+OVERDUE_CONCURRENCY = int(os.getenv("OVERDUE_CONCURRENCY", 4))
+
 CELERY_BEAT_SCHEDULE = {
-    "check-overdue-borrowings-every-day": {
-        "task": "borrowing.tasks.check_borrowings_overdue",
-        "schedule": crontab(hour="9", minute="0"),
-    }
+    "send-borrowing-reminders": {
+        "task": "borrowing.tasks.send_borrowing_reminders",
+        "schedule": 60.0,
+    },
+    "dispatch-notifications": {
+        "task": "notification.tasks.dispatch_notifications",
+        "schedule": 10.0,
+    },
+    "apply-stripe-events": {
+        "task": "payment.tasks.apply_stripe_events",
+        "schedule": 10.0,
+    },
+    "requeue-stale-session-requests": {
+        "task": "payment.tasks.requeue_stale_session_requests",
+        "schedule": 60.0,
+    },
+    "refresh-catalog-snapshot": {
+        "task": "book.tasks.refresh_catalog_snapshot",
+        "schedule": crontab(minute="*/5"),
+    },
 }
 
+CATALOG_SNAPSHOT_DIR = os.getenv("CATALOG_SNAPSHOT_DIR", BASE_DIR / "snapshots")
+# Seconds a snapshot may lag behind checkouts and returns.
+CATALOG_SNAPSHOT_MAX_AGE = int(os.getenv("CATALOG_SNAPSHOT_MAX_AGE", 3600))
+
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+stripe.api_base = os.getenv("STRIPE_API_BASE", stripe.api_base)
+# Create Stripe checkout sessions in a Celery task: the payment endpoints
+# answer 202 at once, with the payment to poll for the session URL.
+STRIPE_ASYNC_SESSIONS = os.getenv("STRIPE_ASYNC_SESSIONS") == "True"
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 
 SPECTACULAR_SETTINGS = {
     "TITLE": "Library Service API",
@@ -0,0 +1,440 @@
+import re
+from collections import Counter
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, resolve, reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from book.models import Book, BookInventoryShard
+from borrowing.models import Borrowing
+from payment.models import Payment
+
+
+# Every route is called with 1 and with SIZES[-1] related rows.
+SIZES = (1, 100)
+PROJECT_APPS = ("book", "borrowing", "notification", "payment", "user")
+HTTP_METHODS = ("get", "post", "put", "patch", "delete")
+
+
+def create_library(size):
+    """
+    Seed `size` books, users, borrowings and payments.
+
+    The main borrowing of the reader holds all books, which are sharded, and
+    the reader has `size` active borrowings with a paid payment each plus
+    one borrowing returned late without a fine.
+    """
+    user_model = get_user_model()
+    today = date.today()
+    admin_user = user_model.objects.create_user(
+        "admin@library.com", is_staff=True, is_superuser=True
+    )
+    reader = user_model.objects.create_user(
+        "reader@library.com", first_name="Ann", last_name="Reader"
+    )
+    user_model.objects.bulk_create(
+        user_model(email=f"user{n}@library.com") for n in range(size)
+    )
+
+    books = Book.objects.bulk_create(
+        Book(
+            title=f"Book {n}",
+            author=f"Author {n}",
+            cover=Book.Cover.SOFT,
+            daily_fee=Decimal("0.50"),
+            shard_count=2,
+        )
+        for n in range(size)
+    )
+    BookInventoryShard.objects.bulk_create(
+        BookInventoryShard(book=book, slot=slot, count=5)
+        for book in books
+        for slot in range(2)
+    )
+
+    borrowings = []
+    for n in range(size + 1):
+        borrowing = Borrowing(
+            user=reader, expected_return_date=today + timedelta(days=10)
+        )
+        borrowing.take_snapshot(books if n == 0 else [books[n - 1]])
+        borrowings.append(borrowing)
+    borrowings = Borrowing.objects.bulk_create(borrowings)
+    Borrowing.book.through.objects.bulk_create(
+        [Borrowing.book.through(borrowing=borrowings[0], book=book) for book in books]
+        + [
+            Borrowing.book.through(borrowing=borrowing, book=book)
+            for borrowing, book in zip(borrowings[1:], books)
+        ]
+    )
+    *active, returned = borrowings
+    Borrowing.objects.filter(pk=returned.pk).update(
+        borrow_date=today - timedelta(days=10),
+        expected_return_date=today - timedelta(days=5),
+        actual_return_date=today - timedelta(days=1),
+    )
+    payments = Payment.objects.bulk_create(
+        Payment(
+            borrowing=borrowing,
+            status=Payment.Status.PAID,
+            money_to_pay=10,
+            session_id=f"session-{borrowing.id}",
+            session_url=f"https://checkout.stripe.com/c/pay/session-{borrowing.id}",
+        )
+        for borrowing in active
+    )
+
+    return SimpleNamespace(
+        admin=admin_user,
+        reader=reader,
+        books=books,
+        book=books[0],
+        borrowing=active[0],
+        active=active,
+        returned=returned,
+        payment=payments[0],
+    )
+
+
+def book_payload(library):
+    return {
+        "title": "New book",
+        "author": "New author",
+        "cover": Book.Cover.HARD,
+        "inventory": 3,
+        "daily_fee": "1.00",
+    }
+
+
+def import_payload(library):
+    rows = "".join(
+        f"{book.title},{book.author},SF,7,0.50\n" for book in library.books
+    )
+    return {
+        "file": SimpleUploadedFile(
+            "books.csv", f"title,author,cover,inventory,daily_fee\n{rows}".encode()
+        )
+    }
+
+
+def user_payload(library):
+    return {
+        "email": "new@library.com",
+        "password": "new-password",
+        "first_name": "New",
+        "last_name": "User",
+    }
+
+
+def with_password(library):
+    library.reader.set_password("reader-password")
+    library.reader.save()
+    return {"email": "reader@library.com", "password": "reader-password"}
+
+
+def without_payment(library):
+    library.payment.delete()
+    return {"borrowing": library.borrowing.id}
+
+
+def pending_session(library):
+    Payment.objects.filter(pk=library.payment.pk).update(
+        status=Payment.Status.PENDING
+    )
+    return {"session_id": library.payment.session_id}
+
+
+def session_completed(library):
+    return {
+        "id": f"evt_{library.payment.session_id}",
+        "type": "checkout.session.completed",
+        "data": {
+            "object": {"id": library.payment.session_id, "payment_status": "paid"}
+        },
+    }
+
+
+# (route name, method) -> how to call it. `user` is authenticated, `kwargs`
+# names the object in the URL, `data` builds the request (query parameters of
+# GET requests) and `status` is the expected status, if not a success.
+SCENARIOS = {
+    ("book:book-list", "get"): {"user": "reader"},
+    ("book:book-list", "post"): {"user": "admin", "data": book_payload},
+    ("book:book-detail", "get"): {"user": "reader", "kwargs": "book"},
+    ("book:book-detail", "put"): {
+        "user": "admin",
+        "kwargs": "book",
+        "data": book_payload,
+    },
+    ("book:book-detail", "patch"): {
+        "user": "admin",
+        "kwargs": "book",
+        "data": lambda library: {"inventory": 20},
+    },
+    ("book:book-detail", "delete"): {"user": "admin", "kwargs": "book"},
+    ("book:book-import-books", "post"): {
+        "user": "admin",
+        "data": import_payload,
+        "format": "multipart",
+    },
+    ("book:book-adjust-inventory", "post"): {
+        "user": "admin",
+        "data": lambda library: {
+            "adjustments": [{"book_id": book.id, "delta": 1} for book in library.books]
+        },
+    },
+    ("book:book-shard-inventory", "post"): {
+        "user": "admin",
+        "kwargs": "book",
+        "data": lambda library: {"shard_count": 4},
+    },
+    ("book:book-snapshot", "get"): {"user": "reader", "status": 503},
+    ("user:register", "post"): {"data": user_payload},
+    ("user:token_obtain_pair", "post"): {"data": with_password},
+    ("user:token_refresh", "post"): {
+        "data": lambda library: {"refresh": str(RefreshToken.for_user(library.reader))}
+    },
+    ("user:token_verify", "post"): {
+        "data": lambda library: {"token": str(AccessToken.for_user(library.reader))}
+    },
+    ("user:manage", "get"): {"user": "reader"},
+    ("user:manage", "put"): {"user": "reader", "data": user_payload},
+    ("user:manage", "patch"): {
+        "user": "reader",
+        "data": lambda library: {"first_name": "Anna"},
+    },
+    ("user:user-list", "get"): {"user": "admin"},
+    ("user:user-list", "post"): {"user": "admin", "data": user_payload},
+    ("user:user-detail", "get"): {"user": "admin", "kwargs": "reader"},
+    ("user:user-detail", "put"): {
+        "user": "admin",
+        "kwargs": "reader",
+        "data": user_payload,
+    },
+    ("user:user-detail", "patch"): {
+        "user": "admin",
+        "kwargs": "reader",
+        "data": lambda library: {"first_name": "Anna"},
+    },
+    ("borrowing:borrowing-list", "get"): {"user": "admin"},
+    ("borrowing:borrowing-list", "post"): {
+        "user": "reader",
+        "data": lambda library: {
+            "book": [book.id for book in library.books],
+            "expected_return_date": date.today() + timedelta(days=7),
+        },
+    },
+    ("borrowing:borrowing-detail", "get"): {"user": "reader", "kwargs": "borrowing"},
+    ("borrowing:borrowing-return-book", "post"): {
+        "user": "reader",
+        "kwargs": "borrowing",
+    },
+    ("borrowing:borrowing-return-books", "post"): {
+        "user": "reader",
+        "data": lambda library: {
+            "borrowings": [borrowing.id for borrowing in library.active]
+        },
+    },
+    ("payment:payment-list", "get"): {"user": "admin"},
+    ("payment:payment-list", "post"): {
+        "user": "reader",
+        "data": lambda library: {"borrowing": library.borrowing.id},
+        "status": 403,
+    },
+    ("payment:payment-detail", "get"): {"user": "reader", "kwargs": "payment"},
+    ("payment:payment-detail", "put"): {
+        "user": "reader",
+        "kwargs": "payment",
+        "status": 403,
+    },
+    ("payment:payment-detail", "patch"): {
+        "user": "reader",
+        "kwargs": "payment",
+        "status": 403,
+    },
+    ("payment:payment-detail", "delete"): {
+        "user": "reader",
+        "kwargs": "payment",
+        "status": 403,
+    },
+    ("payment:payment-create-payment", "post"): {
+        "user": "reader",
+        "data": without_payment,
+    },
+    ("payment:payment-create-fine", "post"): {
+        "user": "reader",
+        "data": lambda library: {"borrowing": library.returned.id},
+    },
+    ("payment:payment-success", "get"): {"data": pending_session},
+    ("payment:payment-webhook", "post"): {"data": session_completed},
+    ("payment:payment-cancel", "get"): {},
+    ("schema", "get"): {},
+    ("swagger-ui", "get"): {},
+    ("redoc", "get"): {},
+}
+
+
+def iter_routes(patterns=None, namespaces=()):
+    """Yield (name, URL kwargs, view class, {method: action}) of every route."""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace in ("admin", "djdt"):
+                continue
+            namespace = (pattern.namespace,) if pattern.namespace else ()
+            yield from iter_routes(pattern.url_patterns, namespaces + namespace)
+            continue
+        # Format suffix variants share the view of the plain route.
+        if "format" in pattern.pattern.regex.groupindex:
+            continue
+        view = pattern.callback
+        view_class = getattr(view, "cls", None) or getattr(view, "view_class", None)
+        # Copied, as DRF adds "head" to the actions of a viewset on request.
+        actions = getattr(view, "actions", None) or {
+            method: method for method in HTTP_METHODS if hasattr(view_class, method)
+        }
+        actions = {
+            method: action for method, action in actions.items()
+            if method in HTTP_METHODS
+        }
+        kwargs = {"pk": 1} if "pk" in pattern.pattern.regex.groupindex else {}
+        yield ":".join(namespaces + (pattern.name,)), kwargs, view_class, actions
+
+
+def iter_admin_changelists():
+    """Yield (name, model admin) of the changelists of the project models."""
+    for model, model_admin in admin.site._registry.items():
+        if model._meta.app_label in PROJECT_APPS:
+            name = f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist"
+            yield name, model_admin
+
+
+def sql_template(sql):
+    """Strip the literals of a statement, so repeated queries compare equal."""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    return re.sub(r"\b\d+(\.\d+)?\b", "?", sql)
+
+
+def duplicated_sql(small, large):
+    """Report the statements that run more often with more rows."""
+    small_counts = Counter(sql_template(query["sql"]) for query in small)
+    large_counts = Counter(sql_template(query["sql"]) for query in large)
+    return "\n".join(
+        f"  {count}x (was {small_counts[sql]}x): {sql}"
+        for sql, count in large_counts.most_common()
+        if count > small_counts[sql]
+    )
+
+
+class QueryBudgetTests(TestCase):
+    """
+    The number of queries of every endpoint doesn't depend on the data size.
+
+    Budgets are declared next to the views, in `query_budgets` (per action
+    of viewsets, per HTTP method of plain views and "changelist" of model
+    admins). Views of third-party packages are only checked for constant
+    query counts.
+    """
+
+    def setUp(self):
+        session = SimpleNamespace(
+            id="cs_test", url="https://checkout.stripe.com/c/pay/cs_test"
+        )
+        patches = (
+            mock.patch("stripe.checkout.Session.create", return_value=session),
+            mock.patch("stripe.WebhookSignature.verify_header", return_value=True),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        webhook_secret = override_settings(STRIPE_WEBHOOK_SECRET="whsec_test")
+        webhook_secret.enable()
+        self.addCleanup(webhook_secret.disable)
+
+    def run_request(self, call, size):
+        """Call a route against fresh data and return the captured queries."""
+        with transaction.atomic():
+            library = create_library(size)
+            data = call.get("data", lambda library: None)(library)
+            client = APIClient()
+            user = call.get("user")
+            if user == "admin-session":
+                client.force_login(library.admin)
+            elif user:
+                client.force_authenticate(getattr(library, user))
+            kwargs = {}
+            if "kwargs" in call:
+                kwargs["pk"] = getattr(library, call["kwargs"]).pk
+            url = reverse(call["name"], kwargs=kwargs)
+            cache.clear()
+
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(client, call["method"])(
+                    url, data, format=call.get("format", "json")
+                )
+            transaction.set_rollback(True)
+
+        if "status" in call:
+            self.assertEqual(response.status_code, call["status"], response)
+        else:
+            self.assertLess(response.status_code, 400, response)
+        return list(queries)
+
+    def assertQueryBudget(self, call, budget):
+        # The first call warms up per-process caches, like content types.
+        self.run_request(call, SIZES[0])
+        small = self.run_request(call, SIZES[0])
+        large = self.run_request(call, SIZES[-1])
+
+        route = f"{call['method'].upper()} {call['name']}"
+        self.assertEqual(
+            len(small),
+            len(large),
+            f"{route} runs {len(small)} queries for {SIZES[0]} row(s) and "
+            f"{len(large)} for {SIZES[-1]}, repeated statements:\n"
+            f"{duplicated_sql(small, large)}",
+        )
+        if budget is not None:
+            self.assertLessEqual(
+                len(large),
+                budget,
+                f"{route} runs {len(large)} queries, over its budget of "
+                f"{budget}:\n" + "\n".join(query["sql"] for query in large),
+            )
+
+    def test_api_routes(self):
+        for name, kwargs, view_class, actions in iter_routes():
+            # Shadowed routes (like the router roots) can't be reached.
+            if resolve(reverse(name, kwargs=kwargs)).view_name != name:
+                continue
+            budgets = getattr(view_class, "query_budgets", None)
+            is_project_view = view_class.__module__.split(".")[0] in PROJECT_APPS
+            for method, action in actions.items():
+                with self.subTest(route=name, method=method):
+                    self.assertIn((name, method), SCENARIOS, "No scenario")
+                    budget = None
+                    if is_project_view:
+                        self.assertIn(action, budgets or {}, "No query budget")
+                        budget = budgets[action]
+                    call = {"name": name, "method": method, **SCENARIOS[name, method]}
+                    self.assertQueryBudget(call, budget)
+
+    def test_admin_changelists(self):
+        for name, model_admin in iter_admin_changelists():
+            with self.subTest(route=name):
+                budgets = getattr(model_admin, "query_budgets", {})
+                self.assertIn("changelist", budgets, "No query budget")
+                call = {"name": name, "method": "get", "user": "admin-session"}
+                self.assertQueryBudget(call, budgets["changelist"])
@@ -0,0 +1,21 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from notification.models import Notification
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "attempts", "created_at", "sent_at", "message")
+    list_filter = ("status",)
+    readonly_fields = ("created_at", "sent_at")
+    actions = ("requeue",)
+    query_budgets = {"changelist": 5}
+
+    @admin.action(description="Send the selected notifications again")
+    def requeue(self, request, queryset):
+        queryset.exclude(status=Notification.Status.SENT).update(
+            status=Notification.Status.PENDING,
+            attempts=0,
+            next_attempt_at=timezone.now(),
+        )
@@ -0,0 +1,119 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from notification.models import Notification
+from utils.telegram import get_telegram_client, pack_messages
+
+
+# All notifications go to one chat, which Telegram allows 20 messages per
+# minute: a batch takes up to a minute of pacing, plus TELEGRAM_FLOOD_RETRIES
+# waits of TELEGRAM_MAX_FLOOD_WAIT, which is still well inside CLAIM_TIMEOUT.
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 8
+RETRY_DELAY = timedelta(seconds=30)
+MAX_RETRY_DELAY = timedelta(hours=1)
+# Claimed notifications are tried again after this, if their dispatcher died.
+CLAIM_TIMEOUT = timedelta(minutes=10)
+DISPATCH_LOCK = "notification:dispatch:lock"
+
+
+def enqueue_notification(message: str) -> None:
+    """
+    Queue a Telegram message with one INSERT, in the transaction of the caller.
+
+    It is only sent if that transaction commits. Messages longer than
+    Telegram allows are split into several notifications.
+    """
+    enqueue_notifications([message])
+
+
+def enqueue_notifications(parts) -> None:
+    """Queue parts packed into as few messages as possible, with one INSERT."""
+    Notification.objects.bulk_create(
+        Notification(message=message) for message in pack_messages(parts)
+    )
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def claim_notifications(batch_size: int) -> list[Notification]:
+    """
+    Take the oldest due notifications for this dispatcher.
+
+    Rows locked by another dispatcher are skipped, and the claimed ones are
+    pushed CLAIM_TIMEOUT into the future, so they aren't sent twice while
+    being delivered outside of the transaction.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            Notification.objects.due(now)
+            .select_for_update(skip_locked=True)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        Notification.objects.filter(
+            id__in=[notification.id for notification in batch]
+        ).update(next_attempt_at=now + CLAIM_TIMEOUT)
+    return batch
+
+
+def dispatch_due_notifications(batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Send due notifications in batches, oldest first.
+
+    A failed notification is retried with exponential backoff, starting at
+    RETRY_DELAY, and dead-lettered after MAX_ATTEMPTS. Returns the number
+    of sent, retried and dead notifications.
+
+    Only one dispatcher runs at a time, so the pacing of the chat isn't
+    split between processes: while another one holds DISPATCH_LOCK,
+    nothing is sent.
+    """
+    lock_timeout = CLAIM_TIMEOUT.total_seconds()
+    if not cache.add(DISPATCH_LOCK, 1, timeout=lock_timeout):
+        return {"sent": 0, "retried": 0, "dead": 0}
+    try:
+        return send_due_batches(batch_size, lock_timeout)
+    finally:
+        cache.delete(DISPATCH_LOCK)
+
+
+def send_due_batches(batch_size: int, lock_timeout: float) -> dict:
+    """Send batches until none is due, renewing DISPATCH_LOCK for each."""
+    counts = {"sent": 0, "retried": 0, "dead": 0}
+    client = get_telegram_client()
+    while True:
+        cache.touch(DISPATCH_LOCK, lock_timeout)
+        batch = claim_notifications(batch_size)
+        if not batch:
+            break
+        errors = client.run(
+            client.deliver([notification.message for notification in batch])
+        ).result()
+
+        now = timezone.now()
+        for notification, error in zip(batch, errors):
+            if error is None:
+                notification.status = Notification.Status.SENT
+                notification.sent_at = now
+                counts["sent"] += 1
+                continue
+            notification.attempts += 1
+            notification.last_error = error
+            if notification.attempts >= MAX_ATTEMPTS:
+                notification.status = Notification.Status.DEAD
+                counts["dead"] += 1
+            else:
+                notification.next_attempt_at = now + retry_delay(notification.attempts)
+                counts["retried"] += 1
+        Notification.objects.bulk_update(
+            batch, ["status", "attempts", "next_attempt_at", "last_error", "sent_at"]
+        )
+        if len(batch) < batch_size:
+            break
+    return counts
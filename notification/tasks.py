@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from notification.outbox import dispatch_due_notifications
+
+
+@shared_task
+def dispatch_notifications():
+    return dispatch_due_notifications()
@@ -0,0 +1,250 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from telegram.constants import MessageLimit
+
+from book.models import Book
+from borrowing.models import Borrowing
+from notification.models import Notification
+from notification.outbox import (
+    CLAIM_TIMEOUT,
+    DISPATCH_LOCK,
+    MAX_ATTEMPTS,
+    RETRY_DELAY,
+    claim_notifications,
+    dispatch_due_notifications,
+    enqueue_notification,
+)
+from payment.models import Payment
+from payment.tasks import apply_stripe_events
+from payment.webhooks import store_event
+from utils.fake_telegram import FakeTelegramServer
+from utils.telegram import close_telegram_client
+
+
+def sample_user(**kwargs):
+    defaults = {
+        "email": "reader@mail.com",
+        "password": "TestPassword12345",
+        "first_name": "Ann",
+        "last_name": "Reader",
+    }
+    defaults.update(**kwargs)
+    return get_user_model().objects.create(**defaults)
+
+
+def sample_book(**kwargs):
+    defaults = {
+        "title": "Test Book Title",
+        "author": "Test Author",
+        "cover": "SF",
+        "inventory": 2,
+        "daily_fee": Decimal("0.50"),
+    }
+    defaults.update(**kwargs)
+    return Book.objects.create(**defaults)
+
+
+class EnqueueNotificationTests(TestCase):
+    def test_long_messages_are_split(self):
+        enqueue_notification("x" * (MessageLimit.MAX_TEXT_LENGTH + 10))
+
+        self.assertEqual(
+            sorted(len(n.message) for n in Notification.objects.all()),
+            [10, MessageLimit.MAX_TEXT_LENGTH],
+        )
+
+    def test_new_borrowing_is_queued_with_one_insert(self):
+        user = sample_user()
+        borrowing = Borrowing(expected_return_date="2024-10-17", user=user)
+        borrowing.take_snapshot([sample_book()])
+
+        with CaptureQueriesContext(connection) as queries:
+            borrowing.save()
+
+        outbox_queries = [
+            query["sql"]
+            for query in queries.captured_queries
+            if "notification_notification" in query["sql"]
+        ]
+        self.assertEqual(len(outbox_queries), 1)
+        self.assertTrue(outbox_queries[0].startswith("INSERT"))
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.status, Notification.Status.PENDING)
+        self.assertIn("Test Book Title by Ann Reader", notification.message)
+
+    def test_borrowing_without_snapshot_is_queued_once_books_are_added(self):
+        borrowing = Borrowing.objects.create(
+            expected_return_date="2024-10-17", user=sample_user()
+        )
+        self.assertFalse(Notification.objects.exists())
+
+        borrowing.book.add(sample_book(title="First"))
+        borrowing.book.add(sample_book(title="Second"))
+
+        self.assertEqual(
+            Notification.objects.get().message,
+            "New borrowing created: First by Ann Reader",
+        )
+
+    def test_borrowing_added_in_admin_is_queued_with_its_books(self):
+        admin = sample_user(email="admin@mail.com", is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        book = sample_book()
+
+        self.client.post(
+            reverse("admin:borrowing_borrowing_add"),
+            {
+                "expected_return_date": "2024-10-17",
+                "book": [book.id],
+                "user": admin.id,
+            },
+        )
+
+        self.assertEqual(
+            Notification.objects.get().message,
+            "New borrowing created: Test Book Title by Ann Reader",
+        )
+
+    def test_paid_payment_is_queued(self):
+        borrowing = Borrowing.objects.create(
+            expected_return_date="2024-10-17", user=sample_user()
+        )
+        borrowing.book.add(sample_book())
+        Payment.objects.create(
+            borrowing=borrowing, session_id="cs_test", money_to_pay=Decimal("5.00")
+        )
+        Notification.objects.all().delete()
+        store_event(
+            {
+                "id": "evt_test",
+                "type": "checkout.session.completed",
+                "data": {"object": {"id": "cs_test", "payment_status": "paid"}},
+            }
+        )
+
+        apply_stripe_events()
+
+        self.assertIn("amount - 5.00$", Notification.objects.get().message)
+
+
+class DispatchNotificationsTests(TestCase):
+    def use_telegram(self, base_url):
+        settings = override_settings(
+            TELEGRAM_BOT_TOKEN="123456:test",
+            TELEGRAM_CHAT_ID="-100",
+            TELEGRAM_BASE_URL=base_url,
+            TELEGRAM_SEND_TIMEOUT=2,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        close_telegram_client()
+        self.addCleanup(close_telegram_client)
+
+    def test_due_notifications_are_sent_in_order(self):
+        fake = FakeTelegramServer().start()
+        self.addCleanup(fake.stop)
+        self.use_telegram(fake.base_url)
+        for n in range(5):
+            enqueue_notification(f"Message {n}")
+        Notification.objects.create(
+            message="Later", next_attempt_at=timezone.now() + timedelta(hours=1)
+        )
+
+        counts = dispatch_due_notifications(batch_size=2)
+
+        self.assertEqual(counts, {"sent": 5, "retried": 0, "dead": 0})
+        self.assertEqual(
+            [text for _, text in fake.messages], [f"Message {n}" for n in range(5)]
+        )
+        self.assertEqual(
+            Notification.objects.filter(status=Notification.Status.SENT).count(), 5
+        )
+        self.assertEqual(
+            Notification.objects.get(message="Later").status,
+            Notification.Status.PENDING,
+        )
+
+    def test_failures_back_off_then_go_dead(self):
+        self.use_telegram("http://127.0.0.1:1/bot")
+        enqueue_notification("Message")
+
+        started = timezone.now()
+        counts = dispatch_due_notifications()
+
+        self.assertEqual(counts, {"sent": 0, "retried": 1, "dead": 0})
+        notification = Notification.objects.get()
+        self.assertEqual(notification.attempts, 1)
+        self.assertTrue(notification.last_error)
+        self.assertGreaterEqual(notification.next_attempt_at, started + RETRY_DELAY)
+
+        Notification.objects.update(
+            attempts=MAX_ATTEMPTS - 1, next_attempt_at=timezone.now()
+        )
+        counts = dispatch_due_notifications()
+
+        self.assertEqual(counts, {"sent": 0, "retried": 0, "dead": 1})
+        self.assertEqual(Notification.objects.get().status, Notification.Status.DEAD)
+
+    def test_only_one_dispatcher_sends_at_a_time(self):
+        fake = FakeTelegramServer().start()
+        self.addCleanup(fake.stop)
+        self.use_telegram(fake.base_url)
+        enqueue_notification("Message")
+        cache.add(DISPATCH_LOCK, 1)
+        self.addCleanup(cache.delete, DISPATCH_LOCK)
+
+        counts = dispatch_due_notifications()
+
+        self.assertEqual(counts, {"sent": 0, "retried": 0, "dead": 0})
+        self.assertEqual(fake.messages, [])
+        self.assertEqual(Notification.objects.get().status, Notification.Status.PENDING)
+
+        cache.delete(DISPATCH_LOCK)
+        counts = dispatch_due_notifications()
+
+        self.assertEqual(counts, {"sent": 1, "retried": 0, "dead": 0})
+        self.assertIsNone(cache.get(DISPATCH_LOCK))
+
+    def test_claimed_notifications_are_not_claimed_again(self):
+        enqueue_notification("Message")
+
+        claimed = claim_notifications(10)
+
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claim_notifications(10), [])
+        self.assertGreater(
+            Notification.objects.get().next_attempt_at,
+            timezone.now() + CLAIM_TIMEOUT - timedelta(minutes=1),
+        )
+
+
+class NotificationAdminTests(TestCase):
+    def test_requeue_resets_unsent_notifications(self):
+        admin = sample_user(email="admin@mail.com", is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        dead = Notification.objects.create(
+            message="Dead", status=Notification.Status.DEAD, attempts=MAX_ATTEMPTS
+        )
+        sent = Notification.objects.create(
+            message="Sent", status=Notification.Status.SENT, attempts=0
+        )
+
+        self.client.post(
+            reverse("admin:notification_notification_changelist"),
+            {"action": "requeue", "_selected_action": [dead.id, sent.id]},
+        )
+
+        dead.refresh_from_db()
+        sent.refresh_from_db()
+        self.assertEqual(dead.status, Notification.Status.PENDING)
+        self.assertEqual(dead.attempts, 0)
+        self.assertEqual(sent.status, Notification.Status.SENT)
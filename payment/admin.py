@@ -3,4 +3,8 @@ from django.contrib import admin
 from payment.models import Payment
 
 
-admin.site.register(Payment)
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    # Payment.__str__ shows the name of the borrowing user.
+    list_select_related = ("borrowing__user",)
+    query_budgets = {"changelist": 5}
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0007_borrowing_access_indexes"),
+        ("payment", "0005_alter_payment_session_url"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING")),
+                fields=["borrowing"],
+                name="payment_pending_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.1 on 2026-10-17 01:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0008_borrowing_reminder"),
+        ("payment", "0006_payment_pending_idx"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="payment",
+            name="payment_pending_idx",
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING_SESSION", "Pending session"),
+                    ("PENDING", "Pending"),
+                    ("PAID", "Paid"),
+                ],
+                default="PENDING",
+                max_length=16,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status__in", ["PENDING_SESSION", "PENDING"])),
+                fields=["borrowing"],
+                name="payment_pending_idx",
+            ),
+        ),
+    ]
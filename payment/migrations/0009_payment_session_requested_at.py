@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-17 01:56
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0009_backfill_overdue_reminders"),
+        ("payment", "0008_stripe_event"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="session_requested_at",
+            field=models.DateTimeField(
+                db_default=django.db.models.functions.datetime.Now()
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING_SESSION")),
+                fields=["session_requested_at"],
+                name="payment_pending_session_idx",
+            ),
+        ),
+    ]
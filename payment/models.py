@@ -1,11 +1,37 @@
+from datetime import timedelta
+
 from django.db import models
+from django.db.models.functions import Now
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from borrowing.models import Borrowing
 
 
+# A Stripe session requested this long ago without being created is lost:
+# the task was never queued or its worker died. It is requested again.
+SESSION_REQUEST_TIMEOUT = timedelta(minutes=15)
+
+
+class PaymentQuerySet(models.QuerySet):
+    def unpaid(self):
+        """Payments still waiting to be paid, with or without a session yet."""
+        return self.filter(
+            status__in=[Payment.Status.PENDING_SESSION, Payment.Status.PENDING]
+        )
+
+    def stale_session_requests(self):
+        """Payments still waiting for a session after SESSION_REQUEST_TIMEOUT."""
+        return self.filter(
+            status=Payment.Status.PENDING_SESSION,
+            session_requested_at__lt=timezone.now() - SESSION_REQUEST_TIMEOUT,
+        )
+
+
 class Payment(models.Model):
     class Status(models.TextChoices):
+        # The Stripe session is still being created by a Celery task.
+        PENDING_SESSION = "PENDING_SESSION", _("Pending session")
         PENDING = "PENDING", _("Pending")
         PAID = "PAID", _("Paid")
 
@@ -14,7 +40,7 @@ class Payment(models.Model):
         FINE = "FINE", _("Fine")
 
     status = models.CharField(
-        max_length=8, choices=Status.choices, default=Status.PENDING
+        max_length=16, choices=Status.choices, default=Status.PENDING
     )
     type = models.CharField(max_length=8, choices=Type.choices, default=Type.PAYMENT)
     borrowing = models.ForeignKey(
@@ -23,6 +49,10 @@ class Payment(models.Model):
     session_url = models.URLField(blank=True, max_length=511)
     session_id = models.CharField(max_length=511, blank=True, null=True)
     money_to_pay = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # When its current Stripe session was requested.
+    session_requested_at = models.DateTimeField(db_default=Now())
+
+    objects = PaymentQuerySet.as_manager()
 
     class Meta:
         constraints = [
@@ -30,11 +60,60 @@ class Payment(models.Model):
                 fields=["type", "borrowing"], name="unique_payment"
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=["borrowing"],
+                condition=models.Q(status__in=["PENDING_SESSION", "PENDING"]),
+                name="payment_pending_idx",
+            ),
+            # Stripe redirects and webhooks find payments by their session.
+            models.Index(fields=["session_id"], name="payment_session_idx"),
+            models.Index(
+                fields=["session_requested_at"],
+                condition=models.Q(status="PENDING_SESSION"),
+                name="payment_pending_session_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.type} ({self.borrowing.user.full_name}): {self.status}"
 
+    @property
+    def session_expired(self) -> bool:
+        """Still due, but its Stripe session expired before it was paid."""
+        return self.status == self.Status.PENDING and not self.session_url
+
+    @property
+    def session_request_stale(self) -> bool:
+        """Still waiting for its session after SESSION_REQUEST_TIMEOUT."""
+        return (
+            self.status == self.Status.PENDING_SESSION
+            and self.session_requested_at < timezone.now() - SESSION_REQUEST_TIMEOUT
+        )
+
     def save(self, *args, **kwargs):
         if self.money_to_pay <= 0 and self.status == self.Status.PAID:
             raise ValueError("Cannot be 'Paid' if money_to_pay is zero or negative")
         super().save(*args, **kwargs)
+
+
+class StripeEvent(models.Model):
+    """A raw Stripe webhook event, applied to the payments by a worker."""
+
+    id = models.CharField(primary_key=True, max_length=255)
+    type = models.CharField(max_length=64)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["received_at", "id"],
+                condition=models.Q(processed_at__isnull=True),
+                name="stripe_event_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.type} ({self.id})"
@@ -3,4 +3,5 @@ from rest_framework import permissions
 
 class CanNotEditAndDeletePayments(permissions.BasePermission):
     def has_permission(self, request, view):
-        return view.action not in ["update", "partial_update", "destroy"]
+        # Payments are only created through create_payment and create_fine.
+        return view.action not in ["create", "update", "partial_update", "destroy"]
@@ -1,4 +1,6 @@
-from django.db.models import Q, F
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 
 from utils.stripe import (
@@ -7,6 +9,53 @@ from utils.stripe import (
 )
 from borrowing.models import Borrowing
 from payment.models import Payment
+from payment.tasks import (
+    SESSION_FACTORIES,
+    create_checkout_session,
+    session_idempotency_key,
+)
+from utils.fields import BulkPrimaryKeyRelatedField
+
+
+def create_payment_without_session(**fields) -> Payment:
+    """Create a payment now and its Stripe session in a Celery task."""
+    payment = Payment.objects.create(status=Payment.Status.PENDING_SESSION, **fields)
+    # If the task can't be queued, requeue_stale_session_requests does it later.
+    transaction.on_commit(
+        lambda: create_checkout_session.delay(payment.id), robust=True
+    )
+    return payment
+
+
+def renew_session(payment: Payment) -> Payment:
+    """
+    Give a payment whose Stripe session expired, or was lost before it was
+    created, a new session.
+
+    The expired session is part of the idempotency key, so a repeated
+    request gets the same new session.
+    """
+    expired_session_id = payment.session_id
+    payment.session_requested_at = timezone.now()
+    if settings.STRIPE_ASYNC_SESSIONS:
+        payment.status = Payment.Status.PENDING_SESSION
+        payment.save(update_fields=["status", "session_requested_at"])
+        transaction.on_commit(
+            lambda: create_checkout_session.delay(payment.id, expired_session_id),
+            robust=True,
+        )
+        return payment
+    session = SESSION_FACTORIES[payment.type](
+        payment.borrowing,
+        idempotency_key=session_idempotency_key(payment.id, expired_session_id),
+    )
+    payment.status = Payment.Status.PENDING
+    payment.session_url = session.url
+    payment.session_id = session.id
+    payment.save(
+        update_fields=["status", "session_url", "session_id", "session_requested_at"]
+    )
+    return payment
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -33,44 +82,52 @@ class PaymentSerializer(serializers.ModelSerializer):
 
 
 class CreatePaymentSerializer(serializers.Serializer):
-    borrowing = serializers.PrimaryKeyRelatedField(queryset=Borrowing.objects.all())
+    borrowing = BulkPrimaryKeyRelatedField(queryset=Borrowing.objects.all())
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "request" in self.context:
             user = self.context["request"].user
-            paid_borrowing_payments_ids = Payment.objects.filter(
-                type="PAYMENT", status="PAID"
-            ).values_list("borrowing_id", flat=True)
-            if user.is_staff:
-                not_paid_borrowing_payments_ids = Borrowing.objects.exclude(
-                    id__in=paid_borrowing_payments_ids
+            not_paid_borrowing_payments_ids = Borrowing.objects.without_paid(
+                Payment.Type.PAYMENT
+            )
+            if not user.is_staff:
+                not_paid_borrowing_payments_ids = (
+                    not_paid_borrowing_payments_ids.filter(user=user)
                 )
-            else:
-                not_paid_borrowing_payments_ids = Borrowing.objects.exclude(
-                    id__in=paid_borrowing_payments_ids
-                ).filter(user=user)
-
-            self.fields[
-                "borrowing"
-            ].queryset = not_paid_borrowing_payments_ids.select_related().prefetch_related(
-                "book"
+
+            self.fields["borrowing"].queryset = (
+                not_paid_borrowing_payments_ids.select_related()
             )
 
     def validate(self, data):
         borrowing = data.get("borrowing")
 
-        if Payment.objects.filter(
-            borrowing=borrowing, type=Payment.Type.PAYMENT
-        ).exists():
+        payment = (
+            Payment.objects.select_related("borrowing")
+            .filter(borrowing=borrowing, type=Payment.Type.PAYMENT)
+            .first()
+        )
+        if payment is not None and not (
+            payment.session_expired or payment.session_request_stale
+        ):
             raise serializers.ValidationError(
                 "Payment already exist for this Borrowing"
             )
+        data["payment"] = payment
         return data
 
     def create(self, validated_data):
         borrowing = validated_data["borrowing"]
 
+        if validated_data["payment"] is not None:
+            return renew_session(validated_data["payment"])
+        if settings.STRIPE_ASYNC_SESSIONS:
+            return create_payment_without_session(
+                type=Payment.Type.PAYMENT,
+                borrowing=borrowing,
+                money_to_pay=borrowing.calculate_payment_amount(),
+            )
         session = create_stripe_session_for_payment(borrowing)
 
         payment = Payment.objects.create(
@@ -84,44 +141,50 @@ class CreatePaymentSerializer(serializers.Serializer):
 
 
 class CreateFineSerializer(serializers.Serializer):
-    borrowing = serializers.PrimaryKeyRelatedField(queryset=Borrowing.objects.all())
+    borrowing = BulkPrimaryKeyRelatedField(queryset=Borrowing.objects.all())
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if "request" in self.context:
             user = self.context["request"].user
-            borrowing_overdue = Borrowing.objects.filter(
-                Q(actual_return_date__isnull=False)
-                & Q(expected_return_date__lt=F("actual_return_date"))
+            not_paid_borrowing_fine_ids = (
+                Borrowing.objects.returned_late().without_paid(Payment.Type.FINE)
             )
-            paid_borrowing_fine_ids = Payment.objects.filter(
-                type="FINE", status="PAID"
-            ).values_list("borrowing_id", flat=True)
-            if user.is_staff:
-                not_paid_borrowing_fine_ids = borrowing_overdue.exclude(
-                    id__in=paid_borrowing_fine_ids
+            if not user.is_staff:
+                not_paid_borrowing_fine_ids = not_paid_borrowing_fine_ids.filter(
+                    user=user
                 )
-            else:
-                not_paid_borrowing_fine_ids = borrowing_overdue.exclude(
-                    id__in=paid_borrowing_fine_ids
-                ).filter(user=user)
-
-            self.fields[
-                "borrowing"
-            ].queryset = not_paid_borrowing_fine_ids.select_related().prefetch_related(
-                "book"
+
+            self.fields["borrowing"].queryset = (
+                not_paid_borrowing_fine_ids.select_related()
             )
 
     def validate(self, data):
         borrowing = data.get("borrowing")
 
-        if Payment.objects.filter(borrowing=borrowing, type=Payment.Type.FINE).exists():
+        fine = (
+            Payment.objects.select_related("borrowing")
+            .filter(borrowing=borrowing, type=Payment.Type.FINE)
+            .first()
+        )
+        if fine is not None and not (
+            fine.session_expired or fine.session_request_stale
+        ):
             raise serializers.ValidationError("Fine already exist for this Borrowing")
+        data["fine"] = fine
         return data
 
     def create(self, validated_data):
         borrowing = validated_data["borrowing"]
 
+        if validated_data["fine"] is not None:
+            return renew_session(validated_data["fine"])
+        if settings.STRIPE_ASYNC_SESSIONS:
+            return create_payment_without_session(
+                type=Payment.Type.FINE,
+                borrowing=borrowing,
+                money_to_pay=borrowing.calculate_fine_amount(),
+            )
         session = create_stripe_session_for_fine(borrowing)
 
         fine = Payment.objects.create(
@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from borrowing.models import Borrowing
+from borrowing.signals import bump_borrowing_version
+from payment.models import Payment
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def bump_borrowing_version_on_payment_change(sender, instance, **kwargs):
+    if Payment.borrowing.is_cached(instance):
+        user_id = instance.borrowing.user_id
+    else:
+        user_id = (
+            Borrowing.objects.filter(pk=instance.borrowing_id)
+            .values_list("user_id", flat=True)
+            .first()
+        )
+    bump_borrowing_version(user_id)
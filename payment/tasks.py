@@ -0,0 +1,187 @@
+import stripe
+from celery import shared_task
+from django.db import transaction
+from django.utils import timezone
+
+from borrowing.signals import bump_borrowing_version
+from notification.outbox import enqueue_notifications
+from payment.models import Payment, StripeEvent
+from payment.webhooks import SESSION_EXPIRED, payment_paid_message
+from utils.stripe import (
+    create_stripe_session_for_fine,
+    create_stripe_session_for_payment,
+)
+
+
+SESSION_FACTORIES = {
+    Payment.Type.PAYMENT: create_stripe_session_for_payment,
+    Payment.Type.FINE: create_stripe_session_for_fine,
+}
+# Errors that may go away on their own; the others are raised at once.
+RETRYABLE_STRIPE_ERRORS = (
+    stripe.APIConnectionError,
+    stripe.APIError,
+    stripe.RateLimitError,
+)
+EVENT_BATCH_SIZE = 500
+
+
+def session_idempotency_key(payment_id: int, expired_session_id: str = None) -> str:
+    key = f"payment-{payment_id}"
+    if expired_session_id:
+        key += f"-after-{expired_session_id}"
+    return key
+
+
+@shared_task(bind=True, max_retries=5)
+def create_checkout_session(self, payment_id: int, expired_session_id: str = None):
+    """
+    Create the Stripe session of a payment waiting for one.
+
+    The payment id (and the expired session it replaces, if any) is the
+    idempotency key of the session, so a retry after a lost response gets
+    the session Stripe already created. If the first session can't be
+    created, the payment is deleted so it can be requested again; a payment
+    whose session expired stays due, without a session.
+    """
+    payment = (
+        Payment.objects.select_related("borrowing")
+        .filter(id=payment_id, status=Payment.Status.PENDING_SESSION)
+        .first()
+    )
+    if payment is None:
+        return None
+
+    try:
+        session = SESSION_FACTORIES[payment.type](
+            payment.borrowing,
+            idempotency_key=session_idempotency_key(payment.id, expired_session_id),
+        )
+    except stripe.StripeError as exc:
+        if (
+            isinstance(exc, RETRYABLE_STRIPE_ERRORS)
+            and self.request.retries < self.max_retries
+        ):
+            raise self.retry(exc=exc, countdown=2**self.request.retries)
+        waiting = Payment.objects.filter(
+            id=payment_id, status=Payment.Status.PENDING_SESSION
+        )
+        if expired_session_id:
+            with transaction.atomic():
+                if waiting.update(status=Payment.Status.PENDING):
+                    bump_borrowing_version(payment.borrowing.user_id)
+        else:
+            waiting.delete()
+        raise
+
+    with transaction.atomic():
+        updated = Payment.objects.filter(
+            id=payment_id, status=Payment.Status.PENDING_SESSION
+        ).update(
+            status=Payment.Status.PENDING,
+            session_url=session.url,
+            session_id=session.id,
+        )
+        if updated:
+            bump_borrowing_version(payment.borrowing.user_id)
+    return session.id
+
+
+@shared_task
+def requeue_stale_session_requests():
+    """
+    Queue the session task again for payments waiting for it too long.
+
+    The task is lost if the broker was down when it was queued, or if its
+    worker died. A task that is only late does no harm: the idempotency key
+    gets it the same session. Returns how many payments were requeued.
+    """
+    with transaction.atomic():
+        stale = list(
+            Payment.objects.stale_session_requests()
+            .select_for_update(skip_locked=True)
+            .values_list("id", "session_id")
+        )
+        Payment.objects.filter(id__in=[payment_id for payment_id, _ in stale]).update(
+            session_requested_at=timezone.now()
+        )
+    for payment_id, expired_session_id in stale:
+        create_checkout_session.delay(payment_id, expired_session_id)
+    return len(stale)
+
+
+def apply_stripe_events_batch(batch_size: int) -> dict:
+    """
+    Apply the oldest unprocessed Stripe events to the payments.
+
+    Events are claimed with SKIP LOCKED and marked processed in the same
+    transaction. Payments of completed sessions are marked paid with one
+    UPDATE keyed on their session ids, and their notifications are queued.
+    Payments of expired sessions stay pending without a session URL, until
+    their owner requests them again. Events about sessions that were
+    already applied, or that aren't ours, change nothing.
+    """
+    counts = {"events": 0, "paid": 0, "expired": 0}
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects.filter(processed_at__isnull=True)
+            .select_for_update(skip_locked=True)
+            .order_by("received_at", "id")[:batch_size]
+        )
+        if not events:
+            return counts
+        paid_sessions, expired_sessions = set(), set()
+        for event in events:
+            session = event.payload["data"]["object"]
+            if event.type == SESSION_EXPIRED:
+                expired_sessions.add(session["id"])
+            elif session.get("payment_status") == "paid":
+                paid_sessions.add(session["id"])
+
+        paid = list(
+            Payment.objects.unpaid()
+            .filter(session_id__in=paid_sessions)
+            .select_related("borrowing__user")
+            .prefetch_related("borrowing__book")
+            .select_for_update(of=("self",))
+        )
+        if paid:
+            Payment.objects.unpaid().filter(session_id__in=paid_sessions).update(
+                status=Payment.Status.PAID
+            )
+            enqueue_notifications(payment_paid_message(payment) for payment in paid)
+
+        expired = dict(
+            Payment.objects.filter(
+                session_id__in=expired_sessions, status=Payment.Status.PENDING
+            )
+            .exclude(session_url="")
+            .select_for_update(of=("self",))
+            .values_list("id", "borrowing__user_id")
+        )
+        if expired:
+            Payment.objects.filter(id__in=expired).update(session_url="")
+
+        # update() skips the signals that bump the borrowing stamps.
+        user_ids = {payment.borrowing.user_id for payment in paid}
+        user_ids.update(expired.values())
+        if user_ids:
+            bump_borrowing_version(*user_ids)
+
+        StripeEvent.objects.filter(id__in=[event.id for event in events]).update(
+            processed_at=timezone.now()
+        )
+    counts.update(events=len(events), paid=len(paid), expired=len(expired))
+    return counts
+
+
+@shared_task
+def apply_stripe_events(batch_size: int = EVENT_BATCH_SIZE):
+    """Apply the pending Stripe events batch by batch, until none is left."""
+    totals = {"events": 0, "paid": 0, "expired": 0}
+    while True:
+        counts = apply_stripe_events_batch(batch_size)
+        for name, count in counts.items():
+            totals[name] += count
+        if counts["events"] < batch_size:
+            return totals
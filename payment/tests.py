@@ -1,13 +1,30 @@
-from django.test import TestCase
+import json
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+import stripe
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 
 from book.models import Book
 from borrowing.models import Borrowing
-from payment.models import Payment
+from library_api_service.celery import app as celery_app
+from notification.models import Notification
+from payment.models import SESSION_REQUEST_TIMEOUT, Payment, StripeEvent
 from payment.serializers import PaymentSerializer, PaymentRetrieveSerializer
+from payment.tasks import (
+    apply_stripe_events,
+    create_checkout_session,
+    requeue_stale_session_requests,
+)
+from utils.fake_stripe import FakeStripeServer, sign_webhook
 
 PAYMENT_URL = reverse("payment:payment-list")
 
@@ -276,3 +293,341 @@ class AdminPaymentAPITests(TestCase):
         response = self.client.delete(url)
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(STRIPE_ASYNC_SESSIONS=True)
+class AsyncCheckoutSessionTests(TestCase):
+    def setUp(self):
+        # Run the session task in process, like a worker would.
+        for name in ("task_always_eager", "task_eager_propagates"):
+            self.addCleanup(setattr, celery_app.conf, name, celery_app.conf[name])
+            celery_app.conf[name] = True
+        self.fake = FakeStripeServer().start()
+        self.addCleanup(self.fake.stop)
+        stripe_settings = {
+            "api_key": "sk_test_fake",
+            "api_base": self.fake.base_url,
+            "max_network_retries": 0,
+        }
+        for name, value in stripe_settings.items():
+            patcher = mock.patch.object(stripe, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.user = sample_user(email="reader@mail.com")
+        self.client.force_authenticate(user=self.user)
+        self.borrowing = Borrowing.objects.create(
+            expected_return_date=date.today() + timedelta(days=4), user=self.user
+        )
+        self.borrowing.book.add(sample_book(title="Book1"), sample_book(title="Book2"))
+
+    def create_payment(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse("payment:payment-create-payment"),
+                {"borrowing": self.borrowing.id},
+            )
+
+    def test_payment_is_accepted_then_gets_its_session(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                reverse("payment:payment-create-payment"),
+                {"borrowing": self.borrowing.id},
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        payment = Payment.objects.get()
+        self.assertEqual(payment.status, Payment.Status.PENDING_SESSION)
+        self.assertEqual(payment.money_to_pay, Decimal("5.00"))
+        self.assertEqual(response["Location"], response.data["poll_url"])
+        self.assertTrue(response.data["poll_url"].endswith(detail_url(payment.id)))
+        self.assertEqual(self.fake.sessions, {})
+
+        for callback in callbacks:
+            callback()
+        poll = self.client.get(response.data["poll_url"])
+
+        self.assertEqual(poll.data["status"], Payment.Status.PENDING)
+        session = self.fake.sessions[poll.data["session_id"]]
+        self.assertEqual(poll.data["session_url"], session["url"])
+        self.assertEqual(session["amount_total"], 500)
+
+    def test_new_session_changes_the_borrowings_etag(self):
+        payment = Payment.objects.create(
+            borrowing=self.borrowing,
+            status=Payment.Status.PENDING_SESSION,
+            money_to_pay=Decimal("5.00"),
+        )
+        borrowings = self.client.get(reverse("borrowing:borrowing-list"))
+
+        create_checkout_session.delay(payment.id)
+        response = self.client.get(
+            reverse("borrowing:borrowing-list"), HTTP_IF_NONE_MATCH=borrowings["ETag"]
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["results"][0]["payment"][0]["status"],
+            Payment.Status.PENDING,
+        )
+
+    def test_pending_session_blocks_new_borrowings(self):
+        Payment.objects.create(
+            borrowing=self.borrowing,
+            status=Payment.Status.PENDING_SESSION,
+            money_to_pay=Decimal("5.00"),
+        )
+
+        response = self.client.post(
+            reverse("borrowing:borrowing-list"),
+            {
+                "book": [self.borrowing.book.first().id],
+                "expected_return_date": "2030-01-01",
+            },
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_stripe_errors_are_retried_with_the_same_idempotency_key(self):
+        self.fake.fail_requests = 2
+        # Eager retries run at once and then raise Retry to the caller.
+        celery_app.conf["task_eager_propagates"] = False
+
+        self.create_payment()
+
+        payment = Payment.objects.get()
+        self.assertEqual(payment.status, Payment.Status.PENDING)
+        self.assertEqual(self.fake.requests, 3)
+        self.assertEqual(
+            self.fake.idempotency_keys, {f"payment-{payment.id}": payment.session_id}
+        )
+
+    def test_expired_session_is_renewed_in_the_task(self):
+        payment = Payment.objects.create(
+            borrowing=self.borrowing,
+            session_id="cs_test_expired",
+            money_to_pay=Decimal("5.00"),
+        )
+
+        response = self.create_payment()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.Status.PENDING)
+        self.assertEqual(
+            self.fake.idempotency_keys,
+            {f"payment-{payment.id}-after-cs_test_expired": payment.session_id},
+        )
+
+    def test_session_is_requeued_when_the_task_cannot_be_queued(self):
+        delay = mock.patch.object(
+            create_checkout_session, "delay", side_effect=ConnectionError
+        )
+        with delay, self.assertLogs(level="ERROR"):
+            response = self.create_payment()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        payment = Payment.objects.get()
+        self.assertEqual(payment.status, Payment.Status.PENDING_SESSION)
+        self.assertEqual(requeue_stale_session_requests(), 0)
+
+        Payment.objects.update(
+            session_requested_at=timezone.now() - SESSION_REQUEST_TIMEOUT
+        )
+
+        self.assertEqual(requeue_stale_session_requests(), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.Status.PENDING)
+        self.assertEqual(
+            self.fake.idempotency_keys, {f"payment-{payment.id}": payment.session_id}
+        )
+
+    def test_stale_pending_session_can_be_requested_again(self):
+        payment = Payment.objects.create(
+            borrowing=self.borrowing,
+            status=Payment.Status.PENDING_SESSION,
+            money_to_pay=Decimal("5.00"),
+        )
+
+        self.assertEqual(
+            self.create_payment().status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+        Payment.objects.update(
+            session_requested_at=timezone.now() - SESSION_REQUEST_TIMEOUT
+        )
+        response = self.create_payment()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.Status.PENDING)
+        self.assertTrue(payment.session_url)
+
+    def test_payment_is_dropped_when_stripe_keeps_failing(self):
+        self.fake.fail_requests = 100
+        payment = Payment.objects.create(
+            borrowing=self.borrowing,
+            status=Payment.Status.PENDING_SESSION,
+            money_to_pay=Decimal("5.00"),
+        )
+
+        with self.assertRaises(stripe.APIError):
+            create_checkout_session.apply(
+                args=[payment.id], retries=create_checkout_session.max_retries
+            )
+
+        self.assertFalse(Payment.objects.exists())
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET="whsec_test")
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        for name in ("task_always_eager", "task_eager_propagates"):
+            self.addCleanup(setattr, celery_app.conf, name, celery_app.conf[name])
+            celery_app.conf[name] = True
+        self.fake = FakeStripeServer().start()
+        self.addCleanup(self.fake.stop)
+        stripe_settings = {"api_key": "sk_test_fake", "api_base": self.fake.base_url}
+        for name, value in stripe_settings.items():
+            patcher = mock.patch.object(stripe, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.user = sample_user(email="reader@mail.com")
+        self.borrowings = []
+        for n in range(3):
+            borrowing = Borrowing.objects.create(
+                expected_return_date=date.today() + timedelta(days=4), user=self.user
+            )
+            borrowing.book.add(sample_book(title=f"Book{n}"))
+            self.borrowings.append(borrowing)
+        self.payments = [self.create_payment(b) for b in self.borrowings]
+        Notification.objects.all().delete()
+
+    def create_payment(self, borrowing):
+        _, session = self.fake.create_session({}, None)
+        return Payment.objects.create(
+            borrowing=borrowing,
+            session_id=session["id"],
+            session_url=session["url"],
+            money_to_pay=Decimal("2.50"),
+        )
+
+    def send(self, event, secret="whsec_test"):
+        payload = json.dumps(event)
+        return self.client.post(
+            reverse("payment:payment-webhook"),
+            payload,
+            content_type="application/json",
+            headers={"stripe-signature": sign_webhook(payload, secret)},
+        )
+
+    def success(self, payment):
+        return self.client.get(
+            reverse("payment:payment-success"), {"session_id": payment.session_id}
+        )
+
+    def test_completed_payment_is_paid_once_events_are_applied(self):
+        payment = self.payments[0]
+        event = self.fake.pay(payment.session_id)
+
+        self.assertEqual(self.send(event).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.send(event).status_code, status.HTTP_200_OK)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(self.success(payment).status_code, status.HTTP_202_ACCEPTED)
+
+        self.assertEqual(apply_stripe_events(), {"events": 1, "paid": 1, "expired": 0})
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.Status.PAID)
+        self.assertEqual(Notification.objects.count(), 1)
+        with self.assertNumQueries(1):
+            response = self.success(payment)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.send(self.fake.event("checkout.session.completed", payment.session_id))
+        self.assertEqual(apply_stripe_events(), {"events": 1, "paid": 0, "expired": 0})
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_events_are_applied_in_batches(self):
+        for payment in self.payments:
+            self.send(self.fake.pay(payment.session_id))
+
+        with CaptureQueriesContext(connection) as queries:
+            counts = apply_stripe_events(batch_size=10)
+
+        self.assertEqual(counts, {"events": 3, "paid": 3, "expired": 0})
+        self.assertEqual(
+            Payment.objects.filter(status=Payment.Status.PAID).count(), 3
+        )
+        # Locks, fetch, update and notify, whatever the number of events.
+        self.assertLessEqual(len(queries), 12)
+
+    def test_bad_signatures_and_other_events_are_not_kept(self):
+        event = self.fake.pay(self.payments[0].session_id)
+
+        response = self.send(event, secret="whsec_other")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        other = {**event, "type": "checkout.session.async_payment_failed"}
+        response = self.send(other)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_applied_events_change_the_borrowings_etag(self):
+        self.client.force_authenticate(user=self.user)
+        borrowings = self.client.get(reverse("borrowing:borrowing-list"))
+        self.send(self.fake.pay(self.payments[0].session_id))
+
+        apply_stripe_events()
+        response = self.client.get(
+            reverse("borrowing:borrowing-list"), HTTP_IF_NONE_MATCH=borrowings["ETag"]
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        statuses = {
+            payment["id"]: payment["status"]
+            for borrowing in response.data["results"]
+            for payment in borrowing["payment"]
+        }
+        self.assertEqual(statuses[self.payments[0].id], Payment.Status.PAID)
+
+    def test_missing_secret_is_reported(self):
+        event = self.fake.pay(self.payments[0].session_id)
+
+        with override_settings(STRIPE_WEBHOOK_SECRET=None):
+            response = self.send(event)
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_expired_session_is_renewed_only_on_request(self):
+        payment = self.payments[0]
+        expired_session_id = payment.session_id
+        self.send(self.fake.expire(expired_session_id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            counts = apply_stripe_events()
+
+        self.assertEqual(counts, {"events": 1, "paid": 0, "expired": 1})
+        payment.refresh_from_db()
+        self.assertTrue(payment.session_expired)
+        self.assertEqual(self.fake.idempotency_keys, {})
+        self.assertEqual(
+            self.success(payment).status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(
+            reverse("payment:payment-create-payment"),
+            {"borrowing": payment.borrowing_id},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        payment.refresh_from_db()
+        self.assertEqual(response.data["session_url"], payment.session_url)
+        self.assertEqual(Payment.objects.count(), 3)
+        self.assertEqual(
+            self.fake.idempotency_keys,
+            {f"payment-{payment.id}-after-{expired_session_id}": payment.session_id},
+        )
@@ -1,8 +1,9 @@
-import asyncio
-import stripe.checkout
+import stripe
+from django.core.exceptions import ImproperlyConfigured
 from rest_framework import status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.viewsets import ModelViewSet
 
 from payment.models import Payment
@@ -14,27 +15,44 @@ from payment.serializers import (
     PaymentRetrieveSerializer,
     CreateFineSerializer,
 )
-from utils.telegram import send_telegram_message
+from payment.webhooks import parse_event, store_event
 
 
 class PaymentViewSet(ModelViewSet):
-    queryset = Payment.objects.select_related("borrowing__user").prefetch_related(
-        "borrowing__book"
-    )
+    queryset = Payment.objects.all()
     permission_classes = [permissions.IsAuthenticated, CanNotEditAndDeletePayments]
+    query_budgets = {
+        "list": 1,
+        "create": 0,
+        "retrieve": 2,
+        "update": 0,
+        "partial_update": 0,
+        "destroy": 0,
+        "create_payment": 3,
+        "create_fine": 3,
+        "success": 1,
+        "webhook": 1,
+        "cancel": 0,
+    }
 
     def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "retrieve":
+            queryset = queryset.select_related("borrowing__user").prefetch_related(
+                "borrowing__book"
+            )
+
         user = self.request.user
         if not user.is_staff:
-            return self.queryset.filter(borrowing__user=user)
-        return self.queryset
+            return queryset.filter(borrowing__user=user)
+        return queryset
 
     def get_serializer_class(self):
         if self.action == "create_payment":
             return CreatePaymentSerializer
         if self.action == "create_fine":
             return CreateFineSerializer
-        if self.action in ["success", "cancel"]:
+        if self.action in ["success", "cancel", "webhook"]:
             return PaymentResultSerializer
         if self.action == "retrieve":
             return PaymentRetrieveSerializer
@@ -47,10 +65,7 @@ class PaymentViewSet(ModelViewSet):
         )
         if serializer.is_valid():
             payment = serializer.save()
-            return Response(
-                {"session_url": payment.session_url},
-                status=status.HTTP_201_CREATED,
-            )
+            return self.session_response(request, payment)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=False, methods=["POST"], url_path="create_fine")
@@ -60,11 +75,30 @@ class PaymentViewSet(ModelViewSet):
         )
         if serializer.is_valid():
             fine = serializer.save()
+            return self.session_response(request, fine)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @staticmethod
+    def session_response(request, payment):
+        """
+        The session URL of a new payment, or where to poll for it.
+
+        While the Stripe session is still being created the answer is 202,
+        with the payment detail URL to poll until `session_url` is set.
+        """
+        if payment.status != Payment.Status.PENDING_SESSION:
             return Response(
-                {"session_url": fine.session_url},
+                {"session_url": payment.session_url},
                 status=status.HTTP_201_CREATED,
             )
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        poll_url = request.build_absolute_uri(
+            reverse("payment:payment-detail", args=[payment.id])
+        )
+        return Response(
+            {"id": payment.id, "status": payment.status, "poll_url": poll_url},
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": poll_url},
+        )
 
     @action(
         detail=False,
@@ -73,27 +107,54 @@ class PaymentViewSet(ModelViewSet):
         permission_classes=(permissions.AllowAny,),
     )
     def success(self, request):
+        # Payments are marked paid by the Stripe webhook events, which may
+        # arrive a bit after the customer is redirected here.
         session_id = request.query_params.get("session_id")
-        session = stripe.checkout.Session.retrieve(session_id)
+        payment_status = session_url = None
+        if session_id:
+            payment_status, session_url = (
+                Payment.objects.filter(session_id=session_id)
+                .values_list("status", "session_url")
+                .first()
+            ) or (None, None)
 
-        if session.payment_status == "paid":
-            payment = Payment.objects.get(session_id=session_id)
-            payment.status = Payment.Status.PAID
-            payment.save()
+        if payment_status == Payment.Status.PAID:
             serializer = PaymentResultSerializer({"message": "Payment was successful"})
-
-            message = (
-                f"New payment was paid: \n"
-                f"borrowing - {payment.borrowing}, \n"
-                f"type - {payment.type}, \n"
-                f"amount - {payment.money_to_pay}$."
-            )
-            asyncio.run(send_telegram_message(message))
-
             return Response(serializer.data, status=status.HTTP_200_OK)
+        # An expired session has no URL anymore.
+        if payment_status is not None and session_url:
+            serializer = PaymentResultSerializer(
+                {"message": "Payment is being confirmed"}
+            )
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
         serializer = PaymentResultSerializer({"message": "Payment not completed"})
         return Response(serializer.data, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="webhook",
+        permission_classes=(permissions.AllowAny,),
+        authentication_classes=(),
+    )
+    def webhook(self, request):
+        """Receive signed Stripe events, kept for the apply_stripe_events task."""
+        try:
+            event = parse_event(
+                request.body, request.META.get("HTTP_STRIPE_SIGNATURE", "")
+            )
+        except ImproperlyConfigured as e:
+            # Stripe delivers the event again later, once the secret is set.
+            serializer = PaymentResultSerializer({"message": str(e)})
+            return Response(
+                serializer.data, status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        except (ValueError, stripe.SignatureVerificationError):
+            serializer = PaymentResultSerializer({"message": "Invalid event"})
+            return Response(serializer.data, status=status.HTTP_400_BAD_REQUEST)
+        store_event(event)
+        return Response(status=status.HTTP_200_OK)
+
     @action(
         detail=False,
         methods=["GET"],
@@ -104,7 +165,8 @@ class PaymentViewSet(ModelViewSet):
         serializer = PaymentResultSerializer(
             {
                 "message": "Payment was cancelled. It can be paid a bit later "
-                "(session is available for only 24h.)"
+                "(session is available for only 24h, then request the payment "
+                "again for a new one.)"
             }
         )
         return Response(serializer.data, status=status.HTTP_200_OK)
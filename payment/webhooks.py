@@ -0,0 +1,54 @@
+import json
+
+import stripe
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from payment.models import Payment, StripeEvent
+
+
+SESSION_COMPLETED = "checkout.session.completed"
+SESSION_EXPIRED = "checkout.session.expired"
+HANDLED_EVENTS = (SESSION_COMPLETED, SESSION_EXPIRED)
+
+
+def parse_event(payload: bytes, signature: str) -> dict:
+    """
+    Check the Stripe signature of a webhook payload and decode it.
+
+    Raises stripe.SignatureVerificationError for a bad or stale signature,
+    ValueError for a payload that isn't JSON and ImproperlyConfigured when
+    STRIPE_WEBHOOK_SECRET isn't set.
+    """
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        raise ImproperlyConfigured("STRIPE_WEBHOOK_SECRET is not set.")
+    payload = payload.decode()
+    stripe.WebhookSignature.verify_header(
+        payload, signature, settings.STRIPE_WEBHOOK_SECRET
+    )
+    return json.loads(payload)
+
+
+def store_event(event: dict) -> bool:
+    """
+    Keep a handled event for the worker, with one INSERT.
+
+    Stripe delivers events at least once: a redelivered event is ignored.
+    Returns whether the event is of a handled type.
+    """
+    if event.get("type") not in HANDLED_EVENTS:
+        return False
+    StripeEvent.objects.bulk_create(
+        [StripeEvent(id=event["id"], type=event["type"], payload=event)],
+        ignore_conflicts=True,
+    )
+    return True
+
+
+def payment_paid_message(payment: Payment) -> str:
+    return (
+        f"New payment was paid: \n"
+        f"borrowing - {payment.borrowing}, \n"
+        f"type - {payment.type}, \n"
+        f"amount - {payment.money_to_pay}$."
+    )
@@ -39,6 +39,7 @@ class UserAdmin(DjangoUserAdmin):
     list_display = ("email", "first_name", "last_name", "is_staff")
     search_fields = ("email", "first_name", "last_name", "email")
     ordering = ("email",)
+    query_budgets = {"changelist": 6}
 
 
 admin.site.unregister(Group)
@@ -10,12 +10,14 @@ from user.serializers import UserSerializer, UserUpdateSerializer
 class CreateUserView(generics.CreateAPIView):
     serializer_class = UserSerializer
     permission_classes = (permissions.AllowAny,)
+    query_budgets = {"post": 2}
 
 
 class ManageUserView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated,)
+    query_budgets = {"get": 0, "put": 2, "patch": 1}
 
     def get_object(self):
         return self.request.user
@@ -31,6 +33,13 @@ class UserViewSet(
     queryset = get_user_model().objects.all()
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAdminUser,)
+    query_budgets = {
+        "list": 1,
+        "create": 2,
+        "retrieve": 1,
+        "update": 3,
+        "partial_update": 2,
+    }
 
     def get_serializer_class(self):
         if self.action == "update":
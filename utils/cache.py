@@ -0,0 +1,207 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+SINGLE_FLIGHT_LOCK_TIMEOUT = 30
+SINGLE_FLIGHT_WAIT = 5
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
+
+def _version_key(namespace: str) -> str:
+    return f"version:{namespace}"
+
+
+def get_versions(*namespaces: str) -> list[int]:
+    """
+    Return the version stamps of the namespaces, creating missing ones.
+
+    Stamps are nanosecond timestamps rather than counters, so a flushed
+    cache never hands out a version that was already used.
+    """
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_version(namespace: str) -> int:
+    return get_versions(namespace)[0]
+
+
+def bump_version(*namespaces: str) -> None:
+    """
+    Invalidate everything cached under the namespaces.
+
+    The stamps are bumped right away and once more after the transaction
+    commits, so a response computed from not yet committed data can't stay
+    cached under the new version.
+    """
+
+    def bump():
+        now = time.time_ns()
+        cache.set_many(
+            {_version_key(namespace): now for namespace in namespaces},
+            timeout=None,
+        )
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_or_compute(key: str, compute, timeout=None):
+    """
+    Return the cached value for `key`, computing it at most once at a time.
+
+    Concurrent misses wait for the process holding the lock to store the
+    value instead of computing it themselves (single-flight). If it takes
+    longer than SINGLE_FLIGHT_WAIT seconds, the value is computed anyway.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f"{key}:lock"
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT
+    while not cache.add(lock_key, 1, timeout=SINGLE_FLIGHT_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            return compute()
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+    try:
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            if timeout is None:
+                cache.set(key, value)
+            else:
+                cache.set(key, value, timeout)
+        return value
+    finally:
+        cache.delete(lock_key)
+
+
+class CachedResponseMixin:
+    """
+    Cache successful responses of `cache_actions` in the shared cache.
+
+    Keys are built from the full request URL and the version stamps of
+    `cache_namespaces`, so bumping a namespace invalidates the responses.
+    """
+
+    cache_actions = ("list", "retrieve")
+    cache_namespaces = ()
+    cache_timeout = None
+
+    def get_response_cache_key(self, request):
+        versions = get_versions(*self.cache_namespaces)
+        raw_key = "|".join(
+            [self.action, request.build_absolute_uri(), *map(str, versions)]
+        )
+        digest = hashlib.sha256(raw_key.encode()).hexdigest()
+        return f"response:{self.basename}:{digest}"
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        def compute():
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                raise _UncacheableResponse(response)
+            return response.data
+
+        try:
+            data = get_or_compute(
+                self.get_response_cache_key(request), compute, self.cache_timeout
+            )
+        except _UncacheableResponse as error:
+            return error.response
+        return Response(data)
+
+    def list(self, request, *args, **kwargs):
+        if "list" not in self.cache_actions:
+            return super().list(request, *args, **kwargs)
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if "retrieve" not in self.cache_actions:
+            return super().retrieve(request, *args, **kwargs)
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    Answer conditional GETs of `conditional_actions` from version stamps.
+
+    The ETag and Last-Modified validators come from the stamps returned by
+    get_version_namespaces(), so a `304 Not Modified` is sent before the
+    queryset is evaluated or anything is serialized. A retrieve only gets
+    it after an existence check of the object in get_queryset(), so a
+    missing or foreign object is still a 404.
+    """
+
+    conditional_actions = ("list", "retrieve")
+    vary_on_user = False
+
+    def get_version_namespaces(self):
+        return self.cache_namespaces
+
+    def get_validators(self, request):
+        versions = get_versions(*self.get_version_namespaces())
+        raw_etag = "|".join([self.action, request.get_full_path(), *map(str, versions)])
+        etag = f'"{hashlib.sha256(raw_etag.encode()).hexdigest()[:32]}"'
+        return etag, max(versions) // 1_000_000_000
+
+    def get_conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is not None and self.action == "retrieve":
+            self.check_object_exists()
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        if self.vary_on_user:
+            patch_vary_headers(response, ["Authorization"])
+        return response
+
+    def check_object_exists(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        if not queryset.exists():
+            raise Http404
+
+    def list(self, request, *args, **kwargs):
+        if "list" not in self.conditional_actions:
+            return super().list(request, *args, **kwargs)
+        return self.get_conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if "retrieve" not in self.conditional_actions:
+            return super().retrieve(request, *args, **kwargs)
+        return self.get_conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+
+class _UncacheableResponse(Exception):
+    def __init__(self, response):
+        self.response = response
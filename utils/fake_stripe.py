@@ -0,0 +1,160 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeStripeServer:
+    """
+    Local stand-in for the Stripe checkout sessions API, for tests and
+    benchmarks.
+
+    It creates and retrieves checkout sessions after `latency` seconds,
+    honours idempotency keys like Stripe does and records the sessions. The
+    first `fail_requests` session creations are refused with a server error.
+    Point `stripe.api_base` at `base_url` to use it, and sign its webhook
+    events with `sign_webhook`.
+    """
+
+    def __init__(self, latency: float = 0.0, fail_requests: int = 0):
+        self.latency = latency
+        self.fail_requests = fail_requests
+        self.sessions = {}
+        self.idempotency_keys = {}
+        self.requests = 0
+        self.events = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def pay(self, session_id: str) -> dict:
+        """Complete the checkout of a session, as the customer would."""
+        with self.lock:
+            self.sessions[session_id].update(payment_status="paid", status="complete")
+        return self.event("checkout.session.completed", session_id)
+
+    def expire(self, session_id: str) -> dict:
+        with self.lock:
+            self.sessions[session_id].update(status="expired")
+        return self.event("checkout.session.expired", session_id)
+
+    def event(self, event_type: str, session_id: str) -> dict:
+        """The webhook event Stripe sends about a session."""
+        with self.lock:
+            self.events += 1
+            return {
+                "id": f"evt_test_{self.events:024d}",
+                "object": "event",
+                "type": event_type,
+                "created": int(time.time()),
+                "data": {"object": dict(self.sessions[session_id])},
+            }
+
+    def create_session(self, params: dict, idempotency_key: str) -> tuple[int, dict]:
+        with self.lock:
+            self.requests += 1
+            if self.requests <= self.fail_requests:
+                return 500, {
+                    "error": {"type": "api_error", "message": "Something went wrong"}
+                }
+            if idempotency_key in self.idempotency_keys:
+                return 200, self.sessions[self.idempotency_keys[idempotency_key]]
+
+            session_id = f"cs_test_{len(self.sessions) + 1:024d}"
+            amount = int(params.get("line_items[0][price_data][unit_amount]", 0))
+            quantity = int(params.get("line_items[0][quantity]", 1))
+            session = {
+                "id": session_id,
+                "object": "checkout.session",
+                "amount_total": amount * quantity,
+                "currency": params.get("line_items[0][price_data][currency]"),
+                "mode": params.get("mode"),
+                "payment_status": "unpaid",
+                "status": "open",
+                "success_url": params.get("success_url"),
+                "cancel_url": params.get("cancel_url"),
+                "url": f"{self.base_url}/pay/{session_id}",
+            }
+            self.sessions[session_id] = session
+            if idempotency_key:
+                self.idempotency_keys[idempotency_key] = session_id
+            return 200, session
+
+    def answer(self, method: str, path: str, params: dict, headers) -> tuple[int, dict]:
+        time.sleep(self.latency)
+        prefix = "/v1/checkout/sessions"
+        if method == "POST" and path == prefix:
+            return self.create_session(params, headers.get("Idempotency-Key"))
+        if method == "GET" and path.startswith(f"{prefix}/"):
+            with self.lock:
+                session = self.sessions.get(path[len(prefix) + 1:])
+            if session is not None:
+                return 200, session
+        return 404, {
+            "error": {"type": "invalid_request_error", "message": "No such resource"}
+        }
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections alive, like the real API.
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def respond(self, method):
+                path, _, query = self.path.partition("?")
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                params = {
+                    key: values[0]
+                    for key, values in parse_qs(query or body.decode()).items()
+                }
+                status, payload = fake.answer(method, path, params, self.headers)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.respond("GET")
+
+            def do_POST(self):
+                self.respond("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def sign_webhook(payload: str, secret: str, timestamp: int = None) -> str:
+    """The Stripe-Signature header Stripe would send with `payload`."""
+    timestamp = timestamp or int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
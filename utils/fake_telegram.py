@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeTelegramServer:
+    """
+    Local stand-in for the Telegram Bot API, for tests and benchmarks.
+
+    It answers sendMessage and getMe after `latency` seconds and records the
+    sent messages and the number of HTTP connections. The first
+    `flood_requests` messages are refused with a `retry_after` flood error.
+    """
+
+    def __init__(self, latency: float = 0.0, flood_requests: int = 0, retry_after=1):
+        self.latency = latency
+        self.flood_requests = flood_requests
+        self.retry_after = retry_after
+        self.messages = []
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/bot"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def answer(self, method: str, params: dict) -> tuple[int, dict]:
+        time.sleep(self.latency)
+        if method == "getMe":
+            return 200, {
+                "ok": True,
+                "result": {"id": 1, "is_bot": True, "first_name": "Fake"},
+            }
+        if method != "sendMessage":
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+
+        with self.lock:
+            self.requests += 1
+            if self.requests <= self.flood_requests:
+                return 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            self.messages.append((params.get("chat_id"), params.get("text")))
+            message_id = len(self.messages)
+        return 200, {
+            "ok": True,
+            "result": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id") or 0), "type": "channel"},
+                "text": params.get("text"),
+            },
+        }
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections alive, like the real API.
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body or b"{}")
+                else:
+                    params = {
+                        key: values[0]
+                        for key, values in parse_qs(body.decode()).items()
+                    }
+                status, payload = fake.answer(self.path.rsplit("/", 1)[-1], params)
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except ConnectionError:
+                    # The client gave up waiting, like on a timeout.
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,67 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS, ManyRelatedField
+
+
+class BulkManyRelatedField(ManyRelatedField):
+    """ManyRelatedField that resolves the whole list in one query."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, "__iter__"):
+            self.fail("not_a_list", input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail("empty")
+
+        return self.child_relation.to_internal_values(list(data))
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that looks up all ids with a single pk__in query.
+
+    Objects are returned in the order of the submitted ids, and every missing
+    or malformed id is reported with the usual DRF error messages.
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {"child_relation": cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_internal_value(self, data):
+        return self.to_internal_values([data])[0]
+
+    def to_internal_values(self, data):
+        queryset = self.get_queryset()
+        pk_field = queryset.model._meta.pk
+        errors = []
+        pks = []
+        for value in data:
+            try:
+                if self.pk_field is not None:
+                    value = self.pk_field.to_internal_value(value)
+                if isinstance(value, bool):
+                    raise TypeError
+                pks.append(pk_field.to_python(value))
+            except (TypeError, ValueError, DjangoValidationError):
+                errors.append(
+                    self.error_messages["incorrect_type"].format(
+                        data_type=type(value).__name__
+                    )
+                )
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        objects = queryset.in_bulk(set(pks))
+        missing = list(dict.fromkeys(pk for pk in pks if pk not in objects))
+        if missing:
+            raise serializers.ValidationError(
+                [
+                    self.error_messages["does_not_exist"].format(pk_value=pk)
+                    for pk in missing
+                ]
+            )
+        return [objects[pk] for pk in pks]
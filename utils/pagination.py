@@ -0,0 +1,244 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on the full `ordering` tuple.
+
+    Unlike DRF's CursorPagination it never falls back to OFFSET for rows
+    sharing the same position, so the last field of `ordering` must be unique
+    (usually `id`). It is enabled per request by the `cursor` query parameter
+    (empty for the first page) and never runs COUNT(*).
+    Nullable fields follow the PostgreSQL defaults: NULLS LAST for ascending
+    and NULLS FIRST for descending order.
+    """
+
+    ordering = ("id",)
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        reverse, position = self.decode_cursor(request, queryset.model)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [self._reverse(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is None:
+            rows = list(queryset[: self.page_size + 1])
+        else:
+            rows = []
+            for segment in self._after(ordering, position, queryset.model):
+                rows += queryset.filter(segment)[: self.page_size + 1 - len(rows)]
+                if len(rows) > self.page_size:
+                    break
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = has_more if reverse else position is not None
+        self.first_position = self._position(rows[0]) if rows else None
+        self.last_position = self._position(rows[-1]) if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(False, self.last_position)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_position is None:
+            return None
+        return self.encode_cursor(True, self.first_position)
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Pagination cursor. Pass an empty value to get "
+                "the first page.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page "
+                f"(max {self.max_page_size}).",
+                "schema": {"type": "integer"},
+            },
+        ]
+
+    def encode_cursor(self, reverse, position):
+        payload = json.dumps({"r": int(reverse), "p": position}, separators=(",", ":"))
+        token = base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request, model):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return False, None
+        try:
+            padded = token + "=" * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            position = payload["p"]
+            if len(position) != len(self.ordering):
+                raise ValueError
+            position = [
+                None
+                if value is None
+                else self._field(model, field.lstrip("-")).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+            return bool(payload["r"]), position
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _position(self, row):
+        position = []
+        for field in self.ordering:
+            value = getattr(row, field.lstrip("-"))
+            position.append(value if value is None else str(value))
+        return position
+
+    def _after(self, ordering, position, model):
+        """
+        Rows strictly after `position` in `ordering` (nulls are largest).
+
+        They are returned as a list of conditions that select consecutive
+        segments of the ordering. Each segment starts with a range on the
+        leading field, so the index can serve the seek even when that field
+        is nullable: the non-null range and the null group are separate
+        segments instead of one OR that can only be used as a filter.
+        """
+        field, value = ordering[0], position[0]
+        name = field.lstrip("-")
+        nullable = self._field(model, name).null
+
+        rest = Q(pk__in=[])
+        equal_so_far = Q()
+        for next_field, next_value in zip(ordering[1:], position[1:]):
+            next_name = next_field.lstrip("-")
+            if next_field.startswith("-"):
+                after = self._less(next_name, next_value)
+            else:
+                after = self._greater(next_name, next_value, model)
+            rest |= equal_so_far & after
+            equal_so_far &= self._equal(next_name, next_value)
+
+        if value is None:
+            # Nulls are one group: seek inside it on the next field.
+            segments = [Q(**{f"{name}__isnull": True}) & rest]
+            if len(ordering) > 1:
+                segments[0] &= self._bound(ordering[1], position[1], model)
+            if field.startswith("-"):
+                segments.append(Q(**{f"{name}__isnull": False}))
+            return segments
+
+        if field.startswith("-"):
+            return [
+                Q(**{f"{name}__lte": value})
+                & (Q(**{f"{name}__lt": value}) | Q(**{name: value}) & rest)
+            ]
+
+        segments = [
+            Q(**{f"{name}__gte": value})
+            & (Q(**{f"{name}__gt": value}) | Q(**{name: value}) & rest)
+        ]
+        if nullable:
+            segments.append(Q(**{f"{name}__isnull": True}))
+        return segments
+
+    def _bound(self, field, value, model):
+        """Range on `field` that includes every row from `value` onwards."""
+        name = field.lstrip("-")
+        if field.startswith("-"):
+            return Q() if value is None else Q(**{f"{name}__lte": value})
+        if value is None:
+            return Q(**{f"{name}__isnull": True})
+        condition = Q(**{f"{name}__gte": value})
+        if self._field(model, name).null:
+            condition |= Q(**{f"{name}__isnull": True})
+        return condition
+
+    def _greater(self, name, value, model):
+        if value is None:
+            return Q(pk__in=[])
+        condition = Q(**{f"{name}__gt": value})
+        if self._field(model, name).null:
+            condition |= Q(**{f"{name}__isnull": True})
+        return condition
+
+    @staticmethod
+    def _less(name, value):
+        if value is None:
+            return Q(**{f"{name}__isnull": False})
+        return Q(**{f"{name}__lt": value})
+
+    @staticmethod
+    def _equal(name, value):
+        if value is None:
+            return Q(**{f"{name}__isnull": True})
+        return Q(**{name: value})
+
+    @staticmethod
+    def _reverse(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    @staticmethod
+    def _field(model, name):
+        if name == "pk":
+            return model._meta.pk
+        return model._meta.get_field(name)
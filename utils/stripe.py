@@ -3,7 +3,9 @@ import stripe
 from borrowing.models import Borrowing
 
 
-def create_stripe_session_for_payment(borrowing: Borrowing) -> stripe.checkout.Session:
+def create_stripe_session_for_payment(
+    borrowing: Borrowing, idempotency_key: str = None
+) -> stripe.checkout.Session:
     session = stripe.checkout.Session.create(
         line_items=[
             {
@@ -20,12 +22,15 @@ def create_stripe_session_for_payment(borrowing: Borrowing) -> stripe.checkout.S
         mode="payment",
         success_url="http://127.0.0.1:8000/api/library/payments/success?session_id={CHECKOUT_SESSION_ID}",
         cancel_url="http://127.0.0.1:8000/api/library/payments/cancel",
+        idempotency_key=idempotency_key,
     )
 
     return session
 
 
-def create_stripe_session_for_fine(borrowing: Borrowing) -> stripe.checkout.Session:
+def create_stripe_session_for_fine(
+    borrowing: Borrowing, idempotency_key: str = None
+) -> stripe.checkout.Session:
     session = stripe.checkout.Session.create(
         line_items=[
             {
@@ -42,6 +47,7 @@ def create_stripe_session_for_fine(borrowing: Borrowing) -> stripe.checkout.Sess
         mode="payment",
         success_url="http://127.0.0.1:8000/api/library/payments/success?session_id={CHECKOUT_SESSION_ID}",
         cancel_url="http://127.0.0.1:8000/api/library/payments/cancel",
+        idempotency_key=idempotency_key,
     )
 
     return session
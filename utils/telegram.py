@@ -1,15 +1,239 @@
-import telegram
-import logging
+import atexit
 import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+import telegram
 from django.conf import settings
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+
+
+class TokenBucket:
+    """Allow `rate` events per `per` seconds, in bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, per: float = 1.0, capacity: float = None):
+        self.rate = rate / per
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class TelegramClient:
+    """
+    Long-lived Telegram client of a process.
+
+    Messages are sent by a background event loop over a pool of kept-alive
+    HTTP connections, paced by token buckets for the global and per-chat
+    rate limits of Telegram. Every HTTP call is bounded by `timeout`. Flood
+    errors are waited out at most `flood_retries` times, and only when
+    Telegram asks for `max_flood_wait` seconds or less.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        chat_id,
+        base_url: str = "https://api.telegram.org/bot",
+        messages_per_second: float = 30,
+        chat_messages_per_minute: float = 20,
+        timeout: float = 10,
+        pool_size: int = 4,
+        flood_retries: int = 3,
+        max_flood_wait: float = 60,
+    ):
+        self.chat_id = chat_id
+        self.timeout = timeout
+        self.flood_retries = flood_retries
+        self.max_flood_wait = max_flood_wait
+        self.bot = telegram.Bot(
+            token=token,
+            base_url=base_url,
+            request=HTTPXRequest(
+                connection_pool_size=pool_size,
+                connect_timeout=timeout,
+                read_timeout=timeout,
+                write_timeout=timeout,
+                pool_timeout=timeout,
+            ),
+        )
+        self.global_bucket = TokenBucket(messages_per_second)
+        self.chat_buckets = defaultdict(
+            lambda: TokenBucket(chat_messages_per_minute, per=60)
+        )
+        self.pending = set()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="telegram-client", daemon=True
+        )
+        self.thread.start()
+
+    async def send_message(self, chat_id, text: str) -> None:
+        """Send one paced message, sleeping off short flood errors."""
+        await self.chat_buckets[chat_id].acquire()
+        await self.global_bucket.acquire()
+        for retry in range(self.flood_retries + 1):
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return
+            except RetryAfter as e:
+                if retry == self.flood_retries or e.retry_after > self.max_flood_wait:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    async def deliver(self, messages: list[str], chat_id=None) -> list[str | None]:
+        """Send messages to a chat in order, returning the error of each."""
+        chat_id = chat_id or self.chat_id
+        errors = []
+        for message in messages:
+            try:
+                await self.send_message(chat_id, message)
+                errors.append(None)
+            except Exception as e:
+                logging.info(f"Failed to send message: {e}")
+                errors.append(str(e) or type(e).__name__)
+        return errors
+
+    async def send_messages(self, messages: list[str], chat_id=None) -> int:
+        """Send messages to a chat in order, returning how many were sent."""
+        errors = await self.deliver(messages, chat_id)
+        return errors.count(None)
+
+    def run(self, coroutine) -> concurrent.futures.Future:
+        """Run a coroutine on the event loop of the client, from any thread."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        return future
+
+    def submit(self, messages, chat_id=None) -> concurrent.futures.Future:
+        """Queue messages on the event loop of the client, from any thread."""
+        return self.run(self.send_messages(list(messages), chat_id))
 
+    def close(self) -> None:
+        """Wait a bit for queued messages, then release the connections."""
+        concurrent.futures.wait(list(self.pending), timeout=self.timeout)
+        shutdown = asyncio.run_coroutine_threadsafe(self.bot.shutdown(), self.loop)
+        try:
+            shutdown.result(self.timeout)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(self.timeout)
 
-async def send_telegram_message(message: str) -> None:
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_telegram_client() -> TelegramClient:
+    """The client of this process, created on first use and after a fork."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = TelegramClient(
+                token=settings.TELEGRAM_BOT_TOKEN,
+                chat_id=settings.TELEGRAM_CHAT_ID,
+                base_url=settings.TELEGRAM_BASE_URL,
+                messages_per_second=settings.TELEGRAM_MESSAGES_PER_SECOND,
+                chat_messages_per_minute=settings.TELEGRAM_CHAT_MESSAGES_PER_MINUTE,
+                timeout=settings.TELEGRAM_SEND_TIMEOUT,
+                pool_size=settings.TELEGRAM_POOL_SIZE,
+                flood_retries=settings.TELEGRAM_FLOOD_RETRIES,
+                max_flood_wait=settings.TELEGRAM_MAX_FLOOD_WAIT,
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+@atexit.register
+def close_telegram_client() -> None:
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None and _client_pid == os.getpid():
+        client.close()
+
+
+def send_telegram_message(message: str) -> None:
     """Send message to the telegram channel"""
 
     try:
-        bot = telegram.Bot(token=settings.TELEGRAM_BOT_TOKEN)
-        await bot.send_message(chat_id=settings.TELEGRAM_CHAT_ID, text=message)
-        logging.info(f"Message sent successfully: {message}")
+        future = get_telegram_client().submit([message])
     except Exception as e:
         logging.info(f"Failed to send message: {e}")
+        return
+    try:
+        if future.result(settings.TELEGRAM_SEND_TIMEOUT):
+            logging.info(f"Message sent successfully: {message}")
+    except TimeoutError:
+        logging.info(f"Message is still being sent: {message}")
+
+
+def send_telegram_messages(messages: list[str]) -> int:
+    """
+    Send messages to the telegram channel in order, waiting for all of them.
+
+    Returns how many were sent; failures are logged and the rest is still
+    sent. Sending is given up after TELEGRAM_BATCH_TIMEOUT seconds, and 0
+    is returned.
+    """
+    try:
+        client = get_telegram_client()
+    except Exception as e:
+        logging.info(f"Failed to send messages: {e}")
+        return 0
+    future = client.submit(messages)
+    try:
+        sent = future.result(settings.TELEGRAM_BATCH_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        logging.info(f"Gave up sending {len(messages)} messages: timed out")
+        return 0
+    logging.info(f"{sent} of {len(messages)} messages sent")
+    return sent
+
+
+def pack_messages(
+    parts, separator: str = "\n\n", limit: int = MessageLimit.MAX_TEXT_LENGTH
+):
+    """
+    Join parts into as few messages of at most `limit` characters as possible.
+
+    Parts keep their order and are only split when a single part is longer
+    than `limit`.
+    """
+    message = ""
+    for part in parts:
+        while len(part) > limit:
+            if message:
+                yield message
+                message = ""
+            yield part[:limit]
+            part = part[limit:]
+        if not message:
+            message = part
+        elif len(message) + len(separator) + len(part) <= limit:
+            message += separator + part
+        else:
+            yield message
+            message = part
+    if message:
+        yield message
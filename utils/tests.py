@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from utils.fake_telegram import FakeTelegramServer
+from utils.telegram import (
+    TelegramClient,
+    TokenBucket,
+    close_telegram_client,
+    get_telegram_client,
+    send_telegram_message,
+    send_telegram_messages,
+)
+
+
+TOKEN = "123456:test"
+UNLIMITED = {"messages_per_second": 10**6, "chat_messages_per_minute": 10**8}
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_bursts_up_to_capacity_then_paces(self):
+        bucket = TokenBucket(20, capacity=2)
+
+        async def acquire(times):
+            for _ in range(times):
+                await bucket.acquire()
+
+        started = time.monotonic()
+        asyncio.run(acquire(2))
+        self.assertLess(time.monotonic() - started, 0.05)
+        asyncio.run(acquire(4))
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+
+class TelegramClientTests(SimpleTestCase):
+    def start_fake(self, **options):
+        fake = FakeTelegramServer(**options).start()
+        self.addCleanup(fake.stop)
+        return fake
+
+    def create_client(self, fake, **options):
+        options = {"pool_size": 2, "timeout": 2, **UNLIMITED, **options}
+        client = TelegramClient(TOKEN, chat_id=-100, base_url=fake.base_url, **options)
+        self.addCleanup(client.close)
+        return client
+
+    def test_messages_are_sent_in_order_over_one_connection(self):
+        fake = self.start_fake()
+        client = self.create_client(fake)
+        messages = [f"Message {n}" for n in range(30)]
+
+        sent = client.submit(messages).result()
+
+        self.assertEqual(sent, 30)
+        self.assertEqual(fake.messages, [("-100", message) for message in messages])
+        self.assertEqual(fake.connections, 1)
+
+    def test_concurrent_chats_share_the_connection_pool(self):
+        fake = self.start_fake(latency=0.02)
+        client = self.create_client(fake)
+
+        futures = [
+            client.submit([f"{chat}-{n}" for n in range(5)], chat_id=chat)
+            for chat in range(4)
+        ]
+
+        self.assertEqual([future.result() for future in futures], [5] * 4)
+        self.assertEqual(len(fake.messages), 20)
+        self.assertLessEqual(fake.connections, 2)
+
+    def test_global_rate_is_respected(self):
+        fake = self.start_fake()
+        client = self.create_client(fake, messages_per_second=10)
+
+        started = time.monotonic()
+        client.submit(["Message"] * 15).result()
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.45)
+
+    def test_flood_errors_are_retried_after_the_requested_delay(self):
+        fake = self.start_fake(flood_requests=1, retry_after=1)
+        client = self.create_client(fake)
+
+        started = time.monotonic()
+        sent = client.submit(["First", "Second"]).result()
+
+        self.assertEqual(sent, 2)
+        self.assertGreaterEqual(time.monotonic() - started, 1)
+        self.assertEqual([text for _, text in fake.messages], ["First", "Second"])
+
+    def test_flood_errors_are_retried_a_bounded_number_of_times(self):
+        fake = self.start_fake(flood_requests=10, retry_after=1)
+        client = self.create_client(fake, flood_retries=1)
+
+        sent = client.submit(["Message"]).result()
+
+        self.assertEqual(sent, 0)
+        self.assertEqual(fake.requests, 2)
+
+    def test_long_flood_waits_are_not_waited_out(self):
+        fake = self.start_fake(flood_requests=1, retry_after=3600)
+        client = self.create_client(fake, max_flood_wait=5)
+
+        started = time.monotonic()
+        sent = client.submit(["Message"]).result()
+
+        self.assertEqual(sent, 0)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_slow_server_is_bounded_by_the_timeout(self):
+        fake = self.start_fake(latency=1.5)
+        client = self.create_client(fake, timeout=0.3)
+
+        started = time.monotonic()
+        sent = client.submit(["Message"]).result()
+
+        self.assertEqual(sent, 0)
+        self.assertLess(time.monotonic() - started, 1.5)
+
+
+class SendTelegramMessageTests(SimpleTestCase):
+    def setUp(self):
+        fake = FakeTelegramServer().start()
+        self.addCleanup(fake.stop)
+        self.fake = fake
+        settings = override_settings(
+            TELEGRAM_BOT_TOKEN=TOKEN,
+            TELEGRAM_CHAT_ID="-100",
+            TELEGRAM_BASE_URL=fake.base_url,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        close_telegram_client()
+        self.addCleanup(close_telegram_client)
+
+    def test_sync_calls_reuse_one_client(self):
+        client = get_telegram_client()
+
+        send_telegram_message("First")
+        sent = send_telegram_messages(["Second", "Third"])
+
+        self.assertEqual(sent, 2)
+        self.assertIs(get_telegram_client(), client)
+        self.assertEqual(
+            [text for _, text in self.fake.messages], ["First", "Second", "Third"]
+        )
+        self.assertEqual(self.fake.connections, 1)
+
+    def test_batches_are_given_up_after_the_deadline(self):
+        self.fake.latency = 0.5
+
+        with override_settings(TELEGRAM_BATCH_TIMEOUT=0.1):
+            started = time.monotonic()
+            sent = send_telegram_messages(["First", "Second"])
+
+        self.assertEqual(sent, 0)
+        self.assertLess(time.monotonic() - started, 0.4)